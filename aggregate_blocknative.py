@@ -1,14 +1,20 @@
-
-import pandas as pd
 import os
-from sqlalchemy import create_engine
-import matplotlib.pyplot as plt
-import matplotlib.dates as mdates
-from sqlalchemy import create_engine, Column, Integer, MetaData, Table, select
+import time
+import argparse
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine, text
 from sqlalchemy import Column, Table, MetaData, TIMESTAMP, VARCHAR, NUMERIC, INTEGER, BIGINT, Index
 
 import logging
 
+# Aggregates the transactions table per block into blocknative_blocks, inside Postgres: one
+# set-based statement per range of detect dates groups the transactions by curblocknumber,
+# so no transaction row leaves the database.
+#
+# Usage: python aggregate_blocknative.py                      (the dates not aggregated yet, and the provisional ones)
+#        python aggregate_blocknative.py --full               (every date again)
+#        python aggregate_blocknative.py --start-date 2022-08-01 --end-date 2022-10-31 --days 7 --workers 8
+
 # Create the logs directory if it does not exist
 log_directory = "logs"
 if not os.path.exists(log_directory):
@@ -32,6 +38,10 @@ transactions_table_name = 'transactions'
 engine = create_engine(f"postgresql://{db_params['user']}:{db_params['password']}@{db_params['host']}:{db_params['port']}/{db_params['database']}")
 blocknative_byblock_table_name = 'blocknative_blocks'
 
+# Detect dates per statement, and parallel workers per statement
+DEFAULT_RANGE_DAYS = int(os.getenv('AGGREGATE_RANGE_DAYS', 7))
+DEFAULT_PARALLEL_WORKERS = int(os.getenv('AGGREGATE_PARALLEL_WORKERS', 4))
+
 # Define the metadata context
 metadata = MetaData()
 # Define the table structure with curblocknumber as the primary key
@@ -47,76 +57,144 @@ block_table = Table(blocknative_byblock_table_name, metadata,
                     Column('public_gasused_gwei', NUMERIC),
                     extend_existing=True)
 
-# Create the table in the database
-metadata.create_all(engine)
-
-# Fetch distinct detect dates from the database
-date_query = "SELECT DISTINCT detect_date FROM transactions ORDER BY detect_date ASC"
-detect_dates = pd.read_sql(date_query, engine)['detect_date']
-total_dates = len(detect_dates)
-print(f"Total days to process: {total_dates}")
-
-print("Start processing...")
-
-# Process each detect date
-for i, detect_date in enumerate(detect_dates, start=1):
-    try:
-        # Fetch transactions for the current detect date
-        transactions_query = f"""
-        SELECT curblocknumber, detect_date, timepending, gasused FROM transactions
-        WHERE detect_date = '{detect_date}'
-        """
-        df = pd.read_sql(transactions_query, engine)
-        df = df.dropna(subset=['timepending'])
-        
-        # Apply the scaling factor to the 'gasused' column
-        df['gasused'] *= 1e-9  # Scale gas used from wei to Gwei
-
-        # Group by 'curblocknumber'
-        grouped = df.groupby('curblocknumber')
-        block_data = []
-        for curblocknumber, group in grouped:
-            tx_count = len(group)
-            public_tx_count = group[group['timepending'] != 0].shape[0]
-            private_tx_count = tx_count - public_tx_count
-            gasused = group['gasused'].sum()
-            private_gasused = group[group['timepending'] == 0]['gasused'].sum()
-            public_gasused = group[group['timepending'] != 0]['gasused'].sum()
-            
-            # Prepare the data row for the detect date and curblocknumber
-            block_data.append({
-                'block_number': curblocknumber,
-                'block_date': detect_date,
-                'tx_count': tx_count,
-                'private_tx_count': private_tx_count,
-                'public_tx_count': public_tx_count,
-                'gasused_gwei': gasused,
-                'private_gasused_gwei': private_gasused,
-                'public_gasused_gwei': public_gasused
-            })
-
-        # Insert the batch of data into the database
-        if block_data:
-            pd.DataFrame(block_data).to_sql(blocknative_byblock_table_name, con=engine, if_exists='append', index=False)
-        
-        # Log progress
-        percentage_complete = (i / total_dates) * 100
-        logging.info(f"Processed date {detect_date} ({i}/{total_dates}, {percentage_complete:.2f}% complete)")
-
-    except Exception as e:
-        logging.error(f"Failed to process transactions for date {detect_date}: {e}")
-
-
-print("--------PART 2: MERGE WITH ZEROMEV_DATA: DO IT IN A SEPARATE SHEET-------- ")
-
-
-# # Read the zeromev_data_backup table into a DataFrame
-# zeromev_data_df = pd.read_sql_table(zeromev_table_name, engine)
-
-# # Merge the DataFrames on the respective block number columns
-# merged_df = pd.merge(zeromev_data_df, block_data_df, left_on='block_number', right_on='curblocknumber')
-
-# # Writing the merged DataFrame to a new table in the database
-# merged_df.to_sql('zeromev_with_blocknative', engine, if_exists='replace', index=False)
-
-# print("Data merged and new table 'zeromev_with_blocknative' created in the database.")
\ No newline at end of file
+block_columns = [column.name for column in block_table.columns]
+
+# A transaction is private if it was never seen pending (timepending = 0); transactions without
+# timepending are left out. gasused is scaled from wei to Gwei.
+#
+# A block belongs to the first detect date its transactions were seen on, and those can spill
+# over into the next date, so the scan reaches one date past the range on each side (:lower,
+# :upper) and keeps the blocks whose first date is inside it (:first, :last).
+AGGREGATE_SQL = f"""
+    SELECT curblocknumber AS block_number,
+           MIN(detect_date) AS block_date,
+           COUNT(*) AS tx_count,
+           COUNT(*) FILTER (WHERE timepending = 0) AS private_tx_count,
+           COUNT(*) FILTER (WHERE timepending <> 0) AS public_tx_count,
+           COALESCE(SUM(gasused), 0) * 1e-9 AS gasused_gwei,
+           COALESCE(SUM(gasused) FILTER (WHERE timepending = 0), 0) * 1e-9 AS private_gasused_gwei,
+           COALESCE(SUM(gasused) FILTER (WHERE timepending <> 0), 0) * 1e-9 AS public_gasused_gwei
+    FROM {transactions_table_name}
+    WHERE detect_date BETWEEN :lower AND :upper
+      AND timepending IS NOT NULL AND curblocknumber IS NOT NULL
+    GROUP BY curblocknumber
+    HAVING MIN(detect_date) BETWEEN :first AND :last
+"""
+
+
+def detect_dates(connection):
+    """The detect dates of the transactions table, in order."""
+    return [row[0] for row in connection.execute(text(
+        f"SELECT DISTINCT detect_date FROM {transactions_table_name} ORDER BY detect_date ASC"))]
+
+
+def aggregated_dates(connection):
+    return {row[0] for row in connection.execute(text(f"SELECT DISTINCT block_date FROM {blocknative_byblock_table_name}"))}
+
+
+def provisional_dates(all_dates, done, new_dates):
+    """
+    Aggregated dates to aggregate again: the last detect date, whose transactions may still be
+    coming in, and the dates just before it or before a new date, since their blocks spill
+    over into the next date.
+    """
+    changing = set(new_dates) | set(all_dates[-1:])
+    dates = set(all_dates[-1:])
+    for date in done:
+        next_date = (datetime.strptime(date, '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d')
+        if next_date in changing:
+            dates.add(date)
+    return dates & set(done)
+
+
+def date_ranges(dates, all_dates, days):
+    """
+    (lower, first, last, upper) per run of up to `days` consecutive dates of `dates`, where lower
+    and upper are the dates of all_dates just outside [first, last] (or first and last at the ends).
+    """
+    positions = {date: position for position, date in enumerate(all_dates)}
+    ranges = []
+    for date in dates:
+        position = positions[date]
+        if ranges and positions[ranges[-1][-1]] == position - 1 and len(ranges[-1]) < days:
+            ranges[-1].append(date)
+        else:
+            ranges.append([date])
+    result = []
+    for run in ranges:
+        first, last = positions[run[0]], positions[run[-1]]
+        result.append((all_dates[max(first - 1, 0)], run[0], run[-1], all_dates[min(last + 1, len(all_dates) - 1)]))
+    return result
+
+
+def aggregate_range(lower, first, last, upper, workers):
+    """
+    Aggregate the blocks of the detect dates first..last into blocknative_blocks, replacing
+    their rows if they exist. Returns the number of blocks written.
+
+    INSERT ... SELECT never gets a parallel plan, CREATE TABLE ... AS does, so the aggregate
+    goes through a temporary table that is dropped at commit.
+    """
+    params = {'lower': lower, 'first': first, 'last': last, 'upper': upper}
+    columns = ', '.join(block_columns)
+    updates = ', '.join(f"{column} = EXCLUDED.{column}" for column in block_columns if column != 'block_number')
+    with engine.begin() as connection:
+        connection.execute(text(f"SET LOCAL max_parallel_workers_per_gather = {int(workers)}"))
+        connection.execute(text(f"CREATE TEMP TABLE blocknative_blocks_range ON COMMIT DROP AS {AGGREGATE_SQL}"), params)
+        result = connection.execute(text(f"""
+            INSERT INTO {blocknative_byblock_table_name} ({columns})
+            SELECT {columns} FROM blocknative_blocks_range
+            ON CONFLICT (block_number) DO UPDATE SET {updates}
+        """))
+        return result.rowcount
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Aggregate the transactions table per block into blocknative_blocks.")
+    parser.add_argument('--start-date', help="First detect date, YYYY-MM-DD")
+    parser.add_argument('--end-date', help="Last detect date, YYYY-MM-DD")
+    parser.add_argument('--full', action='store_true', help="Aggregate dates that are in blocknative_blocks already, too")
+    parser.add_argument('--days', type=int, default=DEFAULT_RANGE_DAYS, help="Detect dates per statement")
+    parser.add_argument('--workers', type=int, default=DEFAULT_PARALLEL_WORKERS,
+                        help="max_parallel_workers_per_gather for the aggregation")
+    args = parser.parse_args()
+
+    # Create the table in the database
+    metadata.create_all(engine)
+
+    # Fetch distinct detect dates from the database
+    with engine.connect() as connection:
+        all_dates = detect_dates(connection)
+        dates = [date for date in all_dates
+                 if (args.start_date is None or date >= args.start_date) and (args.end_date is None or date <= args.end_date)]
+        if not args.full:
+            done = aggregated_dates(connection)
+            again = provisional_dates(all_dates, done, [date for date in dates if date not in done])
+            dates = [date for date in dates if date not in done or date in again]
+            if again:
+                logging.info(f"Aggregating {', '.join(sorted(again))} again")
+    ranges = date_ranges(dates, all_dates, args.days)
+    print(f"Total days to process: {len(dates)} in {len(ranges)} ranges")
+    logging.info(f"Aggregating {len(dates)} detect dates in {len(ranges)} ranges of up to {args.days} days, {args.workers} workers")
+
+    start_time = time.time()
+    processed = 0
+    for i, (lower, first, last, upper) in enumerate(ranges, start=1):
+        try:
+            range_start = time.time()
+            blocks = aggregate_range(lower, first, last, upper, args.workers)
+            processed += sum(1 for date in dates if first <= date <= last)
+            # Log progress
+            percentage_complete = (processed / len(dates)) * 100
+            logging.info(f"Processed dates {first} to {last}: {blocks} blocks in {time.time() - range_start:.1f}s "
+                         f"({i}/{len(ranges)} ranges, {percentage_complete:.2f}% complete)")
+        except Exception as e:
+            logging.error(f"Failed to aggregate transactions for dates {first} to {last}: {e}")
+
+    logging.info(f"Aggregated {processed} detect dates in {time.time() - start_time:.1f}s")
+    print(f"Done in {time.time() - start_time:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
+
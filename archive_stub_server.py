@@ -0,0 +1,130 @@
+import os
+import re
+import gzip
+import hashlib
+import random
+import asyncio
+import logging
+import argparse
+from aiohttp import web
+from blocknative_reader import BLOCKNATIVE_COLUMNS
+
+# Local stand-in for archive.blocknative.com, to measure download_slices.py and exercise its
+# retries offline. Every /YYYYMMDD/HH.csv.gz returns the same synthetic slice (or a real one
+# given with --slice), with optional throttling and injected failures.
+#
+# Usage: python archive_stub_server.py --port 8080 --error-rate 0.1 --drop-rate 0.1
+#        python download_slices.py one_hour_dates.txt --base-url http://localhost:8080/
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+SEND_CHUNK_BYTES = 64 * 1024
+
+
+def synthetic_slice(rows, seed=0):
+    """A gzipped slice in the archive format: 27 tab-separated fields with a header line."""
+    rng = random.Random(seed)
+    lines = ['\t'.join(BLOCKNATIVE_COLUMNS)]
+    for i in range(rows):
+        row = dict.fromkeys(BLOCKNATIVE_COLUMNS, '')
+        row.update(detecttime=f'2021-04-23T18:{i % 60:02d}:00.000Z', hash='0x%064x' % rng.getrandbits(256),
+                   status=rng.choice(['confirmed', 'pending', 'failed']), region=rng.choice(['us-east-1', 'eu-central-1']),
+                   reorg='""', replace='""', curblocknumber=str(12298048 + i // 200), blockspending=str(rng.randint(0, 3)),
+                   timepending=str(rng.choice([0, 500, 11224])), nonce=str(rng.randint(0, 999)), gas='196735',
+                   gasprice='74000000000', value=str(rng.randint(0, 10 ** 21)), toaddress='0x7a25', fromaddress='0xd220',
+                   input='0x' + 'ab' * rng.randint(0, 2000), network='main', type='2',
+                   maxpriorityfeepergas='1000000000', stuck='false', gasused=str(rng.randint(21000, 300000)),
+                   detect_date='2021-04-23')
+        lines.append('\t'.join(row[column] for column in BLOCKNATIVE_COLUMNS))
+    return gzip.compress(('\n'.join(lines) + '\n').encode(), compresslevel=6)
+
+
+class ArchiveStub:
+    def __init__(self, body, error_rate, drop_rate, missing_rate, bytes_per_second, latency):
+        self.body = body
+        self.etag = f'"{hashlib.md5(body).hexdigest()}"'
+        self.error_rate = error_rate
+        self.drop_rate = drop_rate
+        self.missing_rate = missing_rate
+        self.bytes_per_second = bytes_per_second
+        self.latency = latency
+        self.stats = {'requests': 0, 'errors': 0, 'drops': 0, 'ranges': 0}
+
+    async def handle_slice(self, request):
+        self.stats['requests'] += 1
+        await asyncio.sleep(self.latency)
+        date = request.match_info['date']
+        # The same date is always missing, like a real gap in the archive
+        if random.Random(date).random() < self.missing_rate:
+            raise web.HTTPNotFound()
+        if random.random() < self.error_rate:
+            self.stats['errors'] += 1
+            status = random.choice([429, 504])
+            headers = {'Retry-After': '1'} if status == 429 else {}
+            return web.Response(status=status, headers=headers)
+
+        start = 0
+        match = re.match(r'^bytes=(\d+)-$', request.headers.get('Range', ''))
+        if match:
+            start = int(match.group(1))
+            if start >= len(self.body):
+                return web.Response(status=416, headers={'Content-Range': f'bytes */{len(self.body)}'})
+            self.stats['ranges'] += 1
+        response = web.StreamResponse(status=206 if match else 200)
+        response.content_length = len(self.body) - start
+        response.headers['Accept-Ranges'] = 'bytes'
+        response.headers['ETag'] = self.etag
+        if match:
+            response.headers['Content-Range'] = f'bytes {start}-{len(self.body) - 1}/{len(self.body)}'
+        await response.prepare(request)
+        if request.method == 'HEAD':
+            return response
+
+        # Drop some connections halfway, so that resuming with Range gets exercised
+        end = len(self.body)
+        if random.random() < self.drop_rate:
+            self.stats['drops'] += 1
+            end = start + (end - start) // 2
+        for offset in range(start, end, SEND_CHUNK_BYTES):
+            chunk = self.body[offset:min(offset + SEND_CHUNK_BYTES, end)]
+            await response.write(chunk)
+            if self.bytes_per_second:
+                await asyncio.sleep(len(chunk) / self.bytes_per_second)
+        if end < len(self.body):
+            request.transport.close()
+            return response
+        await response.write_eof()
+        return response
+
+    async def handle_stats(self, request):
+        return web.json_response(self.stats)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the Blocknative archive.")
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--slice', help="Serve this .csv.gz for every request instead of a synthetic slice")
+    parser.add_argument('--rows', type=int, default=50000, help="Rows of the synthetic slice")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Share of requests answered with 429/504")
+    parser.add_argument('--drop-rate', type=float, default=0.0, help="Share of responses cut off halfway")
+    parser.add_argument('--missing-rate', type=float, default=0.0, help="Share of dates answered with 404")
+    parser.add_argument('--bandwidth-mbps', type=float, default=0.0, help="Per-connection throttle in MB/s, 0 for none")
+    parser.add_argument('--latency', type=float, default=0.0, help="Seconds before each response")
+    args = parser.parse_args()
+
+    if args.slice:
+        with open(args.slice, 'rb') as slice_file:
+            body = slice_file.read()
+    else:
+        body = synthetic_slice(args.rows)
+    logging.info(f"Serving a {len(body) / 1e6:.1f} MB slice for every date on port {args.port}")
+
+    stub = ArchiveStub(body, args.error_rate, args.drop_rate, args.missing_rate, args.bandwidth_mbps * 1e6, args.latency)
+    app = web.Application()
+    app.router.add_get(r'/{date:\d{8}}/{hour:\d{2}}.csv.gz', stub.handle_slice)
+    app.router.add_get('/stats', stub.handle_stats)
+    web.run_app(app, port=args.port)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+import os
+import sys
+import time
+import resource
+import argparse
+import multiprocessing
+import pandas as pd
+from blocknative_reader import read_slice, filter_confirmed_mainnet, TRANSACTIONS_COLUMNS, TRANSACTIONS_SMALL_COLUMNS
+
+# Benchmark for the Blocknative slice reader. Every (slice, reader) pair runs in a fresh
+# process so that the reported peak RSS belongs to that reader only.
+#
+# Usage: python benchmark_reader.py data/20210423/18.csv.gz data/20210601/18.csv.gz --columns small
+
+SINK_COLUMNS = {
+    'full': TRANSACTIONS_COLUMNS,
+    'small': TRANSACTIONS_SMALL_COLUMNS,
+}
+
+
+def read_legacy(path, columns):
+    """The File.load_data path before column projection: parse everything, filter, then drop."""
+    data = pd.read_csv(path, sep='\t', compression='gzip', on_bad_lines='warn')
+    data = filter_confirmed_mainnet(data)
+    data = data.drop(columns=[column for column in data.columns if column not in columns])
+    return len(data)
+
+
+def read_projected(path, columns):
+    """Column-projected, dtype-pinned, chunked reader."""
+    return sum(len(chunk) for chunk in read_slice(path, columns))
+
+
+READERS = {
+    'legacy': read_legacy,
+    'projected': read_projected,
+}
+
+
+def run_reader(reader_name, path, columns, results):
+    baseline_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start_time = time.perf_counter()
+    rows = READERS[reader_name](path, columns)
+    elapsed = time.perf_counter() - start_time
+    peak_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results.put((rows, elapsed, baseline_rss_kb / 1024, peak_rss_kb / 1024))
+
+
+def benchmark(path, columns):
+    context = multiprocessing.get_context('spawn')
+    rows_by_reader = {}
+    for reader_name in READERS:
+        results = context.Queue()
+        process = context.Process(target=run_reader, args=(reader_name, path, columns, results))
+        process.start()
+        process.join()
+        if process.exitcode != 0:
+            print(f"{path}  {reader_name:<10} failed with exit code {process.exitcode}")
+            continue
+        rows, elapsed, baseline_mb, peak_mb = results.get()
+        rows_by_reader[reader_name] = rows
+        print(f"{os.path.basename(os.path.dirname(path))}/{os.path.basename(path)}  {reader_name:<10} "
+              f"rows={rows:<8} parse={elapsed:7.2f}s  peak_rss={peak_mb:8.1f} MB  (+{peak_mb - baseline_mb:.1f} MB over import)")
+
+    if len(set(rows_by_reader.values())) != 1:
+        print(f"WARNING: readers disagree on row count for {path}: {rows_by_reader}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare peak RSS and parse time of the Blocknative slice readers.")
+    parser.add_argument('paths', nargs='+', help="csv.gz slices to read")
+    parser.add_argument('--columns', choices=SINK_COLUMNS.keys(), default='full',
+                        help="sink projection: 'full' for watchdog_v2, 'small' for watchdog_small")
+    args = parser.parse_args()
+
+    file_size_mb = sum(os.path.getsize(path) for path in args.paths) / 1e6
+    print(f"Benchmarking {len(args.paths)} slice(s), {file_size_mb:.1f} MB compressed, '{args.columns}' projection")
+    for path in args.paths:
+        benchmark(path, SINK_COLUMNS[args.columns])
+
+
+if __name__ == '__main__':
+    sys.exit(main())
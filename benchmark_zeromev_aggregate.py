@@ -0,0 +1,195 @@
+import sys
+import json
+import time
+import random
+import argparse
+import numpy as np
+import pandas as pd
+from zeromev_stub_server import synthetic_block, MEV_TYPES, PROTOCOLS
+from zeromev_facts import mev_facts, wide_column_names, WIDE_PROTOCOLS, WIDE_MEV_TYPES
+
+# Checks the zeromev facts (zeromev_facts.mev_facts, pivoted into the zeromev_data columns)
+# against the item-by-item implementation they replaced, on random mevBlock responses
+# (including the odd ones: empty responses, missing protocols, null or missing amounts,
+# unsorted items), and times both on realistic responses.
+#
+# Usage: python benchmark_zeromev_aggregate.py --cases 2000 --blocks 100
+
+
+def aggregate_legacy(data):
+    """The item-by-item aggregation of zeromev.py's former get_mev_tx_info."""
+    transaction_counts = {}
+    financial_aggregates = {}
+    protocol_counts = {}
+    block_volumes = {}
+
+    for item in data:
+        mev_type = item['mev_type']
+        block_number = item['block_number']
+        protocol = item.get('protocol', 'unknown')
+
+        if mev_type not in transaction_counts:
+            transaction_counts[mev_type] = {}
+        if block_number in transaction_counts[mev_type]:
+            transaction_counts[mev_type][block_number] += 1
+        else:
+            transaction_counts[mev_type][block_number] = 1
+
+        if protocol not in protocol_counts:
+            protocol_counts[protocol] = {}
+        if block_number in protocol_counts[protocol]:
+            protocol_counts[protocol][block_number] += 1
+        else:
+            protocol_counts[protocol][block_number] = 1
+
+        if block_number not in financial_aggregates:
+            financial_aggregates[block_number] = {}
+            block_volumes[block_number] = {'total_extractor_profit': 0, 'total_user_swap_volume': 0}
+        if f"{mev_type}_user_swap_volume" not in financial_aggregates[block_number]:
+            financial_aggregates[block_number][f"{mev_type}_user_swap_volume"] = 0
+        if f"{mev_type}_extractor_profit" not in financial_aggregates[block_number]:
+            financial_aggregates[block_number][f"{mev_type}_extractor_profit"] = 0
+
+        user_volume = item.get('user_swap_volume_usd', 0) or 0
+        extractor_profit = item.get('extractor_profit_usd', 0) or 0
+        financial_aggregates[block_number][f"{mev_type}_user_swap_volume"] += item.get('user_swap_volume_usd', 0) or 0
+        financial_aggregates[block_number][f"{mev_type}_extractor_profit"] += item.get('extractor_profit_usd', 0) or 0
+
+        block_volumes[block_number]['total_user_swap_volume'] += user_volume
+        block_volumes[block_number]['total_extractor_profit'] += extractor_profit
+
+    all_transactions = []
+    for block_number in set(k for dic in transaction_counts.values() for k in dic):
+        transaction_record = {'block_number': block_number}
+        for mev_type, counts in transaction_counts.items():
+            if block_number in counts:
+                transaction_record[f"{mev_type}_count"] = counts[block_number]
+                transaction_record.update(financial_aggregates[block_number])
+        for protocol, counts in protocol_counts.items():
+            if block_number in counts:
+                transaction_record[f"{protocol}_count"] = counts[block_number]
+        transaction_record.update(block_volumes[block_number])
+
+        all_transactions.append(transaction_record)
+
+    df = pd.DataFrame(all_transactions)
+    if not df.empty:
+        df = df.groupby('block_number').sum().reset_index()
+    return df
+
+
+def wide_rows(facts):
+    """
+    The zeromev_data rows of a mev_facts frame, pivoted in pandas the way wide_columns_sql
+    pivots zeromev_facts: every wide column, 0 where a block has no such mev_type or protocol.
+    """
+    if facts.empty:
+        return pd.DataFrame(columns=wide_column_names())
+    blocks = facts.groupby('block_number')
+    wide = pd.DataFrame({'total_user_swap_volume': blocks['user_swap_volume'].sum(),
+                         'total_extractor_profit': blocks['extractor_profit'].sum()})
+    protocol_counts = facts.groupby(['block_number', 'protocol'])['tx_count'].sum().unstack()
+    for protocol in WIDE_PROTOCOLS:
+        wide[f"{protocol}_count"] = protocol_counts.get(protocol, 0)
+    by_type = facts.groupby(['block_number', 'mev_type'])[['extractor_profit', 'user_swap_volume', 'tx_count']].sum().unstack()
+    for measure, suffix in (('extractor_profit', 'extractor_profit'), ('user_swap_volume', 'user_swap_volume'), ('tx_count', 'count')):
+        for mev_type in WIDE_MEV_TYPES:
+            wide[f"{mev_type}_{suffix}"] = by_type[measure].get(mev_type, 0)
+    return wide.fillna(0).reset_index()[wide_column_names()]
+
+
+def aggregate_facts(data):
+    """What zeromev.py stores for a response, as zeromev_data rows."""
+    return wide_rows(mev_facts(data))
+
+
+def random_amount(rng):
+    """Amounts as the API sends them: mostly floats, sometimes integers, null or left out."""
+    kind = rng.random()
+    if kind < 0.1:
+        return None
+    if kind < 0.15:
+        return rng.randint(0, 1000)
+    if kind < 0.2:
+        return 'missing'
+    return round(rng.lognormvariate(5, 3) * rng.choice([1, 1, 1, -1]), 6)
+
+
+def random_response(rng):
+    """A random mevBlock response. Null protocols are left out: the old code wrote them as a 'None_count' column."""
+    start_block = rng.randint(11_000_000, 19_500_000)
+    blocks = rng.randint(1, 30)
+    mev_types = rng.sample(sorted(set(MEV_TYPES)), rng.randint(1, len(set(MEV_TYPES))))
+    protocols = rng.sample(PROTOCOLS, rng.randint(1, len(PROTOCOLS)))
+    items = []
+    for _ in range(rng.choice([0, 1, 5, 50, 300])):
+        item = {'block_number': start_block + rng.randrange(blocks), 'mev_type': rng.choice(mev_types)}
+        if rng.random() > 0.1:
+            item['protocol'] = rng.choice(protocols)
+        for field in ('user_swap_volume_usd', 'extractor_profit_usd'):
+            amount = random_amount(rng)
+            if amount != 'missing':
+                item[field] = amount
+        items.append(item)
+    if rng.random() < 0.5:
+        items.sort(key=lambda item: item['block_number'])
+    return items
+
+
+def same_result(expected, actual):
+    """
+    Same blocks, and the same values up to floating point summation order. The legacy frame
+    only has the columns of the mev types and protocols that occur; the others are 0.
+    """
+    if expected.empty or actual.empty:
+        return expected.empty and actual.empty
+    if not set(expected.columns) <= set(actual.columns):
+        return False
+    expected = expected.reindex(columns=actual.columns, fill_value=0)
+    expected = expected.sort_values('block_number').reset_index(drop=True)
+    actual = actual.sort_values('block_number').reset_index(drop=True)[expected.columns]
+    if len(expected) != len(actual):
+        return False
+    return all(np.allclose(expected[column].astype(float), actual[column].astype(float), rtol=1e-9, atol=1e-9)
+               for column in expected.columns)
+
+
+def check(cases, seed):
+    rng = random.Random(seed)
+    for case in range(cases):
+        data = random_response(rng)
+        if not same_result(aggregate_legacy(data), aggregate_facts(data)):
+            print(f"Case {case} (seed {seed}) differs:\n{json.dumps(data)[:2000]}")
+            return False
+    print(f"{cases} random responses: the pivoted facts match the old implementation")
+    return True
+
+
+def benchmark(blocks, requests):
+    bodies = [json.dumps([item for number in range(start, start + blocks) for item in synthetic_block(number)])
+              for start in range(19_220_986, 19_220_986 + blocks * requests, blocks)]
+    items = sum(len(json.loads(body)) for body in bodies)
+    print(f"{requests} responses of {blocks} blocks, {items / requests:.0f} items per response on average")
+    for name, aggregate in (('legacy', aggregate_legacy), ('facts', mev_facts), ('facts+pivot', aggregate_facts)):
+        start_time = time.perf_counter()
+        for body in bodies:
+            aggregate(json.loads(body))
+        elapsed = time.perf_counter() - start_time
+        print(f"  {name:<11} {1000 * elapsed / requests:6.2f} ms per response (including json.loads)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check and time the zeromev response aggregation.")
+    parser.add_argument('--cases', type=int, default=1000, help="Random responses to compare")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--blocks', type=int, default=100, help="Blocks per response for the timing")
+    parser.add_argument('--requests', type=int, default=200, help="Responses for the timing")
+    args = parser.parse_args()
+
+    ok = check(args.cases, args.seed)
+    benchmark(args.blocks, args.requests)
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,147 @@
+import time
+import logging
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pv
+
+# Full Blocknative mempool archive schema, in file order (27 fields).
+BLOCKNATIVE_COLUMNS = [
+    'detecttime', 'hash', 'status', 'region', 'reorg', 'replace', 'curblocknumber',
+    'failurereason', 'blockspending', 'timepending', 'nonce', 'gas', 'gasprice',
+    'value', 'toaddress', 'fromaddress', 'input', 'network', 'type',
+    'maxpriorityfeepergas', 'maxfeepergas', 'basefeepergas', 'dropreason',
+    'rejectionreason', 'stuck', 'gasused', 'detect_date'
+]
+
+# Pinned column types so that nothing has to be inferred (pandas used to re-read
+# 'reorg' because of mixed types). 'value' stays a string since it is NUMERIC(38)
+# in the database and wei amounts do not fit into int64/float64 exactly.
+CATEGORY = pa.dictionary(pa.int32(), pa.string())
+BLOCKNATIVE_TYPES = {
+    'detecttime': pa.string(),
+    'hash': pa.string(),
+    'status': CATEGORY,
+    'region': CATEGORY,
+    'reorg': pa.string(),
+    'replace': pa.string(),
+    'curblocknumber': pa.int64(),
+    'failurereason': pa.string(),
+    'blockspending': pa.int64(),
+    'timepending': pa.int64(),
+    'nonce': pa.int64(),
+    'gas': pa.float64(),
+    'gasprice': pa.float64(),
+    'value': pa.string(),
+    'toaddress': pa.string(),
+    'fromaddress': pa.string(),
+    'input': pa.string(),
+    'network': CATEGORY,
+    'type': pa.int64(),
+    'maxpriorityfeepergas': pa.float64(),
+    'maxfeepergas': pa.float64(),
+    'basefeepergas': pa.float64(),
+    'dropreason': pa.string(),
+    'rejectionreason': pa.string(),
+    'stuck': pa.string(),
+    'gasused': pa.float64(),
+    'detect_date': pa.string(),
+}
+
+# Columns needed to decide whether a row is kept; they are never written to a sink.
+FILTER_COLUMNS = ['status', 'region', 'network']
+
+# Columns of the 'transactions' table created by watchdog_v2.py
+TRANSACTIONS_COLUMNS = [
+    'detecttime', 'hash', 'reorg', 'replace', 'curblocknumber', 'blockspending',
+    'timepending', 'nonce', 'gas', 'gasprice', 'value', 'toaddress', 'fromaddress',
+    'input', 'type', 'maxpriorityfeepergas', 'maxfeepergas', 'basefeepergas',
+    'dropreason', 'rejectionreason', 'stuck', 'gasused', 'detect_date'
+]
+
+# Columns of the reduced 'transactions' table created by watchdog_small.py
+TRANSACTIONS_SMALL_COLUMNS = [
+    'detecttime', 'hash', 'curblocknumber', 'blockspending', 'timepending',
+    'gasprice', 'gasused', 'nonce', 'detect_date'
+]
+
+# Decompressed bytes parsed per chunk, which bounds the memory used for one slice.
+DEFAULT_BLOCK_BYTES = 4 * 1024 * 1024
+
+
+def filter_confirmed_mainnet(chunk):
+    """Keep confirmed mainnet transactions seen from the us-east-1 region."""
+    return chunk[(chunk['status'] == 'confirmed') & (chunk['region'] == 'us-east-1') & (chunk['network'] == 'main')]
+
+
+def _filter_batch(batch):
+    """Arrow version of filter_confirmed_mainnet, applied before converting to pandas."""
+    mask = pc.and_(pc.and_(pc.equal(batch.column('status'), 'confirmed'),
+                           pc.equal(batch.column('region'), 'us-east-1')),
+                   pc.equal(batch.column('network'), 'main'))
+    return batch.filter(mask)
+
+
+def _to_pandas(batch):
+    # Keep integer columns as nullable Int64 instead of letting missing values turn them into floats
+    return batch.to_pandas(types_mapper={pa.int64(): pd.Int64Dtype()}.get)
+
+
+def _skip_bad_line(row):
+    logging.warning(f"Skipping line {row.number}: expected {row.expected_columns} fields, saw {row.actual_columns}")
+    return 'skip'
+
+
+def _open_reader(source, wanted, block_size, invalid_row_handler, column_names=None):
+    return pv.open_csv(
+        source,
+        read_options=pv.ReadOptions(block_size=block_size, column_names=column_names),
+        parse_options=pv.ParseOptions(delimiter='\t', invalid_row_handler=invalid_row_handler),
+        convert_options=pv.ConvertOptions(include_columns=wanted, include_missing_columns=True,
+                                          column_types={column: BLOCKNATIVE_TYPES[column] for column in wanted},
+                                          strings_can_be_null=True))
+
+
+def _read_batches(reader, columns, metrics=None):
+    batches = iter(reader)
+    try:
+        while True:
+            start_time = time.perf_counter()
+            batch = next(batches, None)
+            parsed_time = time.perf_counter()
+            if batch is None:
+                break
+            chunk = _to_pandas(_filter_batch(batch)).reindex(columns=columns)
+            if metrics is not None:
+                metrics.add_time('parse', parsed_time - start_time)
+                metrics.add_time('filter', time.perf_counter() - parsed_time)
+                metrics.count('rows_in', batch.num_rows)
+                metrics.count('rows_out', len(chunk))
+            yield chunk
+    finally:
+        reader.close()
+
+
+def read_slice(source, columns, block_size=DEFAULT_BLOCK_BYTES, quarantine=None, metrics=None):
+    """
+    Stream one Blocknative slice as filtered pandas chunks containing exactly `columns`.
+
+    `source` is a path (.csv.gz is decompressed on the fly) or a binary file object.
+    Only the requested columns plus the filter columns are converted, with pinned
+    types, and the confirmed/us-east-1/main predicate is applied to every chunk so
+    the raw slice is never materialised. Columns missing from older archive files
+    (e.g. 'dropreason' or 'gasused') come back empty. Lines with the wrong number
+    of fields are skipped and logged, as pandas' on_bad_lines='warn' did, unless a
+    SliceQuarantine is given: then they are handed to it, and the lines it repaired
+    are parsed and yielded as one more chunk at the end. Parse and filter times and
+    the row counts before and after the filter are added to `metrics` (SliceMetrics).
+    """
+    wanted = list(dict.fromkeys(list(columns) + FILTER_COLUMNS))
+    handler = quarantine.handle_invalid_row if quarantine is not None else _skip_bad_line
+    yield from _read_batches(_open_reader(source, wanted, block_size, handler), columns, metrics)
+
+    repaired = quarantine.take_repaired_lines() if quarantine is not None else b''
+    if repaired:
+        # Repaired lines always have the full schema, and come without a header
+        yield from _read_batches(_open_reader(pa.BufferReader(repaired), wanted, block_size, _skip_bad_line,
+                                              column_names=BLOCKNATIVE_COLUMNS), columns, metrics)
@@ -0,0 +1,296 @@
+import io
+import os
+import time
+import logging
+import pandas as pd
+
+# Upper bound for the in-memory size of a single COPY payload. Batches are cut by
+# bytes instead of rows because a Blocknative row with calldata can be 100x bigger
+# than one without it.
+DEFAULT_MAX_BATCH_BYTES = 64 * 1024 * 1024
+
+# Size of the reads COPY issues against the CSV stream
+COPY_READ_SIZE = 1024 * 1024
+
+# Floats above this cannot round-trip through int64 without losing precision
+# (wei values in 'value' or 'gasprice'), so they are left as floats.
+MAX_EXACT_FLOAT_INT = 2 ** 53
+
+
+# What happens to a staged row whose key is already in the target table:
+# 'nothing' keeps the row that was loaded first, 'update' overwrites it with the new one.
+CONFLICT_POLICIES = ('nothing', 'update')
+DEFAULT_CONFLICT_POLICY = os.getenv('CONFLICT_POLICY', 'nothing')
+
+
+def frame_nbytes(df):
+    """Approximate in-memory size of a DataFrame, including string payloads."""
+    if df is None or df.empty:
+        return 0
+    return int(df.memory_usage(index=False, deep=True).sum())
+
+
+def _prepare_for_copy(df):
+    """
+    Make the text representation of a frame acceptable to COPY.
+    Integer columns that pandas upcast to float because of missing values would be
+    written as '21000.0', which PostgreSQL rejects for INT/BIGINT targets.
+    """
+    converted = {}
+    for column in df.columns:
+        series = df[column]
+        if not pd.api.types.is_float_dtype(series):
+            continue
+        values = series.dropna()
+        if values.empty:
+            continue
+        if (values % 1 == 0).all() and values.abs().max() < MAX_EXACT_FLOAT_INT:
+            converted[column] = series.astype('Int64')
+    if converted:
+        df = df.assign(**converted)
+    return df
+
+
+class _CsvFrameStream(io.TextIOBase):
+    """
+    File object that renders frames to CSV one at a time while COPY reads from it,
+    so a batch is never concatenated or rendered as a whole.
+    """
+    def __init__(self, frames):
+        self._frames = iter(frames)
+        self._buffer = ''
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) - self._position < size:
+            frame = next(self._frames, None)
+            if frame is None:
+                break
+            if not frame.empty:
+                self._buffer = self._buffer[self._position:] + _prepare_for_copy(frame).to_csv(index=False, header=False, na_rep='')
+                self._position = 0
+        end = len(self._buffer) if size < 0 else self._position + size
+        data = self._buffer[self._position:end]
+        self._position += len(data)
+        return data
+
+
+def copy_frames(cursor, frames, table_name):
+    """
+    Stream DataFrames with identical columns into an existing table with a single
+    COPY ... FROM STDIN. The caller owns the transaction, so several batches can be
+    copied atomically. Returns the number of rows written.
+    """
+    frames = [frame for frame in frames if frame is not None and not frame.empty]
+    if not frames:
+        return 0
+
+    columns = ', '.join(f'"{column}"' for column in frames[0].columns)
+    cursor.copy_expert(f'COPY {table_name} ({columns}) FROM STDIN WITH (FORMAT csv)',
+                       _CsvFrameStream(frames), size=COPY_READ_SIZE)
+    return sum(len(frame) for frame in frames)
+
+
+def merge_frames(cursor, frames, table_name, key='hash', policy=DEFAULT_CONFLICT_POLICY):
+    """
+    COPY frames into a staging table and merge them into `table_name` with
+    INSERT ... ON CONFLICT (key), so a duplicate key costs one merge statement instead
+    of failing the whole COPY. The staging table is a temporary table, which
+    PostgreSQL never writes to the WAL, and is dropped when the caller commits.
+    Returns (rows_written, conflicts), where conflicts counts the staged rows that did
+    not create a new row (duplicates within the batch or keys already in the table).
+    """
+    if policy not in CONFLICT_POLICIES:
+        raise ValueError(f"Unknown conflict policy '{policy}', expected one of {CONFLICT_POLICIES}")
+    frames = [frame for frame in frames if frame is not None and not frame.empty]
+    if not frames:
+        return 0, 0
+
+    staging_table = f"{table_name}_staging"
+    cursor.execute(f"CREATE TEMP TABLE IF NOT EXISTS {staging_table} (LIKE {table_name} INCLUDING DEFAULTS) ON COMMIT DROP")
+    staged = copy_frames(cursor, frames, staging_table)
+
+    columns = ', '.join(f'"{column}"' for column in frames[0].columns)
+    # ON CONFLICT cannot touch the same row twice in one statement, so duplicates within the batch are dropped first
+    select = f'SELECT DISTINCT ON ("{key}") {columns} FROM {staging_table} ORDER BY "{key}"'
+    if policy == 'nothing':
+        cursor.execute(f'INSERT INTO {table_name} ({columns}) {select} ON CONFLICT ("{key}") DO NOTHING')
+        inserted = written = cursor.rowcount
+    else:
+        updates = ', '.join(f'"{column}" = EXCLUDED."{column}"' for column in frames[0].columns if column != key)
+        # xmax is 0 for freshly inserted rows and set for rows that were updated
+        cursor.execute(f"""
+            WITH merged AS (
+                INSERT INTO {table_name} ({columns}) {select}
+                ON CONFLICT ("{key}") DO UPDATE SET {updates}
+                RETURNING (xmax = 0) AS inserted
+            )
+            SELECT count(*) FILTER (WHERE inserted), count(*) FROM merged
+        """)
+        inserted, written = cursor.fetchone()
+    cursor.execute(f"TRUNCATE {staging_table}")
+
+    conflicts = staged - inserted
+    if conflicts:
+        logging.info(f"Merge into {table_name}: {conflicts} of {staged} rows conflicted on '{key}' (policy '{policy}')")
+    return written, conflicts
+
+
+def copy_frame(cursor, df, table_name):
+    """Single-frame version of copy_frames."""
+    return copy_frames(cursor, [df], table_name)
+
+
+def iter_byte_batches(df, max_batch_bytes=DEFAULT_MAX_BATCH_BYTES):
+    """Split a DataFrame into consecutive row slices of roughly max_batch_bytes each."""
+    total_bytes = frame_nbytes(df)
+    if total_bytes <= max_batch_bytes:
+        yield df
+        return
+
+    rows_per_batch = max(1, int(len(df) * max_batch_bytes / total_bytes))
+    for start in range(0, len(df), rows_per_batch):
+        yield df.iloc[start:start + rows_per_batch]
+
+
+def _log_batch(table_name, rows, batch_bytes, elapsed):
+    logging.info(f"COPY into {table_name}: {rows} rows, {batch_bytes / 1e6:.1f} MB in {elapsed:.2f}s "
+                 f"({rows / max(elapsed, 1e-9):.0f} rows/sec)")
+
+
+def bulk_load_frames(engine, frames, table_name):
+    """Write a list of frames with one COPY in its own transaction. Returns the number of rows written."""
+    frames = [frame for frame in frames if frame is not None and not frame.empty]
+    if not frames:
+        return 0
+
+    connection = engine.raw_connection()
+    try:
+        with connection.cursor() as cursor:
+            start_time = time.perf_counter()
+            rows = copy_frames(cursor, frames, table_name)
+            _log_batch(table_name, rows, sum(frame_nbytes(frame) for frame in frames), time.perf_counter() - start_time)
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        connection.close()
+
+    return rows
+
+
+def bulk_merge_frames(engine, frames, table_name, key='hash', policy=DEFAULT_CONFLICT_POLICY):
+    """Like bulk_load_frames, but merges through a staging table with merge_frames. Returns the number of rows written."""
+    connection = engine.raw_connection()
+    try:
+        with connection.cursor() as cursor:
+            start_time = time.perf_counter()
+            rows, _ = merge_frames(cursor, frames, table_name, key, policy)
+            _log_batch(table_name, rows, sum(frame_nbytes(frame) for frame in frames), time.perf_counter() - start_time)
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        connection.close()
+
+    return rows
+
+
+def bulk_load(engine, df, table_name, max_batch_bytes=DEFAULT_MAX_BATCH_BYTES):
+    """
+    Replacement for DataFrame.to_sql(if_exists='append') that uses COPY instead of
+    parameterised INSERTs. All batches are committed in a single transaction and
+    the throughput of every batch is logged.
+    """
+    if df is None or df.empty:
+        return 0
+
+    total_rows = 0
+    connection = engine.raw_connection()
+    try:
+        with connection.cursor() as cursor:
+            for batch in iter_byte_batches(df, max_batch_bytes):
+                start_time = time.perf_counter()
+                rows = copy_frame(cursor, batch, table_name)
+                _log_batch(table_name, rows, frame_nbytes(batch), time.perf_counter() - start_time)
+                total_rows += rows
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        connection.close()
+
+    return total_rows
+
+
+class BatchBuilder:
+    """
+    Collects frames until a byte or row threshold is reached and then hands the whole
+    list to `sink` (e.g. a copy_frames call), without ever concatenating them.
+    The frames are released as soon as they have been flushed; if the sink raises,
+    they are kept and written again by the next flush.
+    """
+    def __init__(self, sink, max_batch_bytes=DEFAULT_MAX_BATCH_BYTES, max_batch_rows=None):
+        self.sink = sink
+        self.max_batch_bytes = max_batch_bytes
+        self.max_batch_rows = max_batch_rows
+        self.frames = []
+        self.nbytes = 0
+        self.nrows = 0
+        self.rows_written = 0
+        self.write_seconds = 0.0
+
+    def is_full(self):
+        if self.max_batch_rows is not None and self.nrows >= self.max_batch_rows:
+            return True
+        return self.nbytes >= self.max_batch_bytes
+
+    def add(self, df):
+        """Add a frame and flush if a threshold is reached. Returns the number of rows flushed."""
+        if df is None or df.empty:
+            return 0
+        self.frames.append(df)
+        self.nbytes += frame_nbytes(df)
+        self.nrows += len(df)
+        return self.flush() if self.is_full() else 0
+
+    def flush(self):
+        """Write the collected frames. Returns the number of rows written."""
+        if not self.frames:
+            return 0
+        frames, batch_bytes = self.frames, self.nbytes
+
+        start_time = time.perf_counter()
+        rows = self.sink(frames)
+        elapsed = time.perf_counter() - start_time
+        # Drop the references only once the batch is written, so the parsed data goes away with it
+        self.frames, self.nbytes, self.nrows = [], 0, 0
+        self.write_seconds += elapsed
+        logging.info(f"Flushed batch: {rows} rows, {batch_bytes / 1e6:.1f} MB in {elapsed:.2f}s "
+                     f"({rows / max(elapsed, 1e-9):.0f} rows/sec)")
+        self.rows_written += rows
+        return rows
+
+
+class StagingMerge:
+    """
+    BatchBuilder sink that merges every batch with merge_frames on a cursor owned by
+    the caller and keeps count of the conflicting rows.
+    """
+    def __init__(self, cursor, table_name, key='hash', policy=DEFAULT_CONFLICT_POLICY):
+        self.cursor = cursor
+        self.table_name = table_name
+        self.key = key
+        self.policy = policy
+        self.conflicts = 0
+
+    def __call__(self, frames):
+        rows, conflicts = merge_frames(self.cursor, frames, self.table_name, self.key, self.policy)
+        self.conflicts += conflicts
+        return rows
@@ -1,8 +1,18 @@
-import pandas as pd
 import os
-from sqlalchemy import create_engine, Column, Integer, MetaData, Table, select
+import argparse
+from sqlalchemy import create_engine, Column, Integer, MetaData, Table, select, text
 from sqlalchemy import Column, Table, MetaData, TIMESTAMP, VARCHAR, NUMERIC, INTEGER, BIGINT, Index
 import logging
+from zeromev_facts import create_zeromev_facts, changed_ranges_table_name, wide_table_name
+
+# Keeps blocknative_zeromev, the wide per-block table the plot scripts read, up to date with
+# blocknative_blocks and the zeromev_data table. Only blocks that changed are refreshed: the
+# block ranges zeromev.py logged in zeromev_changed_ranges and the blocks of blocknative_blocks
+# that are not in blocknative_zeromev yet.
+#
+# Usage: python combine_blocknative_zeromev.py                 (incremental)
+#        python combine_blocknative_zeromev.py --full          (every block of blocknative_blocks)
+#        python combine_blocknative_zeromev.py --start-block 19220986 --end-block 19499238
 
 # Create the logs directory if it does not exist
 log_directory = "logs"
@@ -76,22 +86,130 @@ table = Table(table_name, metadata,
     Column('liquid_count', INTEGER),
     Column('swap_count', INTEGER), # user tx count
     )
-    # Create the table
-metadata.create_all(engine)
-logging.info(f"Table {table_name} has been created/ensured in the database")
 
-# Load the data from the database into Pandas DataFrames
-blocknative_blocks_df = pd.read_sql('SELECT * FROM blocknative_blocks', con=engine)
-logging.info(f"Blocknative table read!")
+blocknative_columns = ['block_number', 'block_date', 'tx_count', 'private_tx_count', 'public_tx_count',
+                       'gasused_gwei', 'private_gasused_gwei', 'public_gasused_gwei']
+zeromev_columns = [column.name for column in table.columns if column.name not in blocknative_columns]
+
+# Blocks per statement of a full refresh
+FULL_REFRESH_BLOCKS = 100000
+
+
+def merge_spans(ranges):
+    """Sorted (first, last) spans covering the (start, count) ranges; overlapping and adjacent ranges are merged."""
+    spans = []
+    for start, count in sorted(ranges):
+        if spans and start <= spans[-1][1] + 1:
+            spans[-1] = (spans[-1][0], max(spans[-1][1], start + count - 1))
+        else:
+            spans.append((start, start + count - 1))
+    return spans
+
+
+def refresh_span(connection, first, last):
+    """
+    Upsert the blocks of blocknative_blocks between first and last, joined with zeromev_data.
+    Returns the number of rows written.
+    """
+    columns = ', '.join(blocknative_columns + zeromev_columns)
+    select_columns = ', '.join([f"b.{column}" for column in blocknative_columns] + [f"z.{column}" for column in zeromev_columns])
+    updates = ', '.join(f"{column} = EXCLUDED.{column}" for column in blocknative_columns + zeromev_columns if column != 'block_number')
+    result = connection.execute(text(f"""
+        INSERT INTO {table_name} ({columns})
+        SELECT {select_columns}
+        FROM blocknative_blocks b
+        LEFT JOIN {wide_table_name} z ON z.block_number = b.block_number
+        WHERE b.block_number BETWEEN :first AND :last
+        ON CONFLICT (block_number) DO UPDATE SET {updates}
+    """), {'first': first, 'last': last})
+    return result.rowcount
+
+
+def refresh_changed(connection):
+    """Refresh the block ranges logged by zeromev.py and clear them off the log, in the caller's transaction."""
+    ranges = connection.execute(text(f"DELETE FROM {changed_ranges_table_name} RETURNING start_block, block_count")).fetchall()
+    spans = merge_spans(ranges)
+    rows = sum(refresh_span(connection, first, last) for first, last in spans)
+    logging.info(f"Refreshed {rows} blocks in {len(spans)} spans for {len(ranges)} changed zeromev ranges")
+    return rows
 
-zeromev_data_df = pd.read_sql('SELECT * FROM zeromev_data', con=engine)
-logging.info(f"Zeromev table read!")
 
+def clear_changed_span(connection, first=None, last=None):
+    """
+    Take the blocks between first and last (open-ended if None) off the zeromev_changed_ranges log:
+    ranges inside the span are deleted, ranges that overlap it are cut down to the blocks outside it.
+    """
+    ranges = connection.execute(text(f"""
+        DELETE FROM {changed_ranges_table_name}
+        WHERE (CAST(:last AS BIGINT) IS NULL OR start_block <= :last)
+          AND (CAST(:first AS BIGINT) IS NULL OR start_block + block_count - 1 >= :first)
+        RETURNING start_block, block_count
+    """), {'first': first, 'last': last}).fetchall()
+    kept = []
+    for start, count in ranges:
+        if first is not None and start < first:
+            kept.append({'start_block': start, 'block_count': first - start})
+        if last is not None and start + count - 1 > last:
+            kept.append({'start_block': last + 1, 'block_count': start + count - 1 - last})
+    if kept:
+        connection.execute(text(f"INSERT INTO {changed_ranges_table_name} (start_block, block_count) "
+                                f"VALUES (:start_block, :block_count)"), kept)
+    logging.info(f"Cleared {len(ranges)} changed zeromev ranges between {first} and {last}, kept {len(kept)} parts outside")
+
+
+def refresh_new_blocks(connection):
+    """Add the blocks of blocknative_blocks that blocknative_zeromev does not have yet, one block_date at a time."""
+    dates = connection.execute(text(f"""
+        SELECT block_date, MIN(block_number), MAX(block_number) FROM blocknative_blocks b
+        WHERE NOT EXISTS (SELECT 1 FROM {table_name} bz WHERE bz.block_number = b.block_number)
+        GROUP BY block_date ORDER BY block_date
+    """)).fetchall()
+    rows = 0
+    for block_date, first, last in dates:
+        rows += refresh_span(connection, first, last)
+    logging.info(f"Added {rows} blocks of {len(dates)} new block dates")
+    return rows
+
+
+def refresh_all(connection, first=None, last=None):
+    """Refresh every block of blocknative_blocks, or those between first and last, in slices of FULL_REFRESH_BLOCKS."""
+    low, high = connection.execute(text("SELECT MIN(block_number), MAX(block_number) FROM blocknative_blocks")).fetchone()
+    if low is None:
+        return 0
+    low, high = max(low, first) if first is not None else low, min(high, last) if last is not None else high
+    rows = 0
+    for start in range(int(low), int(high) + 1, FULL_REFRESH_BLOCKS):
+        rows += refresh_span(connection, start, min(start + FULL_REFRESH_BLOCKS - 1, int(high)))
+    logging.info(f"Refreshed {rows} blocks between {low} and {high}")
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Refresh blocknative_zeromev from blocknative_blocks and zeromev_data.")
+    parser.add_argument('--full', action='store_true', help="Refresh every block instead of the changed ones")
+    parser.add_argument('--start-block', type=int, help="Refresh the blocks from here...")
+    parser.add_argument('--end-block', type=int, help="...to here, inclusive")
+    args = parser.parse_args()
+
+    # Create the table
+    metadata.create_all(engine)
+    create_zeromev_facts(engine)
+    logging.info(f"Table {table_name} has been created/ensured in the database")
+
+    with engine.begin() as connection:
+        if args.full:
+            # A full refresh covers the logged ranges too
+            connection.execute(text(f"DELETE FROM {changed_ranges_table_name}"))
+            refresh_all(connection)
+        elif args.start_block is not None or args.end_block is not None:
+            # Only the logged changes inside the refreshed span are covered
+            clear_changed_span(connection, args.start_block, args.end_block)
+            refresh_all(connection, args.start_block, args.end_block)
+        else:
+            refresh_changed(connection)
+            refresh_new_blocks(connection)
+    logging.info(f"Table {table_name} is up to date.")
 
-# Perform a left join using Pandas, focusing on blocknative_blocks_df
-joined_df = pd.merge(blocknative_blocks_df, zeromev_data_df, on='block_number', how='left')
-logging.info(f"Merge finished!")
 
-# Write the DataFrame to SQL database in a new table or replace the existing one
-joined_df.to_sql(name=table_name, con=engine, if_exists='append', index=False)  # Choose 'append' if you wish to add to an existing table
-logging.info(f"Data successfully joined and written to new table {table_name}.")
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,275 @@
+import os
+import re
+import sys
+import time
+import shutil
+import asyncio
+import logging
+import argparse
+import aiohttp
+from http_retry import RETRY_STATUSES, RetryableError, retry_after_seconds, backoff_seconds
+from slice_cache import SliceCache, store_object, CACHE_ROOT
+from slice_plan import DOMAIN, parse_hours, read_plan
+
+# Concurrent replacement for download_slices.sh. Reads the same date files, writes the
+# same data/YYYYMMDD/HH.csv.gz layout through '.part' files, and applies the same
+# backpressure (pending date directories and free disk watermarks).
+#
+# Usage: python download_slices.py dates.txt --parallel 8
+#        python download_slices.py one_hour_dates.txt --base-url http://localhost:8080/
+#        python download_slices.py dates.txt --cache   (keep a zstd copy, skip slices already cached)
+
+# Create the logs directory if it does not exist
+log_directory = "logs"
+if not os.path.exists(log_directory):
+    os.makedirs(log_directory)
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s',
+                    handlers=[logging.StreamHandler(sys.stdout),
+                              logging.FileHandler(os.path.join(log_directory, "download.log"))])
+
+DOWNLOAD_CHUNK_BYTES = 1024 * 1024
+
+# Same knobs as download_slices.sh
+MAX_PENDING_DIRS = int(os.getenv('MAX_PENDING_DIRS', '4'))
+DISK_LOW_WATERMARK_MB = int(os.getenv('DISK_LOW_WATERMARK_MB', '2048'))
+DISK_HIGH_WATERMARK_MB = int(os.getenv('DISK_HIGH_WATERMARK_MB', '4096'))
+BACKPRESSURE_POLL_SECONDS = float(os.getenv('BACKPRESSURE_POLL_SECONDS', '5'))
+
+
+def open_part_file(part_path, mode):
+    """
+    Open a '.part' file, creating its date directory first. The directory is created only
+    here, with no await before the open: the watchdog deletes empty date directories.
+    """
+    os.makedirs(os.path.dirname(part_path), exist_ok=True)
+    try:
+        return open(part_path, mode)
+    except FileNotFoundError:
+        # Deleted by the watchdog between the two calls
+        os.makedirs(os.path.dirname(part_path), exist_ok=True)
+        return open(part_path, mode)
+
+
+def pending_directories(data_dir):
+    """
+    Date directories with complete slices that the watchdog has not loaded yet (it deletes
+    slices once loaded). Directories with only a '.part' file are still downloading.
+    """
+    count = 0
+    for name in os.listdir(data_dir):
+        date_dir = os.path.join(data_dir, name)
+        if re.match(r'^\d{8}$', name) and os.path.isdir(date_dir):
+            count += any(file_name.endswith('.csv.gz') for file_name in os.listdir(date_dir))
+    return count
+
+
+def free_disk_mb(data_dir):
+    return shutil.disk_usage(data_dir).free // (1024 * 1024)
+
+
+class SliceDownloader:
+    def __init__(self, session, base_url, data_dir, retries, cache=None):
+        self.session = session
+        self.base_url = base_url
+        self.data_dir = data_dir
+        self.retries = retries
+        self.cache = cache
+        self.bytes_downloaded = 0
+        self.downloaded = 0
+        self.cached = 0
+        self.missing = 0
+        self.failed = 0
+
+    async def fetch_once(self, url, part_path):
+        """
+        One GET for a slice. An existing '.part' file is resumed with a Range request; a
+        server that ignores the range sends the whole file (200) and the part file is rewritten.
+        Returns the slice's ETag, if the server sent one.
+        """
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        headers = {'Range': f'bytes={offset}-'} if offset else {}
+        async with self.session.get(url, headers=headers) as response:
+            if response.status == 416 and offset:
+                # The part file already holds the whole slice
+                return None
+            if response.status in RETRY_STATUSES:
+                raise RetryableError(f"HTTP {response.status}", retry_after_seconds(response.headers.get('Retry-After')))
+            if response.status not in (200, 206):
+                response.raise_for_status()
+                raise aiohttp.ClientResponseError(response.request_info, response.history, status=response.status,
+                                                  message=f"unexpected status {response.status}")
+
+            mode = 'ab' if response.status == 206 else 'wb'
+            with open_part_file(part_path, mode) as part_file:
+                async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_BYTES):
+                    part_file.write(chunk)
+                    self.bytes_downloaded += len(chunk)
+
+            expected = response.content_length
+            if expected is not None and os.path.getsize(part_path) - (offset if mode == 'ab' else 0) < expected:
+                raise RetryableError("connection closed before the end of the body")
+            return response.headers.get('ETag')
+
+    async def is_cached(self, url, key):
+        """True if the cache holds this slice and it still matches the archive's size and ETag."""
+        if self.cache.entry(key) is None:
+            return False
+        async with self.session.head(url) as response:
+            if response.status != 200:
+                return False
+            return self.cache.is_current(key, response.content_length, response.headers.get('ETag'))
+
+    async def download(self, date, hour):
+        """Download one slice to data/DATE/HH.csv.gz. Returns True on success."""
+        file_name = f"{hour:02d}.csv.gz"
+        url = f"{self.base_url}{date}/{file_name}"
+        date_dir = os.path.join(self.data_dir, date)
+        final_path = os.path.join(date_dir, file_name)
+        part_path = f"{final_path}.part"
+
+        if self.cache is not None:
+            try:
+                if await self.is_cached(url, f"{date}/{file_name}"):
+                    # Loaded from the cache by watchdog_v2.py --reingest-from-cache instead
+                    logging.info(f"{date}/{file_name} is already in the cache, skipping")
+                    self.cached += 1
+                    return False
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logging.warning(f"Could not check the cached {date}/{file_name} against the archive: {e}")
+
+        for attempt in range(self.retries + 1):
+            try:
+                etag = await self.fetch_once(url, part_path)
+                if self.cache is not None:
+                    # Before the rename: the watchdog deletes the slice once it is loaded
+                    await self.cache_slice(f"{date}/{file_name}", part_path, etag)
+                os.replace(part_path, final_path)
+                self.downloaded += 1
+                logging.info(f"Downloaded {date}/{file_name}")
+                return True
+            except aiohttp.ClientResponseError as e:
+                if e.status == 404:
+                    # Not every date and hour exists in the archive
+                    logging.warning(f"File not found (404) for {file_name} on {date}.")
+                    self.missing += 1
+                    return False
+                logging.error(f"Error downloading {file_name} for {date} - Status code: {e.status}")
+                break
+            except (RetryableError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if attempt == self.retries:
+                    logging.error(f"Retry limit reached for {file_name} on {date}: {e}")
+                    break
+                retry_after = getattr(e, 'retry_after', None)
+                delay = retry_after if retry_after is not None else backoff_seconds(attempt)
+                logging.warning(f"{e or type(e).__name__} for {file_name} on {date}. Retrying in {delay:.1f} seconds...")
+                await asyncio.sleep(delay)
+
+        # Only complete downloads stay on disk; a partial file is kept for a later Range request
+        self.failed += 1
+        return False
+
+    async def cache_slice(self, key, path, etag):
+        # Recompression runs in a thread; the cache index is only used from the event loop
+        try:
+            stored = await asyncio.to_thread(store_object, self.cache.root, path)
+            self.cache.add(key, stored, etag)
+        except Exception as e:
+            logging.error(f"Failed to cache {key}: {e}")
+
+
+async def wait_for_capacity(data_dir):
+    """Backpressure, as in download_slices.sh: wait for the watchdog and for free disk space."""
+    paused = False
+    while True:
+        pending, free_mb = pending_directories(data_dir), free_disk_mb(data_dir)
+        if pending < MAX_PENDING_DIRS and free_mb >= (DISK_HIGH_WATERMARK_MB if paused else DISK_LOW_WATERMARK_MB):
+            if paused:
+                logging.info(f"Resuming downloads: {pending} pending directories, {free_mb} MB free")
+            return
+        if not paused:
+            paused = True
+            logging.info(f"Pausing downloads: {pending} pending directories (max {MAX_PENDING_DIRS}), "
+                         f"{free_mb} MB free (low watermark {DISK_LOW_WATERMARK_MB} MB)")
+        await asyncio.sleep(BACKPRESSURE_POLL_SECONDS)
+
+
+def publish_download_status(data_dir, state, current_date, remaining_dates):
+    path = os.path.join(data_dir, '.download_status')
+    with open(f"{path}.tmp", 'w') as status_file:
+        status_file.write(f"STATE={state}\nCURRENT_DATE={current_date}\nREMAINING_DATES={remaining_dates}\n"
+                          f"PENDING_DIRECTORIES={pending_directories(data_dir)}\nFREE_DISK_MB={free_disk_mb(data_dir)}\n"
+                          f"UPDATED_AT={int(time.time())}\n")
+    os.replace(f"{path}.tmp", path)
+
+
+async def download_dates(plan, base_url, data_dir, parallel, retries, cache=None):
+    """Download the (date, hours) pairs of `plan` into data_dir."""
+    os.makedirs(data_dir, exist_ok=True)
+    # One keep-alive connection per parallel download
+    connector = aiohttp.TCPConnector(limit=parallel)
+    timeout = aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=120)
+    start_time = time.perf_counter()
+
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        downloader = SliceDownloader(session, base_url, data_dir, retries, cache)
+        semaphore = asyncio.Semaphore(parallel)
+
+        async def download_slice(date, hour):
+            async with semaphore:
+                return await downloader.download(date, hour)
+
+        async def download_date(date, hours):
+            results = await asyncio.gather(*(download_slice(date, hour) for hour in hours))
+            if not any(results):
+                # A date without any slice would count as pending forever
+                try:
+                    os.rmdir(os.path.join(data_dir, date))
+                except OSError:
+                    pass
+
+        tasks = []
+        for index, (date, hours) in enumerate(plan):
+            # New dates are only started while the watchdog keeps up; running ones continue
+            await wait_for_capacity(data_dir)
+            publish_download_status(data_dir, 'downloading', date, len(plan) - index)
+            tasks.append((asyncio.create_task(download_date(date, hours)), len(hours)))
+            # Keep at most `parallel` slices waiting for the semaphore
+            while sum(slice_count for task, slice_count in tasks if not task.done()) >= 2 * parallel:
+                await asyncio.wait([task for task, _ in tasks if not task.done()], return_when=asyncio.FIRST_COMPLETED)
+        await asyncio.gather(*(task for task, _ in tasks))
+
+    elapsed = time.perf_counter() - start_time
+    publish_download_status(data_dir, 'finished', plan[-1][0] if plan else '', 0)
+    logging.info(f"Process completed: {downloader.downloaded} slices downloaded, {downloader.cached} already cached, "
+                 f"{downloader.missing} not in the archive, "
+                 f"{downloader.failed} failed, "
+                 f"{downloader.bytes_downloaded / 1e6:.1f} MB in {elapsed:.1f}s "
+                 f"({downloader.bytes_downloaded / 1e6 / max(elapsed, 1e-9):.1f} MB/s)")
+    return downloader.failed == 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Download Blocknative archive slices concurrently.")
+    parser.add_argument('date_file', help="File with one YYYYMMDD date per line, e.g. dates.txt, or a plan from plan_slices.py")
+    parser.add_argument('--hours', default='18', help="Hours to download per date, e.g. 18, 0-23 or 6,18 (default: 18)")
+    parser.add_argument('--parallel', type=int, default=int(os.getenv('DOWNLOAD_PARALLEL', '8')), help="Concurrent downloads")
+    parser.add_argument('--retries', type=int, default=5, help="Retries per slice on 429/5xx and connection errors")
+    parser.add_argument('--base-url', default=DOMAIN, help="Archive URL, e.g. the local archive_stub_server.py")
+    parser.add_argument('--data-dir', default='data')
+    parser.add_argument('--cache', action='store_true', help="Keep a zstd copy of every slice in the local slice cache")
+    parser.add_argument('--cache-dir', default=CACHE_ROOT)
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.date_file):
+        logging.error(f"Date file not found: {args.date_file}")
+        sys.exit(1)
+    base_url = args.base_url if args.base_url.endswith('/') else args.base_url + '/'
+    cache = SliceCache(args.cache_dir) if args.cache else None
+    ok = asyncio.run(download_dates(read_plan(args.date_file, parse_hours(args.hours)), base_url,
+                                    args.data_dir, args.parallel, args.retries, cache))
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
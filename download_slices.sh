@@ -27,43 +27,105 @@ if [ ! -f "$DATE_FILE" ]; then
   exit 1
 fi
 
-# Loop through each date in the date file
-while IFS= read -r LINE || [ -n "$LINE" ]; do
-  # Remove carriage returns (\r) if present
-  DATE=$(echo "$LINE" | tr -d '\r')
+# Backpressure: downloading pauses while more than MAX_PENDING_DIRS date directories are
+# waiting for the watchdog, or while free disk space is below the low watermark. It resumes
+# once the watchdog has caught up and free space is back above the high watermark.
+MAX_PENDING_DIRS="${MAX_PENDING_DIRS:-4}"
+DISK_LOW_WATERMARK_MB="${DISK_LOW_WATERMARK_MB:-2048}"
+DISK_HIGH_WATERMARK_MB="${DISK_HIGH_WATERMARK_MB:-4096}"
+BACKPRESSURE_POLL_SECONDS="${BACKPRESSURE_POLL_SECONDS:-5}"
 
-  # Path for the directory inside "data"
-  DATA_DIR="data/$DATE"
-  echo "DIRECTORY NAME IS $DATA_DIR"
+# Queue depths published by the watchdog and by this script
+INGEST_STATUS_FILE="data/.ingest_status"
+DOWNLOAD_STATUS_FILE="data/.download_status"
 
-  # Create the directory inside "data", including parent if it does not exist
-  mkdir -p "${DATA_DIR}" || {
-    echo "Error: Directory '$DATA_DIR' already exists or cannot be created."
-    echo "Error: Directory '$DATA_DIR' already exists or cannot be created." >> "$LOG_FILE"
-    continue  # Skip to the next date
-  }
+mkdir -p data
+TOTAL_DATES=$(grep -c . "$DATE_FILE")
+DATES_DONE=0
 
-  # Initialize a variable to track successful downloads
-  SUCCESSFUL_DOWNLOADS=0
-  BASE_URL="${DOMAIN}${DATE}/"
-  
-  HOUR=18
+# Date directories in "data" with complete slices that the watchdog has not loaded yet
+# (it deletes slices once loaded). Directories with only a '.part' file are still downloading.
+pending_directories() {
+  local count=0
+  for dir in data/[0-9][0-9][0-9][0-9][0-9][0-9][0-9][0-9]/; do
+    compgen -G "${dir}*.csv.gz" > /dev/null && count=$((count + 1))
+  done
+  echo "$count"
+}
+
+free_disk_mb() {
+  df -Pm data | awk 'NR == 2 {print $4}'
+}
+
+publish_download_status() {
+  printf 'STATE=%s\nCURRENT_DATE=%s\nREMAINING_DATES=%s\nPENDING_DIRECTORIES=%s\nFREE_DISK_MB=%s\nUPDATED_AT=%s\n' \
+    "$1" "$DATE" "$((TOTAL_DATES - DATES_DONE))" "$PENDING" "$FREE_MB" "$(date +%s)" > "${DOWNLOAD_STATUS_FILE}.tmp"
+  mv "${DOWNLOAD_STATUS_FILE}.tmp" "$DOWNLOAD_STATUS_FILE"
+}
+
+wait_for_capacity() {
+  local paused=0
+  while true; do
+    PENDING=$(pending_directories)
+    FREE_MB=$(free_disk_mb)
+    if [ "$PENDING" -lt "$MAX_PENDING_DIRS" ]; then
+      if [ "$paused" -eq 0 ] && [ "$FREE_MB" -ge "$DISK_LOW_WATERMARK_MB" ]; then
+        break
+      elif [ "$paused" -eq 1 ] && [ "$FREE_MB" -ge "$DISK_HIGH_WATERMARK_MB" ]; then
+        echo "Resuming downloads: $PENDING pending directories, ${FREE_MB} MB free"
+        break
+      fi
+    fi
+    if [ "$paused" -eq 0 ]; then
+      paused=1
+      echo "Pausing downloads: $PENDING pending directories (max $MAX_PENDING_DIRS), ${FREE_MB} MB free (low watermark ${DISK_LOW_WATERMARK_MB} MB)"
+      if [ -f "$INGEST_STATUS_FILE" ]; then
+        echo "Watchdog status: $(tr '\n' ' ' < "$INGEST_STATUS_FILE")"
+      fi
+    fi
+    publish_download_status paused
+    sleep "$BACKPRESSURE_POLL_SECONDS"
+  done
+  publish_download_status downloading
+}
+
+# Hours of a plan line: "18", "6,18" or "0-23"; a line with only the date gets hour 18
+parse_hours() {
+  local part
+  for part in ${1//,/ }; do
+    if [[ "$part" =~ ^([0-9]+)-([0-9]+)$ ]]; then
+      seq "${BASH_REMATCH[1]}" "${BASH_REMATCH[2]}"
+    elif [[ "$part" =~ ^[0-9]+$ ]]; then
+      echo "$part"
+    else
+      return 1
+    fi
+  done
+}
+
+# Download one hour of $DATE to $DATA_DIR, retrying on 429 and 504
+download_hour() {
   # Construct the URL for the current hour's data
-  URL="${BASE_URL}${HOUR}.csv.gz"
+  local HOUR
+  HOUR=$(printf '%02d' "$((10#$1))")
+  local URL="${BASE_URL}${HOUR}.csv.gz"
 
-  # Define the filename for the current hour's data
-  FILENAME="${HOUR}.csv.gz"
+  # Define the filename for the current hour's data. The download goes to a '.part' file
+  # that is renamed once complete, so the watchdog only ever sees finished slices.
+  local FILENAME="${HOUR}.csv.gz"
+  local PART_FILE="${DATA_DIR}/${FILENAME}.part"
 
   # Initialize a variable to keep track of retries
-  RETRIES=0
+  local RETRIES=0
 
   # Loop to handle retries on 404, 429, and 504 responses
   while true; do
       # Download the data and check the response status code
-      HTTP_STATUS=$(curl -o "${DATA_DIR}/${FILENAME}" -w "%{http_code}" "$URL")
+      HTTP_STATUS=$(curl --create-dirs -o "$PART_FILE" -w "%{http_code}" "$URL")
 
       # Check the status code and print a message
       if [ "$HTTP_STATUS" -eq 200 ]; then
+          mv "$PART_FILE" "${DATA_DIR}/${FILENAME}"
           echo "Downloaded $FILENAME"
           ((SUCCESSFUL_DOWNLOADS++))
           break  # Exit the retry loop on success
@@ -73,21 +135,69 @@ while IFS= read -r LINE || [ -n "$LINE" ]; do
           sleep 1  # Wait for 1 second before retrying
           ((RETRIES++))
           if [ $RETRIES -ge 3 ]; then
-               echo "Retry limit reached for $DATE. Moving to next date."
+               echo "Retry limit reached for $FILENAME on $DATE. Moving on."
                echo "Retry limit reached for $FILENAME on $DATE." >> "$LOG_FILE"
+               rm -f "$PART_FILE"
                break
           fi
       elif [ "$HTTP_STATUS" -eq 404 ]; then
           echo "File not found (404) for $DATE. Exiting for $FILENAME."
           echo "File not found (404) for $FILENAME on $DATE." >> "$LOG_FILE"
+          rm -f "$PART_FILE"
           break  # Exit the retry loop for 404
       else
           echo "Error downloading $FILENAME for $DATE - Status code: $HTTP_STATUS"
           echo "Error downloading $FILENAME for $DATE - Status code: $HTTP_STATUS" >> "$LOG_FILE"
-          rm "${DATA_DIR}/${FILENAME}"  # Remove the empty file
+          rm -f "$PART_FILE"  # Remove the empty file
           break  # Exit the retry loop on other errors
       fi
   done
+}
+
+# Loop through each date in the date file
+while IFS= read -r LINE || [ -n "$LINE" ]; do
+  # Remove carriage returns (\r) if present. Plans from plan_slices.py list the missing hours
+  # after the date ("YYYYMMDD HH,HH").
+  LINE=$(echo "$LINE" | tr -d '\r')
+  DATE=$(echo "$LINE" | awk '{print $1}')
+  [ -z "$DATE" ] && continue
+  HOURS_FIELD=$(echo "$LINE" | awk '{print $2}')
+  if ! HOURS=$(parse_hours "${HOURS_FIELD:-18}"); then
+    echo "Error: invalid hours '$HOURS_FIELD' for $DATE in $DATE_FILE"
+    echo "Error: invalid hours '$HOURS_FIELD' for $DATE in $DATE_FILE" >> "$LOG_FILE"
+    exit 1
+  fi
+
+  # Wait until the watchdog has caught up and there is enough free disk space
+  wait_for_capacity
+
+  # Path for the directory inside "data"
+  DATA_DIR="data/$DATE"
+  echo "DIRECTORY NAME IS $DATA_DIR"
+
+  # Create the directory inside "data", including parent if it does not exist
+  mkdir -p "${DATA_DIR}" || {
+    echo "Error: Directory '$DATA_DIR' already exists or cannot be created."
+    echo "Error: Directory '$DATA_DIR' already exists or cannot be created." >> "$LOG_FILE"
+    continue  # Skip to the next date
+  }
+
+  # Initialize a variable to track successful downloads
+  SUCCESSFUL_DOWNLOADS=0
+  BASE_URL="${DOMAIN}${DATE}/"
+
+  for HOUR in $HOURS; do
+    download_hour "$HOUR"
+  done
+
+  # A date without any slice would count as pending forever
+  if [ "$SUCCESSFUL_DOWNLOADS" -eq 0 ]; then
+    rmdir "$DATA_DIR" 2>/dev/null
+  fi
+  DATES_DONE=$((DATES_DONE + 1))
 done < "$DATE_FILE"
 
+PENDING=$(pending_directories)
+FREE_MB=$(free_disk_mb)
+publish_download_status finished
 echo "Process completed."
@@ -0,0 +1,223 @@
+import os
+import glob
+import time
+import logging
+import argparse
+import ijson
+import requests
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+# One streaming pass over the Flashbots all_blocks dump that writes a compact table with one
+# row per block: the miner reward and gas of the block and its bundle and transaction counts.
+# Blocks are parsed one at a time with ijson, straight from the API response or from a saved
+# output.json, so memory stays constant however large the dump gets.
+#
+# The nested transactions are flattened once, a batch of blocks at a time, into an Arrow
+# table with one row per transaction, which is kept as Parquet in parquet/flashbots_transactions
+# (FLASHBOTS_TRANSACTIONS_ROOT). The per-block bundle metrics are group-bys over that table,
+# so new metrics can be computed from the Parquet files without parsing the dump again.
+#
+# Usage: python flashbots_block_stats.py                         (from blocks.flashbots.net)
+#        python flashbots_block_stats.py --input output.json --output flashbots_block_stats.csv
+#        python flashbots_block_stats.py --from-parquet          (recompute from the flattened transactions)
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+FLASHBOTS_ALL_BLOCKS_URL = os.getenv('FLASHBOTS_ALL_BLOCKS_URL', "https://blocks.flashbots.net/v1/all_blocks")
+FLASHBOTS_BLOCK_STATS_PATH = 'flashbots_block_stats.csv'
+FLASHBOTS_TRANSACTIONS_ROOT = os.getenv('FLASHBOTS_TRANSACTIONS_ROOT', os.path.join(os.getcwd(), 'parquet', 'flashbots_transactions'))
+PARQUET_COMPRESSION = 'zstd'
+
+# The file of a full pass; incremental syncs add blocks-<first>-<last>.parquet next to it
+ALL_BLOCKS_FILE = 'all_blocks.parquet'
+
+# bundle_tx_count is max(bundle_index) + 1 (1 for a block without transactions), as
+# calculate_max_bundle_index in flashbots_blocknative_combine.py computed it; bundle_count
+# counts the distinct bundle indices and tx_count the Flashbots transactions of the block.
+BLOCK_STATS_COLUMNS = ['block_number', 'miner', 'miner_reward', 'coinbase_transfers', 'gas_used', 'gas_price',
+                       'tx_count', 'bundle_count', 'bundle_tx_count']
+BLOCK_COLUMNS = BLOCK_STATS_COLUMNS[:6]
+
+# Wei amounts do not fit in int64
+TRANSACTION_SCHEMA = pa.schema([
+    ('block_number', pa.int64()),
+    ('bundle_index', pa.int32()),
+    ('tx_hash', pa.string()),
+    ('bundle_type', pa.string()),
+    ('gas_used', pa.int64()),
+    ('coinbase_transfer', pa.decimal128(38, 0)),
+])
+
+# Blocks per flattened batch (one Parquet row group)
+BATCH_BLOCKS = 10000
+PROGRESS_BLOCKS = 100000
+
+
+def flatten_blocks(blocks):
+    """
+    (blocks, transactions) of a list of all_blocks items: a DataFrame of the block fields
+    without the transactions, and an Arrow table with one row per transaction.
+    """
+    rows = []
+    columns = {name: [] for name in TRANSACTION_SCHEMA.names}
+    for block in blocks:
+        rows.append([block['block_number']] + [block.get(column) for column in BLOCK_COLUMNS[1:]])
+        for transaction in block.get('transactions') or []:
+            columns['block_number'].append(block['block_number'])
+            columns['bundle_index'].append(transaction['bundle_index'])
+            columns['tx_hash'].append(transaction.get('transaction_hash'))
+            columns['bundle_type'].append(transaction.get('bundle_type'))
+            columns['gas_used'].append(transaction.get('gas_used'))
+            coinbase_transfer = transaction.get('coinbase_transfer')
+            columns['coinbase_transfer'].append(None if coinbase_transfer is None else str(coinbase_transfer))
+    columns['coinbase_transfer'] = pa.array(columns['coinbase_transfer'], pa.string()).cast(pa.decimal128(38, 0))
+    return pd.DataFrame(rows, columns=BLOCK_COLUMNS), pa.table(columns, schema=TRANSACTION_SCHEMA)
+
+
+def block_metrics(transactions):
+    """Per-block tx_count, bundle_count and bundle_tx_count of a flattened transactions table."""
+    grouped = transactions.group_by('block_number').aggregate([
+        ('bundle_index', 'count'), ('bundle_index', 'count_distinct'), ('bundle_index', 'max')]).to_pandas()
+    return pd.DataFrame({
+        'block_number': grouped['block_number'],
+        'tx_count': grouped['bundle_index_count'],
+        'bundle_count': grouped['bundle_index_count_distinct'],
+        'bundle_tx_count': grouped['bundle_index_max'] + 1,
+    })
+
+
+def block_stats_frame(blocks, transactions):
+    """The compact rows of a batch: the block fields and the metrics of its transactions."""
+    df = blocks.merge(block_metrics(transactions), on='block_number', how='left')
+    # Blocks without transactions
+    df = df.fillna({'tx_count': 0, 'bundle_count': 0, 'bundle_tx_count': 1})
+    return df.astype({'tx_count': 'int64', 'bundle_count': 'int64', 'bundle_tx_count': 'int64'})[BLOCK_STATS_COLUMNS]
+
+
+def iter_blocks(source):
+    """The all_blocks items of a binary file-like object, one at a time."""
+    yield from ijson.items(source, 'item')
+
+
+def iter_batches(blocks, batch_blocks=BATCH_BLOCKS):
+    """(stats, transactions) per batch of blocks, flattened and aggregated."""
+    batch = []
+    for block in blocks:
+        batch.append(block)
+        if len(batch) >= batch_blocks:
+            block_fields, transactions = flatten_blocks(batch)
+            yield block_stats_frame(block_fields, transactions), transactions
+            batch = []
+    if batch:
+        block_fields, transactions = flatten_blocks(batch)
+        yield block_stats_frame(block_fields, transactions), transactions
+
+
+class TransactionsWriter:
+    """
+    Writes flattened transactions to one Parquet file, published on close(). The files
+    matching `replaces` are covered by the new one and removed once it is published.
+    """
+    def __init__(self, root, file_name, replaces=None):
+        os.makedirs(root, exist_ok=True)
+        self.root = root
+        self.path = os.path.join(root, file_name)
+        # Dot files are not part of the dataset, so readers never see a partial file
+        self.temp_path = os.path.join(root, f".{file_name}.tmp")
+        self.replaces = replaces
+        self.writer = pq.ParquetWriter(self.temp_path, TRANSACTION_SCHEMA, compression=PARQUET_COMPRESSION,
+                                       write_statistics=True)
+        self.rows = 0
+
+    def write(self, transactions):
+        self.writer.write_table(transactions.sort_by('block_number'))
+        self.rows += transactions.num_rows
+
+    def close(self):
+        self.writer.close()
+        os.replace(self.temp_path, self.path)
+        if self.replaces:
+            for path in glob.glob(os.path.join(self.root, self.replaces)):
+                os.remove(path)
+        logging.info(f"Wrote {self.rows} flattened transactions to {self.path}")
+
+    def abort(self):
+        self.writer.close()
+        os.remove(self.temp_path)
+
+
+def transactions_dataset(root=FLASHBOTS_TRANSACTIONS_ROOT):
+    """The flattened Flashbots transactions, e.g. block_metrics(transactions_dataset().to_table())."""
+    return ds.dataset(root, format='parquet', schema=TRANSACTION_SCHEMA)
+
+
+def write_block_stats(source, output_path, transactions_root=FLASHBOTS_TRANSACTIONS_ROOT):
+    """
+    Write the compact rows of every block in source to a CSV file and the flattened
+    transactions to Parquet. Returns the number of blocks.
+    """
+    start_time = time.time()
+    blocks = 0
+    temp_path = f"{output_path}.tmp"
+    # A full pass covers the blocks of every incremental sync
+    writer = TransactionsWriter(transactions_root, ALL_BLOCKS_FILE, replaces='blocks-*.parquet') if transactions_root else None
+    try:
+        with open(temp_path, 'w', newline='') as file:
+            for stats, transactions in iter_batches(iter_blocks(source)):
+                stats.to_csv(file, header=blocks == 0, index=False)
+                if writer is not None:
+                    writer.write(transactions)
+                blocks += len(stats)
+                if blocks % PROGRESS_BLOCKS < len(stats):
+                    logging.info(f"{blocks} blocks, {blocks / (time.time() - start_time):.0f} blocks/s")
+            if blocks == 0:
+                file.write(','.join(BLOCK_STATS_COLUMNS) + '\n')
+    except BaseException:
+        if writer is not None:
+            writer.abort()
+        raise
+    # Only a complete pass replaces the previous table
+    if writer is not None:
+        writer.close()
+    os.replace(temp_path, output_path)
+    logging.info(f"Wrote {blocks} blocks to {output_path} in {time.time() - start_time:.1f}s")
+    return blocks
+
+
+def open_all_blocks(url=FLASHBOTS_ALL_BLOCKS_URL):
+    """The all_blocks response as a stream; the body is parsed as it arrives."""
+    response = requests.get(url, stream=True, timeout=(10, 300))
+    response.raise_for_status()
+    response.raw.decode_content = True
+    return response
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compact per-block table of the Flashbots all_blocks dump.")
+    parser.add_argument('--input', help="Saved all_blocks JSON (e.g. output.json) instead of the API")
+    parser.add_argument('--url', default=FLASHBOTS_ALL_BLOCKS_URL)
+    parser.add_argument('--output', default=FLASHBOTS_BLOCK_STATS_PATH)
+    parser.add_argument('--transactions-root', default=FLASHBOTS_TRANSACTIONS_ROOT,
+                        help="Directory of the flattened transactions")
+    parser.add_argument('--from-parquet', action='store_true',
+                        help="Print the bundle metrics of the flattened transactions instead of parsing the dump")
+    args = parser.parse_args()
+
+    if args.from_parquet:
+        start_time = time.time()
+        metrics = block_metrics(transactions_dataset(args.transactions_root).to_table())
+        logging.info(f"Bundle metrics of {len(metrics)} blocks in {time.time() - start_time:.1f}s")
+        print(metrics.describe().T[['count', 'mean', 'max']])
+    elif args.input:
+        with open(args.input, 'rb') as file:
+            write_block_stats(file, args.output, args.transactions_root)
+    else:
+        with open_all_blocks(args.url) as response:
+            write_block_stats(response.raw, args.output, args.transactions_root)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,35 +1,244 @@
+import os
+import time
+import logging
+import argparse
 import requests
-import csv
-
-def fetch_data(url):
-    # Send a GET request to the URL
-    response = requests.get(url)
-    # Raise an exception if the response status is not 200
-    response.raise_for_status()
-    return response.json()
-
-def write_to_csv(data, filename):
-    # Open the CSV file for writing
-    with open(filename, mode='w', newline='') as file:
-        writer = csv.writer(file)
-        # Check if data contains any entries
-        if data:
-            # Write headers based on the keys of the first item
-            headers = data[0].keys()
-            writer.writerow(headers)
-            # Write data rows
-            for item in data:
-                writer.writerow(item.values())
+from datetime import datetime, timezone
+from sqlalchemy import create_engine, Column, Table, MetaData, TIMESTAMP, VARCHAR, NUMERIC, INTEGER, BIGINT, inspect, text
+from bulk_loader import bulk_merge_frames
+from http_retry import RETRY_STATUSES, RetryableError, retry_after_seconds, backoff_seconds
+from flashbots_block_stats import ALL_BLOCKS_FILE, FLASHBOTS_TRANSACTIONS_ROOT, TransactionsWriter, iter_batches, iter_blocks
+
+# Keeps the Flashbots blocks in the flashbots_blocks table, one compact row per block (see
+# flashbots_block_stats.py), and the flashbots_blocknative view that joins them to
+# blocknative_zeromev for the *_vs_flashbots.py and private_mev_ratio.py plots.
+#
+# The first run streams the all_blocks dump into the table. Later runs only page through
+# /v1/blocks, newest first, until they reach the block the last complete run synced up to,
+# which flashbots_syncs records once a run has written all its blocks: a run that fails half
+# way leaves the mark where it was, and the next one fetches the same blocks again. The
+# flattened transactions of every block are kept as Parquet next to the table
+# (FLASHBOTS_TRANSACTIONS_ROOT), one file per complete run.
+#
+# Usage: python flashbots_blocks.py                  (incremental)
+#        python flashbots_blocks.py --full           (stream all_blocks again and update every row)
+#        python flashbots_blocks.py --base-url http://localhost:8091/v1/   (flashbots_stub_server.py)
+
+# Create the logs directory if it does not exist
+log_directory = "logs"
+if not os.path.exists(log_directory):
+    os.makedirs(log_directory)
+
+log_file_path = os.path.join(log_directory, "flashbots_blocks.log")
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s',
+                    handlers=[logging.FileHandler(log_file_path), logging.StreamHandler()])
+
+localhost_name = 'localhost'
+
+db_params = {
+    'host': localhost_name,
+    'database': 'thesisdb',
+    'user': 'postgres',
+    'password': 'admin',
+    'port': '5432'
+}
+
+table_name = 'flashbots_blocks'
+sync_table_name = 'flashbots_syncs'
+view_name = 'flashbots_blocknative'
+blocknative_zeromev_table_name = 'blocknative_zeromev'
+engine = create_engine(f"postgresql://{db_params['user']}:{db_params['password']}@{db_params['host']}:{db_params['port']}/{db_params['database']}")
+
+FLASHBOTS_API_URL = "https://blocks.flashbots.net/v1/"
+
+# Blocks per /v1/blocks page
+PAGE_LIMIT = 10000
+
+metadata = MetaData()
+
+# block_number has the type of blocknative_zeromev.block_number, so the join can use both indexes
+table = Table(table_name, metadata,
+    Column('block_number', NUMERIC(18), primary_key=True),
+    Column('miner', VARCHAR(42)),
+    Column('miner_reward', NUMERIC),
+    Column('coinbase_transfers', NUMERIC),
+    Column('gas_used', BIGINT),
+    Column('gas_price', NUMERIC),
+    Column('tx_count', INTEGER),
+    Column('bundle_count', INTEGER),
+    Column('bundle_tx_count', INTEGER),
+    )
+
+# One row per complete run; every block up to synced_block is in flashbots_blocks
+sync_table = Table(sync_table_name, metadata,
+    Column('finished_at', TIMESTAMP, primary_key=True),
+    Column('mode', VARCHAR(20)),
+    Column('after_block', NUMERIC(18)),
+    Column('synced_block', NUMERIC(18)),
+    Column('blocks', INTEGER),
+    )
+
+
+def create_flashbots_table(engine):
+    """Create flashbots_blocks and, once blocknative_zeromev exists, the flashbots_blocknative view."""
+    metadata.create_all(engine)
+    with engine.begin() as connection:
+        if blocknative_zeromev_table_name in inspect(connection).get_table_names():
+            # tx_count is taken by blocknative's count, so the Flashbots one is renamed
+            connection.execute(text(f"""
+                CREATE OR REPLACE VIEW {view_name} AS
+                SELECT b.*, f.bundle_count, f.bundle_tx_count, f.tx_count AS flashbots_tx_count
+                FROM {blocknative_zeromev_table_name} b
+                LEFT JOIN {table_name} f ON f.block_number = b.block_number
+            """))
+    logging.info(f"Table {table_name} and view {view_name} have been created/ensured in the database")
+
+
+def stored_max_block(engine):
+    with engine.connect() as connection:
+        return connection.execute(text(f"SELECT MAX(block_number) FROM {table_name}")).scalar()
+
+
+def synced_block(engine):
+    """The block the table is complete up to, or None before the first complete run."""
+    with engine.connect() as connection:
+        return connection.execute(text(f"SELECT MAX(synced_block) FROM {sync_table_name}")).scalar()
+
+
+def record_sync(engine, mode, after_block, synced_block, blocks):
+    with engine.begin() as connection:
+        connection.execute(sync_table.insert().values(
+            finished_at=datetime.now(timezone.utc).replace(tzinfo=None), mode=mode, after_block=after_block,
+            synced_block=synced_block, blocks=blocks))
+
+
+def write_rows(df, policy='nothing'):
+    """Merge compact rows into flashbots_blocks on block_number. Returns the number of rows written."""
+    if df.empty:
+        return 0
+    return bulk_merge_frames(engine, [df], table_name, 'block_number', policy)
+
+
+def load_all_blocks(base_url, policy, transactions_root):
+    """
+    Stream all_blocks into the table a batch of blocks at a time. Returns the number of blocks
+    and the newest one.
+    """
+    start_time = time.time()
+    written, fetched, newest_block = 0, 0, None
+    writer = TransactionsWriter(transactions_root, ALL_BLOCKS_FILE, replaces='blocks-*.parquet')
+    try:
+        with requests.get(f"{base_url}all_blocks", stream=True, timeout=(10, 300)) as response:
+            response.raise_for_status()
+            response.raw.decode_content = True
+            for stats, transactions in iter_batches(iter_blocks(response.raw)):
+                written += write_rows(stats, policy)
+                writer.write(transactions)
+                fetched += len(stats)
+                newest_block = max(newest_block or 0, int(stats['block_number'].max()))
+                logging.info(f"{fetched} blocks loaded from all_blocks, {written} written")
+    except BaseException:
+        writer.abort()
+        raise
+    writer.close()
+    logging.info(f"Loaded {fetched} blocks from all_blocks, wrote {written} in {time.time() - start_time:.1f}s")
+    return fetched, newest_block
+
+
+def fetch_page(session, base_url, before, limit, retries):
+    """
+    One /v1/blocks page: {'blocks': up to `limit` blocks below `before` (the newest ones if
+    None), newest first, 'latest_block_number': the newest block of the API}.
+    """
+    params = {'limit': limit}
+    if before is not None:
+        params['before'] = before
+    for attempt in range(retries + 1):
+        try:
+            response = session.get(f"{base_url}blocks", params=params, timeout=(10, 120))
+            if response.status_code in RETRY_STATUSES:
+                raise RetryableError(f"HTTP {response.status_code}", retry_after_seconds(response.headers.get('Retry-After')))
+            response.raise_for_status()
+            return response.json()
+        except (RetryableError, requests.RequestException) as e:
+            if attempt == retries:
+                raise
+            retry_after = getattr(e, 'retry_after', None)
+            delay = retry_after if retry_after is not None else backoff_seconds(attempt)
+            logging.warning(f"{e} for blocks before {before}. Retrying in {delay:.1f} seconds...")
+            time.sleep(delay)
+
+
+def iter_new_blocks(session, base_url, after_block, latest_block, limit, retries):
+    """
+    The blocks above after_block up to latest_block, newest first, paging down until a page
+    reaches after_block. Blocks added after latest_block are left for the next run.
+    """
+    # Not every block has an entry, so there are at most latest - after_block new ones
+    limit = min(limit, latest_block - after_block)
+    before = latest_block + 1
+    while True:
+        page = fetch_page(session, base_url, before, limit, retries)['blocks']
+        new_blocks = [block for block in page if block['block_number'] > after_block]
+        yield from new_blocks
+        if len(new_blocks) < len(page) or len(page) < limit:
+            return
+        before = page[-1]['block_number']
+
+
+def sync_new_blocks(base_url, after_block, limit, retries, transactions_root):
+    """
+    Fetch and store only the blocks newer than after_block. Returns the number of blocks and
+    the block the table is complete up to, the newest block of the API.
+    """
+    start_time = time.time()
+    fetched, written = 0, 0
+    with requests.Session() as session:
+        # An up-to-date table costs a one-block request instead of a full page
+        latest_block = fetch_page(session, base_url, None, 1, retries)['latest_block_number']
+        if latest_block <= after_block:
+            logging.info(f"No blocks after block {after_block}")
+            return 0, after_block
+        # Rows of a failed run are merged again by the next one, but its transactions are only
+        # published once every block is in
+        writer = TransactionsWriter(transactions_root, f"blocks-{after_block + 1}-{latest_block}.parquet")
+        try:
+            for stats, transactions in iter_batches(iter_new_blocks(session, base_url, after_block, latest_block, limit, retries)):
+                written += write_rows(stats)
+                writer.write(transactions)
+                fetched += len(stats)
+        except BaseException:
+            writer.abort()
+            raise
+        writer.close()
+    logging.info(f"Fetched {fetched} blocks after block {after_block}, wrote {written} in {time.time() - start_time:.1f}s")
+    return fetched, latest_block
+
 
 def main():
-    url = "https://blocks.flashbots.net/v1/all_blocks"
-    # Fetch data from the URL
-    data = fetch_data(url)
-    # Specify the filename to write to
-    csv_filename = 'output.csv'
-    # Write data to CSV, assuming the JSON object is a list of dictionaries
-    write_to_csv(data, csv_filename)
-    print(f"Data successfully written to {csv_filename}")
-
-if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load the Flashbots blocks into Postgres incrementally.")
+    parser.add_argument('--base-url', default=FLASHBOTS_API_URL)
+    parser.add_argument('--full', action='store_true', help="Stream all_blocks again and update the stored rows")
+    parser.add_argument('--limit', type=int, default=PAGE_LIMIT, help="Blocks per /v1/blocks page")
+    parser.add_argument('--retries', type=int, default=5)
+    parser.add_argument('--transactions-root', default=FLASHBOTS_TRANSACTIONS_ROOT,
+                        help="Directory of the flattened transactions")
+    args = parser.parse_args()
+
+    create_flashbots_table(engine)
+    # Not MAX(block_number): the blocks arrive newest first, so an interrupted run stores
+    # blocks above the ones it is missing
+    after_block = synced_block(engine)
+    if args.full or after_block is None:
+        # Rows of an interrupted first load are kept, not updated
+        blocks, newest_block = load_all_blocks(args.base_url, 'update' if args.full else 'nothing', args.transactions_root)
+        if newest_block is not None:
+            record_sync(engine, 'all_blocks', None, newest_block, blocks)
+    else:
+        blocks, latest_block = sync_new_blocks(args.base_url, int(after_block), args.limit, args.retries, args.transactions_root)
+        record_sync(engine, 'blocks', int(after_block), latest_block, blocks)
+    logging.info(f"{table_name} is complete up to block {synced_block(engine)} and ends at block {stored_max_block(engine)}")
+
+
+if __name__ == '__main__':
     main()
@@ -1,27 +1,24 @@
 import requests
-import json
 
-def fetch_data(url):
-    # Send a GET request to the URL
-    response = requests.get(url)
-    # Raise an exception if the response status is not 200
-    response.raise_for_status()
-    return response.json()
+# Saves the Flashbots all_blocks dump as it arrives, without parsing it or re-indenting it:
+# the response is copied to output.json in chunks, so memory stays constant. The per-block
+# table the analysis needs comes from flashbots_block_stats.py --input output.json.
 
-def save_to_json(data, filename):
-    # Open the JSON file for writing
-    with open(filename, 'w') as file:
-        # Write data to the file in JSON format
-        json.dump(data, file, indent=4)
+def save_to_json(url, filename, chunk_size=1 << 20):
+    # Stream the response body straight to the file
+    with requests.get(url, stream=True, timeout=(10, 300)) as response:
+        # Raise an exception if the response status is not 200
+        response.raise_for_status()
+        with open(filename, 'wb') as file:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                file.write(chunk)
 
 def main():
     url = "https://blocks.flashbots.net/v1/all_blocks"
-    # Fetch data from the URL
-    data = fetch_data(url)
     # Specify the filename to save to
     json_filename = 'output.json'
-    # Save data to JSON
-    save_to_json(data, json_filename)
+    # Save the response to JSON
+    save_to_json(url, json_filename)
     print(f"Data successfully written to {json_filename}")
 
 if __name__ == "__main__":
@@ -0,0 +1,124 @@
+import json
+import bisect
+import random
+import logging
+import argparse
+from aiohttp import web
+
+# Local stand-in for blocks.flashbots.net, to run the Flashbots scripts offline. /v1/all_blocks
+# streams synthetic blocks in the format of the real API, newest first, and /v1/blocks pages
+# through them with before and limit; the same block always gets the same transactions.
+# Restart it with more --blocks to simulate new blocks for an incremental sync.
+#
+# Usage: python flashbots_stub_server.py --port 8091 --blocks 100000
+#        python flashbots_block_stats.py --url http://localhost:8091/v1/all_blocks
+#        python flashbots_blocks.py --base-url http://localhost:8091/v1/
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+FIRST_BLOCK = 11834049
+BUNDLE_TYPES = ['flashbots', 'flashbots', 'flashbots', 'rogue', 'miner_payout']
+STREAM_BLOCKS = 1000
+MAX_LIMIT = 10000
+
+
+def synthetic_block(block_number):
+    """One all_blocks item. Block numbers are sparse, since not every block had a Flashbots bundle."""
+    rng = random.Random(block_number)
+    transactions = []
+    for bundle_index in range(rng.choice([0, 1, 1, 2, 3, 5])):
+        bundle_type = rng.choice(BUNDLE_TYPES)
+        for _ in range(rng.choice([1, 1, 2, 3])):
+            gas_used = rng.randint(21000, 500000)
+            gas_price = rng.randint(0, 200) * 10 ** 9
+            coinbase_transfer = rng.randint(0, 10 ** 17) if rng.random() < 0.7 else 0
+            transactions.append({
+                'transaction_hash': '0x%064x' % rng.getrandbits(256),
+                'tx_index': len(transactions),
+                'bundle_type': bundle_type,
+                'bundle_index': bundle_index,
+                'block_number': block_number,
+                'eoa_address': '0x%040x' % rng.getrandbits(160),
+                'to_address': '0x%040x' % rng.getrandbits(160),
+                'gas_used': gas_used,
+                'gas_price': str(gas_price),
+                'coinbase_transfer': str(coinbase_transfer),
+                'total_miner_reward': str(gas_used * gas_price + coinbase_transfer),
+            })
+    miner_reward = sum(int(transaction['total_miner_reward']) for transaction in transactions)
+    coinbase_transfers = sum(int(transaction['coinbase_transfer']) for transaction in transactions)
+    gas_used = sum(transaction['gas_used'] for transaction in transactions)
+    return {
+        'block_number': block_number,
+        'miner_reward': str(miner_reward),
+        'miner': '0x%040x' % rng.getrandbits(160),
+        'coinbase_transfers': str(coinbase_transfers),
+        'gas_used': gas_used,
+        'gas_price': str((miner_reward - coinbase_transfers) // gas_used if gas_used else 0),
+        'transactions': transactions,
+    }
+
+
+def block_numbers(blocks):
+    """The block numbers of the stub, oldest first: about two in three blocks have an entry."""
+    numbers, number = [], FIRST_BLOCK
+    rng = random.Random(0)
+    while len(numbers) < blocks:
+        numbers.append(number)
+        number += rng.choice([1, 1, 2])
+    return numbers
+
+
+class FlashbotsStub:
+    def __init__(self, blocks):
+        self.block_numbers = block_numbers(blocks)
+        self.stats = {'blocks': 0}
+
+    async def handle_all_blocks(self, request):
+        response = web.StreamResponse(headers={'Content-Type': 'application/json'})
+        await response.prepare(request)
+        await response.write(b'[')
+        numbers = self.block_numbers[::-1]
+        self.stats['blocks'] += len(numbers)
+        for start in range(0, len(numbers), STREAM_BLOCKS):
+            chunk = ','.join(json.dumps(synthetic_block(number)) for number in numbers[start:start + STREAM_BLOCKS])
+            await response.write((',' if start else '').encode() + chunk.encode())
+        await response.write(b']')
+        await response.write_eof()
+        return response
+
+    async def handle_blocks(self, request):
+        try:
+            limit = int(request.query.get('limit', 100))
+            before = int(request.query['before']) if 'before' in request.query else None
+        except ValueError:
+            raise web.HTTPBadRequest(text='before and limit must be integers')
+        if not 0 < limit <= MAX_LIMIT:
+            raise web.HTTPBadRequest(text=f'limit must be between 1 and {MAX_LIMIT}')
+        end = len(self.block_numbers) if before is None else bisect.bisect_left(self.block_numbers, before)
+        numbers = self.block_numbers[max(0, end - limit):end][::-1]
+        self.stats['blocks'] += len(numbers)
+        return web.json_response({'blocks': [synthetic_block(number) for number in numbers],
+                                  'latest_block_number': self.block_numbers[-1]})
+
+    async def handle_stats(self, request):
+        return web.json_response(self.stats)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the Flashbots blocks API.")
+    parser.add_argument('--port', type=int, default=8091)
+    parser.add_argument('--blocks', type=int, default=100000, help="Blocks with Flashbots transactions to serve")
+    args = parser.parse_args()
+
+    stub = FlashbotsStub(args.blocks)
+    app = web.Application()
+    app.router.add_get('/v1/all_blocks', stub.handle_all_blocks)
+    app.router.add_get('/v1/blocks', stub.handle_blocks)
+    app.router.add_get('/stats', stub.handle_stats)
+    logging.info(f"Serving {args.blocks} synthetic Flashbots blocks on port {args.port}")
+    web.run_app(app, port=args.port)
+
+
+if __name__ == '__main__':
+    main()
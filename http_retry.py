@@ -0,0 +1,60 @@
+import time
+import random
+import asyncio
+from email.utils import parsedate_to_datetime
+
+# Retry and rate limiting helpers shared by the asyncio HTTP clients (download_slices.py, zeromev.py)
+
+# Status codes worth another attempt; everything else except 200/206 fails the request
+RETRY_STATUSES = {408, 429, 500, 502, 503, 504}
+
+# Backoff: the n-th retry waits a random time between 0 and min(cap, base * 2^n) ("full jitter"),
+# unless the server sent a Retry-After
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_CAP_SECONDS = 60.0
+
+
+class RetryableError(Exception):
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def retry_after_seconds(value):
+    """Retry-After is either a number of seconds or an HTTP date."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_seconds(attempt):
+    return random.uniform(0, min(BACKOFF_CAP_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt))
+
+
+class TokenBucket:
+    """Allows `rate` requests per second on average, in bursts of up to `burst` requests."""
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        # Waiters are served in order, so a burst cannot starve the others
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
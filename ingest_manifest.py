@@ -0,0 +1,107 @@
+import os
+import re
+import hashlib
+import logging
+from datetime import datetime, timezone
+from sqlalchemy import text
+
+# One row per slice that went through the watchdog. A slice counts as loaded only if its
+# manifest row says so, and that row is committed in the same transaction as its data.
+manifest_table_name = 'ingest_manifest'
+
+LOADED = 'loaded'
+FAILED = 'failed'
+
+HASH_CHUNK_BYTES = 1024 * 1024
+
+
+def create_manifest_table(engine):
+    with engine.begin() as connection:
+        connection.execute(text(f"""
+            CREATE TABLE IF NOT EXISTS {manifest_table_name} (
+                file_path VARCHAR(1024) NOT NULL,
+                file_size BIGINT NOT NULL,
+                content_hash CHAR(64) NOT NULL,
+                slice_date DATE,
+                slice_hour INT,
+                rows_loaded BIGINT,
+                lines_repaired BIGINT DEFAULT 0,
+                lines_quarantined BIGINT DEFAULT 0,
+                status VARCHAR(20) NOT NULL,
+                error VARCHAR(1000),
+                started_at TIMESTAMP,
+                finished_at TIMESTAMP,
+                duration_seconds NUMERIC,
+                PRIMARY KEY (file_path, file_size, content_hash)
+            );
+        """))
+        # Manifests created before bad lines were counted
+        for column in ('lines_repaired', 'lines_quarantined'):
+            connection.execute(text(f"ALTER TABLE {manifest_table_name} ADD COLUMN IF NOT EXISTS {column} BIGINT DEFAULT 0;"))
+        connection.execute(text(f"CREATE INDEX IF NOT EXISTS idx_{manifest_table_name}_slice_date ON {manifest_table_name} (slice_date);"))
+    logging.info(f"Table '{manifest_table_name}' has been created/ensured in the database.")
+
+
+def slice_key(path):
+    """'.../data/20210423/18.csv.gz' -> '20210423/18.csv.gz', independent of where 'data' lives."""
+    return f"{os.path.basename(os.path.dirname(path))}/{os.path.basename(path)}"
+
+
+def slice_date_and_hour(key):
+    """'20210423/18.csv.gz' -> ('2021-04-23', 18). Returns (None, None) for other names."""
+    match = re.match(r'^(\d{4})(\d{2})(\d{2})/(\d{2})\.csv\.gz$', key)
+    if match is None:
+        return None, None
+    year, month, day, hour = match.groups()
+    return f"{year}-{month}-{day}", int(hour)
+
+
+def file_sha256(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(HASH_CHUNK_BYTES), b''):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def utc_now():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def is_loaded(cursor, key, size):
+    """Look a slice up by name and size only, so loaded slices are skipped without being opened."""
+    cursor.execute(f"SELECT 1 FROM {manifest_table_name} WHERE file_path = %s AND file_size = %s AND status = %s LIMIT 1",
+                   (key, size, LOADED))
+    return cursor.fetchone() is not None
+
+
+def loaded_slices(engine):
+    """(file_path, file_size) of every loaded slice."""
+    with engine.connect() as connection:
+        rows = connection.execute(text(f"SELECT file_path, file_size FROM {manifest_table_name} WHERE status = :status"),
+                                  {'status': LOADED})
+        return {(file_path, file_size) for file_path, file_size in rows}
+
+
+def record_slice(cursor, key, size, content_hash, status, rows_loaded, started_at, error=None,
+                 lines_repaired=0, lines_quarantined=0):
+    """Insert or update the manifest row of a slice. Runs inside the caller's transaction."""
+    finished_at = utc_now()
+    slice_date, slice_hour = slice_date_and_hour(key)
+    cursor.execute(f"""
+        INSERT INTO {manifest_table_name}
+            (file_path, file_size, content_hash, slice_date, slice_hour, rows_loaded, lines_repaired,
+             lines_quarantined, status, error, started_at, finished_at, duration_seconds)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+        ON CONFLICT (file_path, file_size, content_hash) DO UPDATE SET
+            rows_loaded = EXCLUDED.rows_loaded,
+            lines_repaired = EXCLUDED.lines_repaired,
+            lines_quarantined = EXCLUDED.lines_quarantined,
+            status = EXCLUDED.status,
+            error = EXCLUDED.error,
+            started_at = EXCLUDED.started_at,
+            finished_at = EXCLUDED.finished_at,
+            duration_seconds = EXCLUDED.duration_seconds
+    """, (key, size, content_hash, slice_date, slice_hour, rows_loaded, lines_repaired, lines_quarantined, status,
+          error[:1000] if error else None, started_at, finished_at,
+          (finished_at - started_at).total_seconds()))
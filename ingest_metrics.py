@@ -0,0 +1,143 @@
+import os
+import json
+import time
+import logging
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+
+# One JSON object per processed slice
+METRICS_LOG_PATH = os.getenv('INGEST_METRICS_LOG', os.path.join('logs', 'ingest_metrics.jsonl'))
+# Prometheus node_exporter textfile collector format, rewritten after every slice
+METRICS_TEXTFILE_PATH = os.getenv('INGEST_METRICS_TEXTFILE', os.path.join('logs', 'blocknative_ingest.prom'))
+
+# Stages of one slice, in order. 'wait' is the time between the slice being reported
+# complete and a worker picking it up. 'parse' includes gzip decompression, which Arrow
+# runs on its read-ahead thread, overlapping with the parsing. 'filter' covers the row
+# filter and the conversion to pandas.
+STAGES = ('wait', 'hash', 'parse', 'filter', 'write', 'commit', 'delete')
+
+METRIC_PREFIX = 'blocknative_ingest'
+
+
+class SliceMetrics:
+    """Stage timings and counters of one slice, collected in the pool process and returned as a dict."""
+    def __init__(self, key, queued_at=None):
+        self.key = key
+        self.queued_at = queued_at
+        self.started_at = time.time()
+        self.stages = defaultdict(float)
+        self.counters = defaultdict(int)
+        if queued_at is not None:
+            self.stages['wait'] = max(0.0, self.started_at - queued_at)
+
+    @contextmanager
+    def stage(self, name):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] += time.perf_counter() - start_time
+
+    def add_time(self, name, seconds):
+        self.stages[name] += seconds
+
+    def count(self, name, value):
+        self.counters[name] += value
+
+    def as_record(self, status):
+        finished_at = time.time()
+        return {
+            'slice': self.key,
+            'status': status,
+            'pid': os.getpid(),
+            'started_at': self.started_at,
+            'finished_at': finished_at,
+            'seconds': finished_at - self.started_at,
+            'stages': {name: round(self.stages[name], 6) for name in STAGES if name in self.stages},
+            **self.counters,
+        }
+
+
+class MetricsPublisher:
+    """
+    Runs in the main process: appends every slice record to the JSON lines log and keeps
+    running totals for the Prometheus textfile, together with the current queue depths.
+    If `status_path` is set, the queue depths are also written there as KEY=VALUE lines
+    for download_slices.sh.
+    """
+    def __init__(self, log_path=METRICS_LOG_PATH, textfile_path=METRICS_TEXTFILE_PATH, status_path=None):
+        self.log_path = log_path
+        self.textfile_path = textfile_path
+        self.status_path = status_path
+        self.lock = threading.Lock()
+        self.stage_seconds = defaultdict(float)
+        self.counters = defaultdict(int)
+        self.slices = defaultdict(int)
+        self.queue_depth = {}
+        self.last_slice_time = 0
+
+    def set_queue_depth(self, queue, depth):
+        with self.lock:
+            self.queue_depth[queue] = depth
+            self._write_textfile()
+            self._write_status()
+
+    def publish(self, record):
+        with self.lock:
+            try:
+                os.makedirs(os.path.dirname(self.log_path) or '.', exist_ok=True)
+                with open(self.log_path, 'a') as log_file:
+                    log_file.write(json.dumps(record) + '\n')
+            except Exception as e:
+                logging.error(f"Failed to write ingest metrics to {self.log_path}: {e}")
+
+            self.slices[record['status']] += 1
+            for name, seconds in record['stages'].items():
+                self.stage_seconds[name] += seconds
+            for name in ('rows_in', 'rows_out', 'rows_written', 'bytes_in'):
+                self.counters[name] += record.get(name, 0)
+            self.last_slice_time = record['finished_at']
+            self._write_textfile()
+
+    def _write_status(self):
+        if self.status_path is None:
+            return
+        lines = [f"QUEUE_{queue.upper()}={depth}" for queue, depth in sorted(self.queue_depth.items())]
+        lines.append(f"UPDATED_AT={int(time.time())}")
+        _replace_file(self.status_path, lines)
+
+    def _write_textfile(self):
+        lines = [
+            f"# HELP {METRIC_PREFIX}_stage_seconds_total Time spent in each ingest stage, summed over all slices.",
+            f"# TYPE {METRIC_PREFIX}_stage_seconds_total counter",
+            *[f'{METRIC_PREFIX}_stage_seconds_total{{stage="{name}"}} {self.stage_seconds[name]:.6f}' for name in STAGES],
+            f"# HELP {METRIC_PREFIX}_rows_total Rows parsed (in), kept by the filter (out) and written to the sinks.",
+            f"# TYPE {METRIC_PREFIX}_rows_total counter",
+            *[f'{METRIC_PREFIX}_rows_total{{kind="{kind}"}} {self.counters[f"rows_{kind}"]}' for kind in ('in', 'out', 'written')],
+            f"# HELP {METRIC_PREFIX}_bytes_total Compressed slice bytes read.",
+            f"# TYPE {METRIC_PREFIX}_bytes_total counter",
+            f"{METRIC_PREFIX}_bytes_total {self.counters['bytes_in']}",
+            f"# HELP {METRIC_PREFIX}_slices_total Slices processed, by outcome.",
+            f"# TYPE {METRIC_PREFIX}_slices_total counter",
+            *[f'{METRIC_PREFIX}_slices_total{{status="{status}"}} {count}' for status, count in sorted(self.slices.items())],
+            f"# HELP {METRIC_PREFIX}_queue_depth Items waiting in the ingest queues.",
+            f"# TYPE {METRIC_PREFIX}_queue_depth gauge",
+            *[f'{METRIC_PREFIX}_queue_depth{{queue="{queue}"}} {depth}' for queue, depth in sorted(self.queue_depth.items())],
+            f"# HELP {METRIC_PREFIX}_last_slice_timestamp_seconds When the last slice finished.",
+            f"# TYPE {METRIC_PREFIX}_last_slice_timestamp_seconds gauge",
+            f"{METRIC_PREFIX}_last_slice_timestamp_seconds {self.last_slice_time:.3f}",
+        ]
+        _replace_file(self.textfile_path, lines)
+
+
+def _replace_file(path, lines):
+    """Write and rename, so readers never see a half written file."""
+    temp_path = f"{path}.tmp"
+    try:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(temp_path, 'w') as status_file:
+            status_file.write('\n'.join(lines) + '\n')
+        os.replace(temp_path, path)
+    except Exception as e:
+        logging.error(f"Failed to write {path}: {e}")
@@ -0,0 +1,103 @@
+import os
+import re
+import json
+import argparse
+import pandas as pd
+from ingest_metrics import METRICS_LOG_PATH, STAGES
+
+# Summary of the per-slice ingest metrics written by watchdog_v2.py: where the time goes,
+# throughput percentiles and an ETA for the dates that are not loaded yet.
+#
+# Usage: python ingest_summary.py --dates dates.txt
+
+PERCENTILES = [0.5, 0.9, 0.99]
+
+
+def load_records(log_path):
+    with open(log_path) as log_file:
+        records = [json.loads(line) for line in log_file if line.strip()]
+    if not records:
+        return pd.DataFrame()
+    df = pd.json_normalize(records)
+    df['slice_date'] = df['slice'].str[:8]
+    return df
+
+
+def stage_summary(loaded):
+    """Total time per stage, its share of all stage time and per-slice percentiles."""
+    stage_columns = [f'stages.{stage}' for stage in STAGES if f'stages.{stage}' in loaded.columns]
+    stages = loaded[stage_columns].fillna(0).rename(columns=lambda column: column.split('.', 1)[1])
+    summary = stages.quantile(PERCENTILES).T
+    summary.columns = [f'p{int(q * 100)}_s' for q in PERCENTILES]
+    summary.insert(0, 'total_s', stages.sum())
+    summary.insert(1, 'share_%', 100 * stages.sum() / stages.sum().sum())
+    return summary
+
+
+def throughput_summary(loaded):
+    """Per-slice throughput percentiles."""
+    seconds = loaded['seconds'].clip(lower=1e-9)
+    throughput = pd.DataFrame({
+        'rows_in/s': loaded['rows_in'] / seconds,
+        'rows_written/s': loaded['rows_written'] / seconds,
+        'MB_in/s': loaded['bytes_in'] / 1e6 / seconds,
+    })
+    summary = throughput.quantile(PERCENTILES).T
+    summary.columns = [f'p{int(q * 100)}' for q in PERCENTILES]
+    return summary
+
+
+def read_dates(dates_path):
+    """YYYYMMDD dates in the format download_slices.sh reads."""
+    with open(dates_path) as dates_file:
+        return [line.strip() for line in dates_file if re.match(r'^\d{8}$', line.strip())]
+
+
+def eta(loaded, dates):
+    """Remaining dates and the rate observed so far, in dates per wall-clock hour (None if unknown)."""
+    done = set(loaded['slice_date'])
+    remaining = [date for date in dates if date not in done]
+    window = loaded['finished_at'].max() - loaded['started_at'].min()
+    if not done or window <= 0:
+        return remaining, None
+    return remaining, len(done) / window * 3600
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarise the ingest metrics of watchdog_v2.py.")
+    parser.add_argument('--log', default=METRICS_LOG_PATH, help="JSON lines file written by the watchdog")
+    parser.add_argument('--dates', help="File with the YYYYMMDD dates of the whole backfill, e.g. dates.txt")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.log):
+        print(f"No metrics at {args.log}")
+        return
+    df = load_records(args.log)
+    if df.empty:
+        print(f"No slices recorded in {args.log}")
+        return
+
+    print("Slices by status:")
+    print(df['status'].value_counts().to_string())
+    loaded = df[df['status'] == 'loaded']
+    if loaded.empty:
+        return
+
+    print(f"\nRows: {int(loaded['rows_in'].sum())} parsed, {int(loaded['rows_out'].sum())} kept by the filter, "
+          f"{int(loaded['rows_written'].sum())} written; {loaded['bytes_in'].sum() / 1e9:.2f} GB compressed input")
+    print("\nTime per stage:")
+    print(stage_summary(loaded).round(3).to_string())
+    print("\nThroughput per slice:")
+    print(throughput_summary(loaded).round(1).to_string())
+
+    if args.dates:
+        remaining, dates_per_hour = eta(loaded, read_dates(args.dates))
+        if dates_per_hour is None:
+            print(f"\n{len(remaining)} dates remaining, no rate observed yet")
+        else:
+            print(f"\n{len(remaining)} dates remaining at {dates_per_hour:.1f} dates/hour, "
+                  f"ETA {pd.Timedelta(hours=len(remaining) / dates_per_hour).round('s')}")
+
+
+if __name__ == '__main__':
+    main()
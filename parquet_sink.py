@@ -0,0 +1,81 @@
+import os
+import logging
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from blocknative_reader import BLOCKNATIVE_TYPES
+from ingest_manifest import slice_date_and_hour
+
+# Root of the Hive-partitioned landing zone: <root>/detect_date=YYYY-MM-DD/hour=HH/<file>.parquet
+PARQUET_ROOT = os.getenv('PARQUET_ROOT', os.path.join(os.getcwd(), 'parquet', 'transactions'))
+PARQUET_COMPRESSION = 'zstd'
+
+# Row groups are sorted by this column, so their min/max statistics let readers skip them
+SORT_COLUMN = 'curblocknumber'
+
+# Partition columns live in the directory names only
+PARTITION_COLUMNS = ['detect_date', 'hour']
+
+
+def parquet_schema(columns, column_types=None):
+    """Arrow schema of the written files: the pinned reader types, overridden by `column_types`."""
+    column_types = column_types or {}
+    return pa.schema([(column, column_types.get(column, BLOCKNATIVE_TYPES.get(column, pa.string())))
+                      for column in columns if column not in PARTITION_COLUMNS])
+
+
+def slice_parquet_path(root, key):
+    """'20210423/18.csv.gz' -> '<root>/detect_date=2021-04-23/hour=18/18.parquet'."""
+    slice_date, slice_hour = slice_date_and_hour(key)
+    if slice_date is None:
+        raise ValueError(f"Not a slice key: {key}")
+    return os.path.join(root, f"detect_date={slice_date}", f"hour={slice_hour:02d}", f"{slice_hour:02d}.parquet")
+
+
+def transactions_dataset(root=PARQUET_ROOT):
+    """Open the landing zone for analysis, e.g. transactions_dataset().to_table(filter=ds.field('curblocknumber') > n)."""
+    return ds.dataset(root, format='parquet', partitioning='hive')
+
+
+class ParquetSliceWriter:
+    """
+    BatchBuilder sink that writes one slice to its partition, one sorted row group per
+    batch. The file is written under a hidden temporary name and only appears under its
+    final name on close(), so readers never see a partial slice. Loading the same slice again
+    replaces the file.
+    """
+    def __init__(self, root, key, schema):
+        self.path = slice_parquet_path(root, key)
+        # pyarrow skips dot files when it lists a dataset, so the partial file is never read
+        self.temp_path = os.path.join(os.path.dirname(self.path), f".{os.path.basename(self.path)}.tmp")
+        self.schema = schema
+        self.writer = None
+
+    def __call__(self, frames):
+        if self.writer is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self.writer = pq.ParquetWriter(self.temp_path, self.schema, compression=PARQUET_COMPRESSION,
+                                           write_statistics=True)
+        rows = sum(len(frame) for frame in frames)
+        table = pa.concat_tables([pa.Table.from_pandas(frame[self.schema.names], schema=self.schema, preserve_index=False)
+                                  for frame in frames])
+        if SORT_COLUMN in self.schema.names:
+            table = table.sort_by(SORT_COLUMN)
+        self.writer.write_table(table)
+        return rows
+
+    def close(self):
+        """Publish the file. A slice without any kept rows produces no file."""
+        if self.writer is None:
+            return
+        self.writer.close()
+        self.writer = None
+        os.replace(self.temp_path, self.path)
+        logging.info(f"Wrote Parquet slice: {self.path}")
+
+    def abort(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+        if os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
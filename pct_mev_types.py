@@ -6,8 +6,21 @@ from pandas.plotting import register_matplotlib_converters
 
 register_matplotlib_converters()
 
-# Read data from CSV file
-data = pd.read_csv('flashbots_blocknative.csv')
+localhost_name = 'localhost'
+
+db_params = {
+    'host': localhost_name,
+    'database': 'thesisdb',
+    'user': 'postgres',
+    'password': 'admin',
+    'port': '5432'
+}
+
+engine = create_engine(f"postgresql://{db_params['user']}:{db_params['password']}@{db_params['host']}:{db_params['port']}/{db_params['database']}")
+
+# Only the columns this plot needs
+query = "SELECT block_date, arb_count, liquid_count, sandwich_count FROM blocknative_zeromev"
+data = pd.read_sql(query, engine)
 
 # Convert 'block_date' to datetime format for plotting
 data['block_date'] = pd.to_datetime(data['block_date'])
@@ -1,5 +1,5 @@
 import pandas as pd
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
 from pandas.plotting import register_matplotlib_converters
@@ -7,16 +7,33 @@ from scipy.stats import pearsonr, spearmanr
 
 register_matplotlib_converters()
 
-# Read data from CSV file
-data = pd.read_csv('flashbots_blocknative.csv')
+localhost_name = 'localhost'
+
+db_params = {
+    'host': localhost_name,
+    'database': 'thesisdb',
+    'user': 'postgres',
+    'password': 'admin',
+    'port': '5432'
+}
+
+engine = create_engine(f"postgresql://{db_params['user']}:{db_params['password']}@{db_params['host']}:{db_params['port']}/{db_params['database']}")
+
+# Plotted dates: (START_DATE, END_DATE], from the first block when START_DATE is None
+START_DATE = None
+END_DATE = '2022-09-15'
+
+# Only the columns and dates this plot needs, joined to flashbots_blocks in the flashbots_blocknative view (flashbots_blocks.py)
+query = text("""
+SELECT block_date, arb_count, liquid_count, sandwich_count, bundle_tx_count
+FROM flashbots_blocknative
+WHERE (CAST(:start_date AS VARCHAR) IS NULL OR block_date > :start_date) AND block_date <= :end_date
+""")
+data = pd.read_sql(query, engine, params={'start_date': START_DATE, 'end_date': END_DATE})
 
 # Convert 'block_date' to datetime format for plotting
 data['block_date'] = pd.to_datetime(data['block_date'])
 
-# Uncomment below for full data (after merge)
-data = data[data['block_date'] <= pd.Timestamp('2022-09-15')]
-# data = data[(data['block_date'] > pd.Timestamp('2021-03-01')) & (data['block_date'] <= pd.Timestamp('2022-09-15'))]
-
 # Aggregate data by date
 aggregated_data = data.groupby('block_date').agg({
     'arb_count': 'sum',
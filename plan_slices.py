@@ -0,0 +1,260 @@
+import os
+import re
+import sys
+import logging
+import argparse
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine, inspect, text
+from ingest_manifest import manifest_table_name, LOADED, FAILED
+from slice_plan import parse_hours
+
+# Work planner for the backfill: diffs a requested range of date/hour slices against what is
+# already loaded (ingest manifest, and optionally the transactions and blocknative_blocks
+# tables for data loaded before the manifest existed) and writes the missing slices as a date
+# file for download_slices.py / stream_ingest.py, most important gaps first.
+#
+# Usage: python plan_slices.py --start 20191101 --end 20240324 --output plan.txt
+#        python plan_slices.py --dates dates.txt --priority window --window 20220801-20221031
+#        python download_slices.py plan.txt
+
+# Create the logs directory if it does not exist
+log_directory = "logs"
+if not os.path.exists(log_directory):
+    os.makedirs(log_directory)
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s',
+                    handlers=[logging.StreamHandler(sys.stdout),
+                              logging.FileHandler(os.path.join(log_directory, "plan_slices.log"))])
+
+localhost_name = 'localhost'
+
+db_params = {
+    'host': localhost_name,
+    'database': 'thesisdb',
+    'user': 'postgres',
+    'password': 'admin',
+    'port': '5432'
+}
+
+engine = create_engine(f"postgresql://{db_params['user']}:{db_params['password']}@{db_params['host']}:{db_params['port']}/{db_params['database']}")
+
+# Where coverage is looked up. The manifest knows every slice loaded by watchdog_v2.py; the
+# transactions table also covers slices loaded before it; blocknative_blocks only knows
+# whole dates, which is enough when the raw transactions are not needed again.
+COVERAGE_SOURCES = ('manifest', 'transactions', 'blocknative_blocks')
+PRIORITIES = ('gap', 'window', 'date')
+
+# Incomplete downloads moved aside by watchdog_small.py before it loaded slices on filesystem events,
+# as skipped_data/YYYYMMDD/HH.csv.gz
+skipped_directory_path = os.path.join(os.getcwd(), 'skipped_data')
+
+
+def date_range(start, end):
+    """YYYYMMDD dates from start to end, inclusive."""
+    current, last = datetime.strptime(start, '%Y%m%d'), datetime.strptime(end, '%Y%m%d')
+    dates = []
+    while current <= last:
+        dates.append(current.strftime('%Y%m%d'))
+        current += timedelta(days=1)
+    return dates
+
+
+def read_dates(date_file):
+    """The first field of every 'YYYYMMDD' line, as in download_slices.py."""
+    with open(date_file) as file:
+        return [line.split()[0] for line in file if line.split() and re.match(r'^\d{8}$', line.split()[0])]
+
+
+def iso_date(date):
+    return f"{date[:4]}-{date[4:6]}-{date[6:]}"
+
+
+def manifest_coverage(connection, dates):
+    """Loaded and failed (date, hour) slices of the requested dates, from the slice_date index of the manifest."""
+    rows = connection.execute(text(f"""
+        SELECT to_char(slice_date, 'YYYYMMDD'), slice_hour, status FROM {manifest_table_name}
+        WHERE slice_date = ANY(CAST(:dates AS date[]))
+    """), {'dates': [iso_date(date) for date in dates]}).fetchall()
+    loaded = {(date, hour) for date, hour, status in rows if status == LOADED}
+    failed = {(date, hour) for date, hour, status in rows if status == FAILED} - loaded
+    return loaded, failed
+
+
+def transactions_coverage(connection, slices):
+    """
+    Slices with at least one row in transactions. One EXISTS probe per slice on the
+    detect_date index; the probe stops at the first row of the hour.
+    """
+    if not slices:
+        return set()
+    rows = connection.execute(text("""
+        SELECT to_char(s.slice_date, 'YYYYMMDD'), s.slice_hour
+        FROM unnest(CAST(:dates AS date[]), CAST(:hours AS int[])) AS s(slice_date, slice_hour)
+        WHERE EXISTS (
+            SELECT 1 FROM transactions t
+            WHERE t.detect_date = to_char(s.slice_date, 'YYYY-MM-DD')
+              AND t.detecttime >= s.slice_date + make_interval(hours => s.slice_hour)
+              AND t.detecttime < s.slice_date + make_interval(hours => s.slice_hour + 1)
+        )
+    """), {'dates': [iso_date(date) for date, _ in slices], 'hours': [hour for _, hour in slices]}).fetchall()
+    return {(date, hour) for date, hour in rows}
+
+
+def blocknative_blocks_coverage(connection, dates):
+    """Dates with aggregated blocks in blocknative_blocks."""
+    rows = connection.execute(text("SELECT DISTINCT block_date FROM blocknative_blocks WHERE block_date = ANY(:dates)"),
+                              {'dates': [iso_date(date) for date in dates]}).fetchall()
+    return {block_date.replace('-', '') for block_date, in rows}
+
+
+def has_detect_date_index(connection):
+    rows = connection.execute(text("SELECT indexdef FROM pg_indexes WHERE tablename = 'transactions'")).fetchall()
+    return any(re.search(r'\(detect_date\)', indexdef) for indexdef, in rows)
+
+
+def skipped_slices():
+    """(date, hour) of the incomplete downloads in skipped_data."""
+    slices = set()
+    if not os.path.isdir(skipped_directory_path):
+        return slices
+    for root, _, files in os.walk(skipped_directory_path):
+        for file_name in files:
+            match = re.match(r'^(\d{2})\.csv\.gz$', file_name)
+            if match and re.match(r'^\d{8}$', os.path.basename(root)):
+                slices.add((os.path.basename(root), int(match.group(1))))
+    return slices
+
+
+def find_gaps(dates, missing_dates):
+    """Runs of consecutive requested dates that are missing, in date order."""
+    gaps, current = [], []
+    for date in dates:
+        if date in missing_dates:
+            current.append(date)
+        elif current:
+            gaps.append(current)
+            current = []
+    if current:
+        gaps.append(current)
+    return gaps
+
+
+def prioritise(dates, missing_dates, priority, window=None):
+    """
+    Order the missing dates. 'gap': the longest runs of missing dates first, since they hurt
+    the time series most; 'window': dates inside the analysis window first, then by gap;
+    'date': chronological.
+    """
+    if priority == 'date':
+        return [date for date in dates if date in missing_dates]
+    gaps = sorted(find_gaps(dates, missing_dates), key=lambda gap: (-len(gap), gap[0]))
+    ordered = [date for gap in gaps for date in gap]
+    if priority == 'window':
+        start, end = window
+        ordered = sorted(ordered, key=lambda date: not start <= date <= end)
+    return ordered
+
+
+def plan_slices(connection, dates, hours, sources, include_failed=True):
+    """
+    Missing hours per requested date, as {date: [hours]}, and the number of slices found in
+    each coverage source.
+    """
+    requested = {(date, hour) for date in dates for hour in hours}
+    covered, found = set(), {}
+
+    if 'manifest' in sources:
+        loaded, failed = manifest_coverage(connection, dates)
+        covered |= loaded & requested
+        found['manifest'] = len(loaded & requested)
+        found['failed'] = len(failed & requested)
+        if not include_failed:
+            covered |= failed & requested
+    if 'blocknative_blocks' in sources:
+        block_dates = blocknative_blocks_coverage(connection, dates)
+        from_blocks = {(date, hour) for date, hour in requested - covered if date in block_dates}
+        covered |= from_blocks
+        found['blocknative_blocks'] = len(from_blocks)
+    if 'transactions' in sources:
+        if not has_detect_date_index(connection):
+            logging.warning("transactions has no index on detect_date; every probe scans the table "
+                            "(see migrations.py for the index)")
+        from_transactions = transactions_coverage(connection, sorted(requested - covered))
+        covered |= from_transactions
+        found['transactions'] = len(from_transactions)
+
+    missing = {}
+    for date, hour in sorted(requested - covered):
+        missing.setdefault(date, []).append(hour)
+    return missing, found
+
+
+def write_plan(path, ordered_dates, missing, hours):
+    """One line per date: 'YYYYMMDD' if every requested hour is missing, else 'YYYYMMDD HH,HH'."""
+    with open(path, 'w') as plan_file:
+        for date in ordered_dates:
+            if missing[date] == sorted(hours):
+                plan_file.write(f"{date}\n")
+            else:
+                plan_file.write(f"{date} {','.join(str(hour) for hour in missing[date])}\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Plan the Blocknative slices that still have to be downloaded.")
+    parser.add_argument('--start', help="First date of the range, YYYYMMDD")
+    parser.add_argument('--end', help="Last date of the range, YYYYMMDD (default: --start)")
+    parser.add_argument('--dates', help="File with the requested YYYYMMDD dates instead of a range, e.g. dates.txt")
+    parser.add_argument('--hours', default='18', help="Hours per date, e.g. 18, 0-23 or 6,18 (default: 18)")
+    parser.add_argument('--covered-by', default='manifest,transactions',
+                        help=f"Comma separated coverage sources out of {', '.join(COVERAGE_SOURCES)} (default: manifest,transactions)")
+    parser.add_argument('--priority', choices=PRIORITIES, default='gap')
+    parser.add_argument('--window', help="Analysis window for --priority window, YYYYMMDD-YYYYMMDD")
+    parser.add_argument('--skip-failed', action='store_true', help="Do not plan slices the manifest lists as failed")
+    parser.add_argument('--output', default='plan.txt')
+    args = parser.parse_args()
+
+    if args.dates:
+        dates = sorted(set(read_dates(args.dates)))
+    elif args.start:
+        dates = date_range(args.start, args.end or args.start)
+    else:
+        parser.error("either --start or --dates is required")
+    window = None
+    if args.priority == 'window':
+        if not args.window or not re.match(r'^\d{8}-\d{8}$', args.window):
+            parser.error("--priority window needs --window YYYYMMDD-YYYYMMDD")
+        window = tuple(args.window.split('-'))
+    hours = sorted(set(parse_hours(args.hours)))
+    sources = [source.strip() for source in args.covered_by.split(',') if source.strip()]
+    if set(sources) - set(COVERAGE_SOURCES):
+        parser.error(f"--covered-by must be a subset of {COVERAGE_SOURCES}")
+
+    # Sources whose table does not exist yet cover nothing
+    tables = set(inspect(engine).get_table_names())
+    table_of_source = {'manifest': manifest_table_name, 'transactions': 'transactions', 'blocknative_blocks': 'blocknative_blocks'}
+    for source in [source for source in sources if table_of_source[source] not in tables]:
+        logging.warning(f"Table '{table_of_source[source]}' does not exist, ignoring it as a coverage source")
+        sources.remove(source)
+
+    with engine.connect() as connection:
+        missing, found = plan_slices(connection, dates, hours, sources, include_failed=not args.skip_failed)
+
+    ordered_dates = prioritise(dates, set(missing), args.priority, window)
+    write_plan(args.output, ordered_dates, missing, hours)
+
+    slice_count = sum(len(missing_hours) for missing_hours in missing.values())
+    gaps = find_gaps(dates, set(missing))
+    failed = found.pop('failed', 0)
+    logging.info(f"Requested {len(dates) * len(hours)} slices ({len(dates)} dates x {len(hours)} hours); "
+                 f"already loaded: {found}; failed before: {failed}{' (skipped)' if args.skip_failed else ''}")
+    logging.info(f"Planned {slice_count} slices on {len(missing)} dates in {len(gaps)} gaps "
+                 f"(longest {max((len(gap) for gap in gaps), default=0)} dates), priority '{args.priority}': {args.output}")
+    skipped = skipped_slices() & {(date, hour) for date, missing_hours in missing.items() for hour in missing_hours}
+    if skipped:
+        logging.info(f"{len(skipped)} planned slices have an incomplete copy in {skipped_directory_path}, which can be deleted")
+    if slice_count:
+        logging.info(f"Next: python download_slices.py {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,212 @@
+import os
+import time
+import sqlite3
+import hashlib
+import logging
+import argparse
+import threading
+import pyarrow as pa
+from ingest_manifest import file_sha256
+
+# Local cache of downloaded archive slices, so that tables can be rebuilt without downloading
+# the archive again (see watchdog_v2.py --reingest-from-cache). Slices are recompressed from
+# gzip to zstd and stored by the SHA-256 of their decompressed content, so identical slices
+# are stored once. A SQLite index maps 'YYYYMMDD/HH.csv.gz' keys to the stored objects,
+# together with the size, ETag and hash of the original download for validation. The least
+# recently used slices are evicted once the cache is larger than SLICE_CACHE_MAX_GB.
+#
+# Usage: python slice_cache.py            (summary)
+#        python slice_cache.py --verify   (rehash every object, drop the corrupt ones)
+
+CACHE_ROOT = os.getenv('SLICE_CACHE_ROOT', os.path.join(os.getcwd(), 'cache'))
+CACHE_MAX_BYTES = int(float(os.getenv('SLICE_CACHE_MAX_GB', '200')) * 1024 ** 3)
+
+CACHE_COMPRESSION = 'zstd'
+CACHE_READ_BYTES = 4 * 1024 * 1024
+
+
+def _copy_hashed(source, destination):
+    """Copy one Arrow stream into another. Returns the SHA-256 and size of the copied bytes."""
+    sha256 = hashlib.sha256()
+    size = 0
+    while True:
+        chunk = source.read(CACHE_READ_BYTES)
+        if not chunk:
+            return sha256.hexdigest(), size
+        sha256.update(chunk)
+        size += len(chunk)
+        if destination is not None:
+            destination.write(chunk)
+
+
+def object_path(root, object_hash):
+    return os.path.join(root, 'objects', object_hash[:2], f"{object_hash}.csv.zst")
+
+
+def store_object(root, gz_path):
+    """
+    Recompress a .csv.gz slice into the object store of the cache at `root`, without touching
+    the index, so that it can run in a worker thread. Returns what SliceCache.add needs.
+    """
+    source_size = os.path.getsize(gz_path)
+    source_sha256 = file_sha256(gz_path)
+    temp_path = os.path.join(root, 'objects', f".{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        with pa.input_stream(gz_path, compression='gzip') as source, \
+                pa.output_stream(temp_path, compression=CACHE_COMPRESSION) as destination:
+            object_hash, csv_size = _copy_hashed(source, destination)
+        path = object_path(root, object_hash)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return {'object_hash': object_hash, 'object_size': os.path.getsize(path), 'csv_size': csv_size,
+            'source_size': source_size, 'source_sha256': source_sha256}
+
+
+class SliceCache:
+    def __init__(self, root=CACHE_ROOT, max_bytes=CACHE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.join(root, 'objects'), exist_ok=True)
+        # Short transactions; the downloader and the watchdog may use the cache at the same time
+        self.db = sqlite3.connect(os.path.join(root, 'index.sqlite'), timeout=60, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS slices (
+                slice_key TEXT PRIMARY KEY,
+                object_hash TEXT NOT NULL,
+                object_size INTEGER NOT NULL,
+                csv_size INTEGER NOT NULL,
+                source_size INTEGER NOT NULL,
+                source_sha256 TEXT NOT NULL,
+                etag TEXT,
+                cached_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        self.db.execute("CREATE INDEX IF NOT EXISTS slices_last_used ON slices (last_used)")
+
+    def object_path(self, object_hash):
+        return object_path(self.root, object_hash)
+
+    def entry(self, key):
+        """The index row of a cached slice as a dict, or None."""
+        cursor = self.db.execute("SELECT * FROM slices WHERE slice_key = ?", (key,))
+        row = cursor.fetchone()
+        return dict(zip([column[0] for column in cursor.description], row)) if row else None
+
+    def entries(self, dates=None):
+        cursor = self.db.execute("SELECT * FROM slices ORDER BY slice_key")
+        columns = [column[0] for column in cursor.description]
+        rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+        if dates is not None:
+            rows = [row for row in rows if row['slice_key'][:8] in dates]
+        return rows
+
+    def is_current(self, key, source_size=None, etag=None):
+        """
+        True if the slice is cached and its object is intact on disk, and it matches the
+        archive's current Content-Length and ETag where those are known.
+        """
+        entry = self.entry(key)
+        if entry is None:
+            return False
+        if source_size is not None and entry['source_size'] != source_size:
+            return False
+        if etag is not None and entry['etag'] is not None and entry['etag'] != etag:
+            return False
+        path = self.object_path(entry['object_hash'])
+        return os.path.exists(path) and os.path.getsize(path) == entry['object_size']
+
+    def put(self, key, gz_path, etag=None):
+        """Recompress a downloaded .csv.gz slice into the cache. Returns its index row."""
+        return self.add(key, store_object(self.root, gz_path), etag)
+
+    def add(self, key, stored, etag=None):
+        """Index an object written by store_object under `key`."""
+        now = time.time()
+        self.db.execute("""
+            INSERT OR REPLACE INTO slices (slice_key, object_hash, object_size, csv_size, source_size,
+                                           source_sha256, etag, cached_at, last_used)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (key, stored['object_hash'], stored['object_size'], stored['csv_size'], stored['source_size'],
+              stored['source_sha256'], etag, now, now))
+        logging.info(f"Cached {key}: {stored['source_size'] / 1e6:.1f} MB gzip -> {stored['object_size'] / 1e6:.1f} MB zstd")
+        self.evict()
+        return self.entry(key)
+
+    def touch(self, key):
+        self.db.execute("UPDATE slices SET last_used = ? WHERE slice_key = ?", (time.time(), key))
+
+    def total_bytes(self):
+        """Bytes on disk; objects shared by several slices are counted once."""
+        cursor = self.db.execute("SELECT COALESCE(SUM(object_size), 0) FROM (SELECT DISTINCT object_hash, object_size FROM slices)")
+        return cursor.fetchone()[0]
+
+    def remove(self, key):
+        entry = self.entry(key)
+        if entry is None:
+            return
+        self.db.execute("DELETE FROM slices WHERE slice_key = ?", (key,))
+        shared = self.db.execute("SELECT 1 FROM slices WHERE object_hash = ? LIMIT 1", (entry['object_hash'],)).fetchone()
+        if shared is None:
+            try:
+                os.remove(self.object_path(entry['object_hash']))
+            except FileNotFoundError:
+                pass
+
+    def evict(self):
+        """Remove the least recently used slices until the cache fits in max_bytes."""
+        evicted = 0
+        while self.total_bytes() > self.max_bytes:
+            row = self.db.execute("SELECT slice_key FROM slices ORDER BY last_used LIMIT 1").fetchone()
+            if row is None:
+                break
+            self.remove(row[0])
+            evicted += 1
+        if evicted:
+            logging.info(f"Evicted {evicted} slices from the cache at {self.root}")
+
+    def verify(self, key):
+        """Decompress and rehash a cached slice. Removes it from the cache if it does not match."""
+        entry = self.entry(key)
+        try:
+            with pa.input_stream(self.object_path(entry['object_hash']), compression=CACHE_COMPRESSION) as source:
+                object_hash, csv_size = _copy_hashed(source, None)
+            valid = object_hash == entry['object_hash'] and csv_size == entry['csv_size']
+        except (OSError, pa.ArrowException) as e:
+            logging.error(f"Failed to read cached slice {key}: {e}")
+            valid = False
+        if not valid:
+            logging.warning(f"Cached slice {key} is corrupt, removing it")
+            self.remove(key)
+        return valid
+
+    def close(self):
+        self.db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarise or verify the local slice cache.")
+    parser.add_argument('--cache-dir', default=CACHE_ROOT)
+    parser.add_argument('--verify', action='store_true', help="Rehash every cached slice and drop the corrupt ones")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    cache = SliceCache(args.cache_dir)
+    entries = cache.entries()
+    if args.verify:
+        corrupt = sum(not cache.verify(entry['slice_key']) for entry in entries)
+        print(f"Verified {len(entries)} slices, {corrupt} corrupt")
+        entries = cache.entries()
+    source_bytes = sum(entry['source_size'] for entry in entries)
+    print(f"{len(entries)} slices ({len(set(entry['slice_key'][:8] for entry in entries))} dates) in {args.cache_dir}: "
+          f"{cache.total_bytes() / 1e9:.2f} GB zstd for {source_bytes / 1e9:.2f} GB of downloads "
+          f"(limit {cache.max_bytes / 1e9:.0f} GB)")
+    cache.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+import os
+import re
+import time
+import threading
+import logging
+from watchdog.events import FileSystemEventHandler
+
+# Filesystem events of the slice downloads, shared by watchdog_v2.py and watchdog_small.py.
+# No logging configuration here: each script sets up its own log file.
+
+# Slices are reported ready this long after their last filesystem event
+slice_debounce_seconds = float(os.getenv('SLICE_DEBOUNCE_SECONDS', '0.05'))
+
+class SliceDebouncer:
+    """
+    Collects "slice is complete" events from the observer thread and puts each slice on
+    the queue once no further event arrived for it within `delay` seconds. The observer
+    thread only records a timestamp, so it never blocks other filesystem events.
+    """
+    def __init__(self, directories_queue, delay=slice_debounce_seconds):
+        self.directories_queue = directories_queue
+        self.delay = delay
+        self.pending = {}
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def touch(self, path):
+        with self.condition:
+            self.pending[path] = time.monotonic()
+            self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.pending:
+                    self.condition.wait()
+                now = time.monotonic()
+                ready = [path for path, last_event in self.pending.items() if now - last_event >= self.delay]
+                if not ready:
+                    self.condition.wait(self.delay - (now - max(self.pending.values())))
+                    continue
+                for path in ready:
+                    del self.pending[path]
+            for path in ready:
+                logging.info(f"Slice ready: {path}")
+                self.directories_queue.put(path)
+
+class DirectoryHandler(FileSystemEventHandler):
+    def __init__(self, debouncer):
+        self.debouncer = debouncer
+
+    def on_created(self, event):
+        if event.is_directory and is_valid_directory(os.path.basename(event.src_path)):
+            logging.info(f"Directory detected: {event.src_path}")
+
+    def on_moved(self, event):
+        # The downloader writes 'HH.csv.gz.part' and renames it once the download is complete
+        if not event.is_directory and is_slice(event.dest_path):
+            self.debouncer.touch(event.dest_path)
+
+    def on_closed(self, event):
+        # Slices copied in place are complete once the writer closes them (inotify IN_CLOSE_WRITE)
+        if not event.is_directory and is_slice(event.src_path):
+            self.debouncer.touch(event.src_path)
+
+def is_valid_directory(directory_name):
+    """Check if the directory name matches the 'YYYYMMDD' format."""
+    return re.match(r'^\d{8}$', directory_name) is not None
+
+def is_slice(path):
+    """Complete slices are named 'data/YYYYMMDD/HH.csv.gz'; partial downloads end with '.part'."""
+    return path.endswith('.csv.gz') and is_valid_directory(os.path.basename(os.path.dirname(path)))
@@ -0,0 +1,36 @@
+import re
+import logging
+
+# The date files of the backfill, shared by download_slices.py, stream_ingest.py and
+# plan_slices.py. No logging configuration here: each script sets up its own log file.
+
+DOMAIN = "https://archive.blocknative.com/"
+
+
+def parse_hours(value):
+    """'18' -> [18], '0-23' -> [0..23], '6,18' -> [6, 18]."""
+    hours = []
+    for part in value.split(','):
+        if '-' in part:
+            start, end = part.split('-')
+            hours += range(int(start), int(end) + 1)
+        else:
+            hours.append(int(part))
+    return hours
+
+
+def read_plan(date_file, hours):
+    """
+    (date, hours) pairs from a date file. A line is either 'YYYYMMDD', which gets the default
+    `hours`, or 'YYYYMMDD HH,HH' as written by plan_slices.py for partly loaded dates.
+    Carriage returns and invalid lines are skipped.
+    """
+    plan = []
+    with open(date_file) as file:
+        for line in file:
+            fields = line.split()
+            if 1 <= len(fields) <= 2 and re.match(r'^\d{8}$', fields[0]):
+                plan.append((fields[0], parse_hours(fields[1]) if len(fields) == 2 else hours))
+            elif fields:
+                logging.warning(f"Invalid date format: {line.strip()}. Skipping.")
+    return plan
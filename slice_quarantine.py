@@ -0,0 +1,93 @@
+import os
+import re
+import logging
+from blocknative_reader import BLOCKNATIVE_COLUMNS
+
+# Lines with the wrong number of fields are repaired or moved to a side file here:
+# <root>/YYYYMMDD/HH.tsv with one "line number, action, raw line" record per line.
+QUARANTINE_ROOT = os.getenv('QUARANTINE_ROOT', os.path.join(os.getcwd(), 'quarantine'))
+
+EXPECTED_FIELDS = len(BLOCKNATIVE_COLUMNS)
+
+# 'failurereason' is the only free-text field, and the one that carries stray tabs and
+# quotes in the archive (20210423 line 150432, 20210601 line 76601).
+FAILUREREASON_INDEX = BLOCKNATIVE_COLUMNS.index('failurereason')
+
+# Integer fields around 'failurereason' that must parse after a repair, otherwise the
+# extra fields did not come from it and the line is quarantined instead.
+CHECKED_INDEXES = [BLOCKNATIVE_COLUMNS.index(column) for column in ('curblocknumber', 'blockspending', 'timepending', 'nonce')]
+INTEGER_FIELD = re.compile(r'^\d*$')
+
+REPAIRED = 'repaired'
+QUARANTINED = 'quarantined'
+
+
+def quarantine_path(root, key):
+    """'20210423/18.csv.gz' -> '<root>/20210423/18.tsv'."""
+    return os.path.join(root, key[:-len('.csv.gz')] + '.tsv')
+
+
+def repair_line(fields, expected_fields=EXPECTED_FIELDS):
+    """
+    Merge the surplus fields of a line back into 'failurereason'. The embedded tabs become
+    spaces and quotes are dropped, so the field is plain text for the CSV parser.
+    Returns the repaired line, or None if the line cannot be repaired safely.
+    """
+    extra = len(fields) - expected_fields
+    if extra <= 0:
+        return None
+    end = FAILUREREASON_INDEX + extra + 1
+    reason = ' '.join(fields[FAILUREREASON_INDEX:end]).replace('"', '')
+    repaired = fields[:FAILUREREASON_INDEX] + [reason] + fields[end:]
+    if not all(INTEGER_FIELD.match(repaired[index]) for index in CHECKED_INDEXES):
+        return None
+    return '\t'.join(repaired)
+
+
+class SliceQuarantine:
+    """
+    Bad-line handler for read_slice. The parser keeps running on the whole slice and only
+    hands over the lines with the wrong number of fields: lines with surplus fields in the
+    full 27-field schema are repaired and parsed again after the slice (see
+    take_repaired_lines), everything else is written to the side file and dropped.
+    Every repaired or quarantined line is recorded in the side file with its line number.
+    """
+    def __init__(self, side_path):
+        self.side_path = side_path
+        self.repaired = 0
+        self.quarantined = 0
+        self._repaired_lines = []
+        self._side_file = None
+
+    def handle_invalid_row(self, row):
+        text = row.text.rstrip('\r\n')
+        repaired = None
+        # Older archive files have fewer columns; their field positions are not known here
+        if row.expected_columns == EXPECTED_FIELDS:
+            repaired = repair_line(text.split('\t'))
+        if repaired is not None:
+            self.repaired += 1
+            self._repaired_lines.append(repaired)
+            self._record(row.number, REPAIRED, text)
+        else:
+            self.quarantined += 1
+            self._record(row.number, QUARANTINED, text)
+        return 'skip'
+
+    def take_repaired_lines(self):
+        """The repaired lines collected so far, as CSV data without a header."""
+        lines, self._repaired_lines = self._repaired_lines, []
+        return ''.join(line + '\n' for line in lines).encode()
+
+    def _record(self, line_number, action, text):
+        if self._side_file is None:
+            os.makedirs(os.path.dirname(self.side_path), exist_ok=True)
+            self._side_file = open(self.side_path, 'w', encoding='utf-8')
+        self._side_file.write(f"{line_number}\t{action}\t{text}\n")
+
+    def close(self):
+        if self._side_file is not None:
+            self._side_file.close()
+            self._side_file = None
+        if self.repaired or self.quarantined:
+            logging.warning(f"{self.repaired} lines repaired, {self.quarantined} lines quarantined, see {self.side_path}")
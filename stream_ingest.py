@@ -0,0 +1,177 @@
+import io
+import os
+import sys
+import time
+import hashlib
+import logging
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import requests
+import pyarrow as pa
+# watchdog_v2 is imported first, so its logging configuration (logs/filesystem_write.log) is the one in effect
+import watchdog_v2
+from watchdog_v2 import File, ingest_slice, init_ingest_worker, metrics_publisher, create_transactions_table, wait_for_db
+from ingest_manifest import create_manifest_table, slice_key, LOADED, FAILED
+from ingest_metrics import SliceMetrics
+from slice_plan import DOMAIN, read_plan, parse_hours
+from http_retry import RETRY_STATUSES, RetryableError, retry_after_seconds, backoff_seconds
+
+# Streaming mode: every slice goes from the HTTP response through Arrow's gzip decoder
+# straight into the parser and the sinks of watchdog_v2, without being written to data/
+# and read back. With --tee-dir the compressed bytes are also kept on disk for archival.
+#
+# Usage: python stream_ingest.py one_hour_dates.txt --parallel 4 --tee-dir archive
+
+# Compressed bytes requested from the response per read
+RESPONSE_READ_BYTES = 1024 * 1024
+
+# requests session of this pool process, so connections are kept alive between slices
+session = None
+
+
+class ResponseBody(io.RawIOBase):
+    """
+    The compressed response body as a file object for Arrow's gzip decoder. The bytes are
+    hashed for the ingest manifest and copied to `tee_path` on the way through. Network
+    errors are kept in `error`, so that the caller can tell them from bad data and retry.
+    """
+    def __init__(self, response, tee_path=None):
+        self.raw = response.raw
+        self.tee_path = tee_path
+        self.tee = None
+        self.sha256 = hashlib.sha256()
+        self.bytes_read = 0
+        self.error = None
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        try:
+            data = self.raw.read(len(buffer), decode_content=False)
+        except Exception as e:
+            self.error = e
+            raise
+        if self.tee_path is not None and self.tee is None:
+            os.makedirs(os.path.dirname(self.tee_path), exist_ok=True)
+            self.tee = open(self.tee_path, 'wb')
+        self.sha256.update(data)
+        if self.tee is not None:
+            self.tee.write(data)
+        self.bytes_read += len(data)
+        buffer[:len(data)] = data
+        return len(data)
+
+    def content_hash(self):
+        """SHA-256 of the whole body. The gzip decoder may stop before the end of the body, so the rest is read first."""
+        while self.readinto(bytearray(RESPONSE_READ_BYTES)):
+            pass
+        return self.sha256.hexdigest()
+
+    def close(self):
+        if self.tee is not None:
+            self.tee.close()
+            self.tee = None
+        super().close()
+
+
+def init_stream_worker():
+    global session
+    init_ingest_worker()
+    session = requests.Session()
+
+
+def stream_slice(url, path, tee_dir, retries, queued_at):
+    """
+    Runs in a pool process: stream one slice from `url` into the sinks, as if it had been
+    downloaded to `path`. A slice that fails because of the network is retried from the
+    start; its transaction was rolled back. Returns the slice's metrics record.
+    """
+    key = slice_key(path)
+    tee_path = os.path.join(tee_dir, key) if tee_dir else None
+    part_path = f"{tee_path}.part" if tee_path else None
+
+    for attempt in range(retries + 1):
+        metrics = SliceMetrics(key, queued_at)
+        body = None
+        try:
+            with session.get(url, stream=True, timeout=(30, 120)) as response:
+                if response.status_code == 404:
+                    logging.warning(f"File not found (404): {url}")
+                    return metrics.as_record('missing')
+                if response.status_code in RETRY_STATUSES:
+                    raise RetryableError(f"HTTP {response.status_code}", retry_after_seconds(response.headers.get('Retry-After')))
+                response.raise_for_status()
+                if 'Content-Length' not in response.headers:
+                    # The manifest identifies a slice by its size before reading it
+                    logging.error(f"No Content-Length for {url}; use download_slices.py for this archive")
+                    return metrics.as_record(FAILED)
+
+                with ResponseBody(response, part_path) as body:
+                    source = pa.CompressedInputStream(pa.PythonFile(body, mode='r'), 'gzip')
+                    status = ingest_slice(File(path, source), int(response.headers['Content-Length']), metrics, body.content_hash)
+            if status == FAILED and body.error is not None:
+                raise RetryableError(f"connection failed while streaming: {body.error}")
+        except (RetryableError, requests.RequestException) as e:
+            if part_path is not None and os.path.exists(part_path):
+                os.remove(part_path)
+            if attempt == retries:
+                logging.error(f"Retry limit reached for {url}: {e}")
+                return metrics.as_record(FAILED)
+            retry_after = getattr(e, 'retry_after', None)
+            delay = retry_after if retry_after is not None else backoff_seconds(attempt)
+            logging.warning(f"{e} for {url}. Retrying in {delay:.1f} seconds...")
+            time.sleep(delay)
+            continue
+
+        if part_path is not None and os.path.exists(part_path):
+            if status == LOADED:
+                os.replace(part_path, tee_path)
+            else:
+                os.remove(part_path)
+        return metrics.as_record(status)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stream Blocknative archive slices straight into the database.")
+    parser.add_argument('date_file', help="File with one YYYYMMDD date per line, e.g. dates.txt, or a plan from plan_slices.py")
+    parser.add_argument('--hours', default='18', help="Hours to load per date, e.g. 18, 0-23 or 6,18 (default: 18)")
+    parser.add_argument('--parallel', type=int, default=watchdog_v2.ingest_workers, help="Slices streamed at the same time")
+    parser.add_argument('--retries', type=int, default=5, help="Retries per slice on 429/5xx and connection errors")
+    parser.add_argument('--base-url', default=DOMAIN, help="Archive URL, e.g. the local archive_stub_server.py")
+    parser.add_argument('--tee-dir', help="Also keep the downloaded .csv.gz files here, as YYYYMMDD/HH.csv.gz")
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.date_file):
+        logging.error(f"Date file not found: {args.date_file}")
+        sys.exit(1)
+    if not wait_for_db(watchdog_v2.engine):
+        logging.error("Could not connect to the database. Exiting...")
+        sys.exit(1)
+    create_transactions_table(watchdog_v2.engine)
+    create_manifest_table(watchdog_v2.engine)
+
+    base_url = args.base_url if args.base_url.endswith('/') else args.base_url + '/'
+    start_time = time.perf_counter()
+    statuses = {}
+    pool = ProcessPoolExecutor(max_workers=args.parallel, mp_context=multiprocessing.get_context('spawn'),
+                               initializer=init_stream_worker)
+    with pool:
+        futures = []
+        for date, hours in read_plan(args.date_file, parse_hours(args.hours)):
+            for hour in hours:
+                file_name = f"{hour:02d}.csv.gz"
+                futures.append(pool.submit(stream_slice, f"{base_url}{date}/{file_name}",
+                                           os.path.join('data', date, file_name), args.tee_dir, args.retries, time.time()))
+        for future in as_completed(futures):
+            record = future.result()
+            metrics_publisher.publish(record)
+            statuses[record['status']] = statuses.get(record['status'], 0) + 1
+
+    logging.info(f"Streaming completed in {time.perf_counter() - start_time:.1f}s: {statuses}")
+    sys.exit(0 if not statuses.get(FAILED) else 1)
+
+
+if __name__ == '__main__':
+    main()
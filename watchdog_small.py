@@ -1,15 +1,16 @@
 import os
-import re
 import time
 import pandas as pd
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, inspect, text
 from sqlalchemy import Column, Table, MetaData, TIMESTAMP, VARCHAR, NUMERIC, INTEGER, BIGINT, Index
 from sqlalchemy.exc import OperationalError
 from watchdog.observers import Observer
-from watchdog.events import FileSystemEventHandler
 import threading
 from queue import Queue
 import logging
+from bulk_loader import BatchBuilder, bulk_merge_frames, DEFAULT_MAX_BATCH_BYTES
+from blocknative_reader import read_slice, TRANSACTIONS_SMALL_COLUMNS
+from slice_events import SliceDebouncer, DirectoryHandler, is_valid_directory
 
 # Create the logs directory if it does not exist
 log_directory = "logs"
@@ -62,7 +63,7 @@ def create_transactions_table(engine, metadata):
     # Define the 'transactions' table structure
     transactions_table = Table(table_name, metadata,
         Column('detecttime', TIMESTAMP),
-        Column('hash', VARCHAR(256)),
+        Column('hash', VARCHAR(256), primary_key=True),
         Column('curblocknumber', NUMERIC(18), index=True),
         Column('blockspending', INTEGER),
         Column('timepending', BIGINT),
@@ -73,141 +74,132 @@ def create_transactions_table(engine, metadata):
     )
     # Create the table
     metadata.create_all(engine)
+    ensure_hash_key(engine)
     logging.info("Table 'transactions' has been created/ensured in the database, with 'hash' as the primary key.")
 
-# Queue for directories to be processed
-directories_queue = Queue()
-
-class DirectoryHandler(FileSystemEventHandler):
-    def __init__(self, directories_queue):
-        self.directories_queue = directories_queue
-
-    def on_created(self, event):
-        if event.is_directory and is_valid_directory(os.path.basename(event.src_path)):
-            logging.info(f"Directory detected: {event.src_path}")
-            # Wait a bit before processing the directory to allow files to appear
-            time.sleep(10)  # Adjust the sleep time based on your needs
-            self.directories_queue.put(event.src_path)
+def has_hash_key(engine):
+    """Whether 'hash' alone is the primary key or has a unique index, as ON CONFLICT ("hash") needs."""
+    inspector = inspect(engine)
+    keys = [inspector.get_pk_constraint(table_name)['constrained_columns']]
+    keys += [index['column_names'] for index in inspector.get_indexes(table_name) if index['unique']]
+    keys += [constraint['column_names'] for constraint in inspector.get_unique_constraints(table_name)]
+    return ['hash'] in keys
 
-def is_valid_directory(directory_name):
-    """Check if the directory name matches the 'YYYYMMDD' format."""
-    return re.match(r'^\d{8}$', directory_name) is not None
+def ensure_hash_key(engine):
+    """
+    create_all leaves a 'transactions' table from the old schema as it is, without a key on 'hash'.
+    Its duplicate hashes are removed, keeping the first row as the merge does, and the primary key is added.
+    """
+    if has_hash_key(engine):
+        return
+    with engine.begin() as connection:
+        if connection.execute(text(f"SELECT EXISTS (SELECT 1 FROM {table_name} WHERE hash IS NULL)")).scalar():
+            message = f"Table '{table_name}' has rows without a hash, so 'hash' cannot become its primary key. Remove them and start again."
+            logging.error(message)
+            raise RuntimeError(message)
+        logging.info(f"Table '{table_name}' has no key on 'hash', removing duplicate hashes and adding the primary key...")
+        result = connection.execute(text(f"DELETE FROM {table_name} a USING {table_name} b WHERE a.hash = b.hash AND a.ctid > b.ctid"))
+        connection.execute(text(f"ALTER TABLE {table_name} ADD PRIMARY KEY (hash)"))
+        logging.info(f"Removed {result.rowcount} duplicate rows and added the primary key on 'hash' to '{table_name}'.")
+
+# Queue for directories and ready slices to be processed
+directories_queue = Queue()
 
 def directory_processing_worker(engine, directories_queue):
     while True:
-        directory_path = directories_queue.get()
-        if directory_path is None:  # Sentinel value to stop the loop
+        path = directories_queue.get()
+        if path is None:  # Sentinel value to stop the loop
             directories_queue.task_done()
             break
 
-        logging.info(f"Processing target directory: {directory_path}")
-        # Here, we actually call the function to process the directory's contents
-        process_and_load_data(engine, directory_path)
+        logging.info(f"Processing target: {path}")
+        # Here, we actually call the function to process the directory's or slice's contents
+        process_and_load_data(engine, path)
         directories_queue.task_done()
 
 class File:
     def __init__(self, path):
         self.path = path
-        self.is_skipped = False
-        self.data = None  # Placeholder for the data contained in the file
-
-    def check_write_complete(self, max_wait_time=360, sleep_interval=2):
-        start_time = time.time()
-        last_size = -1
-        last_mod_time = -1
-
-        while (time.time() - start_time) < max_wait_time:
-            try:
-                stats = os.stat(self.path)
-                current_size = stats.st_size
-                current_mod_time = stats.st_mtime
-
-                logging.info(f"Checking file: {self.path}, size: {current_size}, modified: {current_mod_time}")
-
-                if current_size == last_size and last_mod_time == current_mod_time:
-                    logging.info("File download/write appears complete.")
-                    return True
-                else:
-                    last_size = current_size
-                    last_mod_time = current_mod_time
-                    time.sleep(sleep_interval)
-            except Exception as e:
-                logging.warning(f"Error checking file: {e}")
-                time.sleep(sleep_interval)
-                continue
 
-        self.is_skipped = True
-        logging.warning(f"File may still be writing or download incomplete after maximum wait time: {self.path}")
-        return False
-
-    def load_data(self):
+    def load_data(self, batch):
+        """Stream the slice chunk by chunk into a BatchBuilder. Returns False if it could not be loaded."""
         try:
-            self.data = pd.read_csv(self.path, sep='\t', compression='gzip', on_bad_lines='warn')
-            # Convert double precision 'stuck' values to boolean:
-            # self.data['stuck'] = self.data['stuck'].map({1: True, 0: False, 'true': True, 'false': False, 'True': True, 'False': False}).fillna(False)
-            # Filter the DataFrame for the desired conditions
-            self.data = self.data[(self.data['status'] == 'confirmed') & (self.data['region'] == 'us-east-1') & (self.data['network'] == 'main')]
-            
-            # only consider the columns you want to have, don't drop later
-            
-            # Drop the unneeded columns, in some files 'dropreason' column don't exist at all.
-            # if 'dropreason' not in self.data.columns:
-            #     self.data['dropreason'] = None
-            self.data = self.data.drop(columns=['reorg', 'replace', 'gas', 'value', 'toaddress', 'fromaddress', 'dropreason', 'input', 'type', 'maxpriorityfeepergas', 'maxfeepergas', 'basefeepergas', 'rejectionreason', 'stuck', 'status', 'region', 'failurereason', 'network'])
+            # Only the columns of the reduced table are parsed; chunks are already
+            # filtered down to confirmed us-east-1 mainnet transactions.
+            for chunk in read_slice(self.path, TRANSACTIONS_SMALL_COLUMNS):
+                batch.add(chunk)
             return True
         except Exception as e:
             logging.error(f"Error loading data from file {self.path}: {e}")
             return False
 
-def process_and_load_data(engine, directory_path):
-    root_directory = os.path.dirname(directory_path)  # This should give you the directory containing 'data'
-    skipped_directory_path = os.path.join(root_directory, 'skipped_data')  # This sets 'skipped_data' at the same level as 'data'
-    
-    if not os.path.exists(skipped_directory_path):
-        os.makedirs(skipped_directory_path)
-
-    accumulator_df = pd.DataFrame()
-    batch_size = 10000
-    directories_to_check = set()
+def delete_file(path):
+    try:
+        os.remove(path)
+        logging.info(f"Deleted processed file: {path}")
+    except Exception as e:
+        logging.error(f"Failed to delete processed file {path}: {e}")
 
-    for root, _, files in os.walk(directory_path):
+class SliceMerge:
+    """
+    BatchBuilder sink that merges a batch into the transactions table and then deletes the
+    slices whose last chunk was in it, so a slice only goes away once all its rows are committed.
+    """
+    def __init__(self, engine):
+        self.engine = engine
+        self.pending = []
+
+    def __call__(self, frames):
+        rows = bulk_merge_frames(self.engine, frames, table_name, key='hash')
+        for path in self.pending:
+            delete_file(path)
+        self.pending = []
+        return rows
+
+    def loaded(self, path, batch):
+        """Called once every chunk of the slice at `path` has been added to `batch`."""
+        if batch.frames:
+            self.pending.append(path)
+        else:
+            # The last chunk was written by the flush it triggered
+            delete_file(path)
+
+def list_slices(path):
+    """A slice reported by an event, or all .csv.gz slices below a directory."""
+    if not os.path.isdir(path):
+        return [path]
+    slices = []
+    for root, _, files in os.walk(path):
         for file_name in files:
             if file_name.endswith('.csv.gz'):
-                file_obj = File(os.path.join(root, file_name))
-                directories_to_check.add(root)  # Track directories for later cleanup
-
-                if not file_obj.check_write_complete():
-                    try:
-                        new_path = os.path.join(skipped_directory_path, os.path.basename(file_obj.path))
-                        os.rename(file_obj.path, new_path)
-                        logging.info(f"Moved incomplete file to 'skipped_data': {new_path}")
-                    except Exception as e:
-                        logging.error(f"Failed to move incomplete file {file_obj.path} to 'skipped_data': {e}")
-                    continue
+                slices.append(os.path.join(root, file_name))
+    return slices
+
+def process_and_load_data(engine, path):
+    # Parsed chunks are collected as they are read and written with one COPY once the batch is big enough.
+    # The batch goes through a staging table, so duplicate hashes are merged instead of failing the batch.
+    # A batch that fails to write is kept and written again with the next one.
+    merge = SliceMerge(engine)
+    batch = BatchBuilder(merge, DEFAULT_MAX_BATCH_BYTES)
+    directories_to_check = set()
 
-                if file_obj.load_data():
-                    accumulator_df = pd.concat([accumulator_df, file_obj.data], ignore_index=True)
+    for slice_path in list_slices(path):
+        if not os.path.exists(slice_path):
+            # Reported twice (e.g. by the startup scan and by an event) and already loaded
+            continue
+        file_obj = File(slice_path)
+        directories_to_check.add(os.path.dirname(slice_path))  # Track directories for later cleanup
 
-                    if len(accumulator_df) >= batch_size:
-                        try:
-                            accumulator_df.to_sql(name=table_name, con=engine, if_exists='append', index=False)
-                            accumulator_df = pd.DataFrame()
-                        except Exception as e:
-                            logging.error(f"Failed to write batch to database: {e}")
-                    
-                    try:
-                        os.remove(file_obj.path)
-                        logging.info(f"Deleted processed file: {file_obj.path}")
-                    except Exception as e:
-                        logging.error(f"Failed to delete processed file {file_obj.path}: {e}")
-                else:
-                    logging.error(f"Failed to process file: {file_obj.path}")
+        if file_obj.load_data(batch):
+            merge.loaded(file_obj.path, batch)
+        else:
+            logging.error(f"Failed to process file: {file_obj.path}")
 
-    if not accumulator_df.empty:
-        try:
-            accumulator_df.to_sql(name=table_name, con=engine, if_exists='append', index=False)
-        except Exception as e:
-            logging.error(f"Failed to write remaining data to database: {e}")
+    try:
+        batch.flush()
+    except Exception as e:
+        # The slices of the failed batch stay on disk and are loaded again on the next run
+        logging.error(f"Failed to write remaining data to database, keeping {len(merge.pending)} files: {e}")
 
     # Cleanup: Delete empty directories
     for dir_path in directories_to_check:
@@ -243,16 +235,19 @@ if __name__ == "__main__":
         os.makedirs(directory_path)
         logging.info(f"Created 'data' directory at {directory_path}")
 
-    # Enqueue existing directories with the correct format within the "data" directory
+    # Enqueue existing directories with the correct format within the "data" directory.
+    # Downloads are renamed to their final name only once complete, so every slice found here can be loaded.
     for item in os.listdir(directory_path):
         item_path = os.path.join(directory_path, item)
         if os.path.isdir(item_path) and is_valid_directory(os.path.basename(item)):
             directories_queue.put(item_path)
 
-    # Setup Watchdog observer to monitor the "data" directory
-    event_handler = DirectoryHandler(directories_queue)
+    # Setup Watchdog observer to monitor the "data" directory and the YYYYMMDD directories inside it
+    debouncer = SliceDebouncer(directories_queue)
+    debouncer.start()
+    event_handler = DirectoryHandler(debouncer)
     observer = Observer()
-    observer.schedule(event_handler, directory_path, recursive=False)
+    observer.schedule(event_handler, directory_path, recursive=True)
     observer.start()
 
     # Start the directory processing worker
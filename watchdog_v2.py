@@ -1,14 +1,25 @@
 import os
-import re
 import time
 import pandas as pd
 from sqlalchemy import create_engine, text
 from sqlalchemy.exc import OperationalError
 from watchdog.observers import Observer
-from watchdog.events import FileSystemEventHandler
 import threading
-from queue import Queue
+from queue import Queue, Empty
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait
 import logging
+import argparse
+import pyarrow as pa
+from bulk_loader import BatchBuilder, StagingMerge, DEFAULT_MAX_BATCH_BYTES
+from blocknative_reader import read_slice, TRANSACTIONS_COLUMNS
+from ingest_manifest import create_manifest_table, file_sha256, is_loaded, loaded_slices, record_slice, slice_key, utc_now, LOADED, FAILED
+from parquet_sink import ParquetSliceWriter, parquet_schema, PARQUET_ROOT
+from slice_quarantine import SliceQuarantine, quarantine_path, QUARANTINE_ROOT
+from ingest_metrics import MetricsPublisher, SliceMetrics
+from ingest_summary import read_dates
+from slice_cache import SliceCache, CACHE_ROOT
+from slice_events import SliceDebouncer, DirectoryHandler, is_valid_directory
 
 # Create the logs directory if it does not exist
 log_directory = "logs"
@@ -34,7 +45,22 @@ db_params = {
 }
 
 # Create a SQLAlchemy engine
-engine = create_engine(f"postgresql://{db_params['user']}:{db_params['password']}@{db_params['host']}:{db_params['port']}/{db_params['database']}")
+database_url = f"postgresql://{db_params['user']}:{db_params['password']}@{db_params['host']}:{db_params['port']}/{db_params['database']}"
+engine = create_engine(database_url)
+
+# Number of processes that parse and load slices in parallel
+ingest_workers = int(os.getenv('INGEST_WORKERS', os.cpu_count() or 1))
+max_batch_bytes = DEFAULT_MAX_BATCH_BYTES
+
+# Where processed slices are written: 'postgres', 'parquet' or both ('postgres,parquet').
+# The ingest manifest stays in Postgres either way.
+INGEST_SINKS = ('postgres', 'parquet')
+ingest_sinks = [sink.strip() for sink in os.getenv('INGEST_SINKS', 'postgres').split(',') if sink.strip()]
+parquet_root = PARQUET_ROOT
+# 'stuck' is converted to boolean before it reaches the sinks
+transactions_parquet_schema = parquet_schema(TRANSACTIONS_COLUMNS, {'stuck': pa.bool_()})
+# Side files for lines with the wrong number of fields
+quarantine_root = QUARANTINE_ROOT
 
 def wait_for_db(engine, max_retries=10, delay_between_retries=5):
     """Wait for the database to become available by attempting to connect."""
@@ -53,7 +79,7 @@ def wait_for_db(engine, max_retries=10, delay_between_retries=5):
     return False
 
 def create_transactions_table(engine):
-    with engine.connect() as connection:
+    with engine.begin() as connection:
         connection.execute(text("""
             CREATE TABLE IF NOT EXISTS transactions (
                 detecttime TIMESTAMP,
@@ -87,143 +113,327 @@ def create_transactions_table(engine):
         # However, if you have other columns you frequently query by, you can create indexes for those.
 
         logging.info("Table 'transactions' has been created/ensured in the database, with 'hash' as the primary key.")
-# Queue for directories to be processed
-directories_queue = Queue()
-
-class DirectoryHandler(FileSystemEventHandler):
-    def __init__(self, directories_queue):
-        self.directories_queue = directories_queue
 
-    def on_created(self, event):
-        if event.is_directory and is_valid_directory(os.path.basename(event.src_path)):
-            logging.info(f"Directory detected: {event.src_path}")
-            # Wait a bit before processing the directory to allow files to appear
-            time.sleep(10)  # Adjust the sleep time based on your needs
-            self.directories_queue.put(event.src_path)
+# Archive files store 'stuck' as text or as a double precision flag
+STUCK_VALUES = {'1': True, '1.0': True, 'true': True, 'True': True, '0': False, '0.0': False, 'false': False, 'False': False}
 
-def is_valid_directory(directory_name):
-    """Check if the directory name matches the 'YYYYMMDD' format."""
-    return re.match(r'^\d{8}$', directory_name) is not None
+# Queue for directories and ready slices to be processed
+directories_queue = Queue()
 
-def directory_processing_worker(engine, directories_queue):
+def directory_processing_worker(directories_queue, pool):
+    in_flight = []
     while True:
-        directory_path = directories_queue.get()
-        if directory_path is None:  # Sentinel value to stop the loop
+        paths = [directories_queue.get()]
+        # Take everything else that is already waiting, so that slices can be ordered by size across directories
+        while True:
+            try:
+                paths.append(directories_queue.get_nowait())
+            except Empty:
+                break
+
+        stop = None in paths  # Sentinel value to stop the loop
+        for _ in range(paths.count(None)):
             directories_queue.task_done()
-            break
+        paths = [path for path in paths if path is not None]
+
+        for path in paths:
+            logging.info(f"Processing target: {path}")
+        # Here, we actually call the function to process the directories' and slices' contents
+        in_flight = [future for future in in_flight if not future.done()]
+        in_flight += process_and_load_data(pool, paths, directories_queue)
 
-        logging.info(f"Processing target directory: {directory_path}")
-        # Here, we actually call the function to process the directory's contents
-        process_and_load_data(engine, directory_path)
-        directories_queue.task_done()
+        if stop:
+            # Let the slices that were already handed to the pool finish before exiting
+            wait(in_flight)
+            break
 
 class File:
-    def __init__(self, path):
+    def __init__(self, path, source=None):
         self.path = path
-        self.is_skipped = False
-        self.data = None  # Placeholder for the data contained in the file
-
-    def check_write_complete(self, max_wait_time=360, sleep_interval=2):
-        start_time = time.time()
-        last_size = -1
-        last_mod_time = -1
+        # An open binary stream when the slice is not read from disk (see stream_ingest.py)
+        self.source = source if source is not None else path
+        self.lines_repaired = 0
+        self.lines_quarantined = 0
 
-        while (time.time() - start_time) < max_wait_time:
-            try:
-                stats = os.stat(self.path)
-                current_size = stats.st_size
-                current_mod_time = stats.st_mtime
-
-                logging.info(f"Checking file: {self.path}, size: {current_size}, modified: {current_mod_time}")
-
-                if current_size == last_size and last_mod_time == current_mod_time:
-                    logging.info("File download/write appears complete.")
-                    return True
-                else:
-                    last_size = current_size
-                    last_mod_time = current_mod_time
-                    time.sleep(sleep_interval)
-            except Exception as e:
-                logging.warning(f"Error checking file: {e}")
-                time.sleep(sleep_interval)
-                continue
-
-        self.is_skipped = True
-        logging.warning(f"File may still be writing or download incomplete after maximum wait time: {self.path}")
-        return False
-
-    def load_data(self):
+    def load_data(self, batch, metrics=None):
+        """Stream the slice chunk by chunk into a BatchBuilder. Returns False if it could not be loaded."""
         try:
-            self.data = pd.read_csv(self.path, sep='\t', compression='gzip', on_bad_lines='warn')
-            # Convert double precision 'stuck' values to boolean:
-            self.data['stuck'] = self.data['stuck'].map({1: True, 0: False, 'true': True, 'false': False, 'True': True, 'False': False}).fillna(False)
-            # Filter the DataFrame for the desired conditions
-            self.data = self.data[(self.data['status'] == 'confirmed') & (self.data['region'] == 'us-east-1') & (self.data['network'] == 'main')]
-            # Drop the 'status' and 'region' columns as they are no longer needed
-            self.data = self.data.drop(columns=['status', 'region', 'failurereason', 'network'])
+            # Lines with the wrong number of fields are repaired or set aside instead of being lost
+            quarantine = SliceQuarantine(quarantine_path(quarantine_root, slice_key(self.path)))
+            try:
+                for chunk in read_slice(self.source, TRANSACTIONS_COLUMNS, quarantine=quarantine, metrics=metrics):
+                    # Convert double precision 'stuck' values to boolean:
+                    chunk['stuck'] = chunk['stuck'].map(STUCK_VALUES).fillna(False).astype(bool)
+                    # Chunks are already filtered down to confirmed us-east-1 mainnet transactions
+                    batch.add(chunk)
+            finally:
+                quarantine.close()
+            self.lines_repaired, self.lines_quarantined = quarantine.repaired, quarantine.quarantined
             return True
         except Exception as e:
             logging.error(f"Error loading data from file {self.path}: {e}")
             return False
 
-def process_and_load_data(engine, directory_path):
-    root_directory = os.path.dirname(directory_path)  # This should give you the directory containing 'data'
-    skipped_directory_path = os.path.join(root_directory, 'skipped_data')  # This sets 'skipped_data' at the same level as 'data'
-    
-    if not os.path.exists(skipped_directory_path):
-        os.makedirs(skipped_directory_path)
-
-    accumulator_df = pd.DataFrame()
-    batch_size = 10000
-    directories_to_check = set()
-
+def list_slices(directory_path):
+    """All .csv.gz slices below a directory."""
+    slices = []
     for root, _, files in os.walk(directory_path):
         for file_name in files:
             if file_name.endswith('.csv.gz'):
-                file_obj = File(os.path.join(root, file_name))
-                directories_to_check.add(root)  # Track directories for later cleanup
-
-                if not file_obj.check_write_complete():
-                    try:
-                        new_path = os.path.join(skipped_directory_path, os.path.basename(file_obj.path))
-                        os.rename(file_obj.path, new_path)
-                        logging.info(f"Moved incomplete file to 'skipped_data': {new_path}")
-                    except Exception as e:
-                        logging.error(f"Failed to move incomplete file {file_obj.path} to 'skipped_data': {e}")
-                    continue
-
-                if file_obj.load_data():
-                    accumulator_df = pd.concat([accumulator_df, file_obj.data], ignore_index=True)
-
-                    if len(accumulator_df) >= batch_size:
-                        try:
-                            accumulator_df.to_sql(name='transactions', con=engine, if_exists='append', index=False)
-                            accumulator_df = pd.DataFrame()
-                        except Exception as e:
-                            logging.error(f"Failed to write batch to database: {e}")
-                    
-                    try:
-                        os.remove(file_obj.path)
-                        logging.info(f"Deleted processed file: {file_obj.path}")
-                    except Exception as e:
-                        logging.error(f"Failed to delete processed file {file_obj.path}: {e}")
-                else:
-                    logging.error(f"Failed to process file: {file_obj.path}")
-
-    if not accumulator_df.empty:
-        try:
-            accumulator_df.to_sql(name='transactions', con=engine, if_exists='append', index=False)
-        except Exception as e:
-            logging.error(f"Failed to write remaining data to database: {e}")
+                slices.append(os.path.join(root, file_name))
+    return slices
 
-    # Cleanup: Delete empty directories
-    for dir_path in directories_to_check:
-        if not os.listdir(dir_path):  # Check if the directory is empty
-            try:
-                os.rmdir(dir_path)
-                logging.info(f"Deleted empty directory: {dir_path}")
-            except Exception as e:
-                logging.error(f"Failed to delete directory {dir_path}: {e}")
+def file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+def init_ingest_worker():
+    """Runs once in every pool process: the process gets its own engine and connection pool."""
+    global engine
+    engine = create_engine(database_url)
+    logging.info(f"Ingest worker {os.getpid()} started")
+
+def delete_slice(path):
+    try:
+        os.remove(path)
+        logging.info(f"Deleted processed file: {path}")
+    except Exception as e:
+        logging.error(f"Failed to delete processed file {path}: {e}")
+
+def record_failure(connection, key, size, content_hash, started_at, error):
+    """Write a 'failed' manifest row in its own transaction, after the data transaction was rolled back."""
+    if content_hash is None:
+        return
+    try:
+        with connection.cursor() as cursor:
+            record_slice(cursor, key, size, content_hash, FAILED, 0, started_at, error)
+        connection.commit()
+    except Exception as e:
+        connection.rollback()
+        logging.error(f"Failed to record failure of {key} in the ingest manifest: {e}")
+
+def write_to_sinks(sinks, frames):
+    """Hand a batch to every sink. Returns the row count of the first one (Postgres, if enabled)."""
+    rows = [sink(frames) for sink in sinks]
+    return rows[0]
+
+def ingest_slice(file_obj, size, metrics, content_hash):
+    """
+    Parse one slice and write it to the configured sinks with the process' own engine. The
+    slice's rows and its ingest_manifest row are committed in one transaction, so after a
+    crash a slice is either fully loaded and recorded, or not loaded at all. The Parquet file
+    is published right before that commit and is simply replaced if the slice has to be
+    loaded again. `content_hash` returns the slice's SHA-256 once it has been read, or None.
+    Returns LOADED, FAILED, or 'skipped' if the manifest already lists the slice.
+    """
+    key = metrics.key
+    started_at = utc_now()
+    metrics.count('bytes_in', size)
+
+    merge, parquet = None, None
+    connection = engine.raw_connection()
+    try:
+        with connection.cursor() as cursor:
+            if is_loaded(cursor, key, size):
+                # Loaded before a crash or restart, but not deleted yet
+                logging.info(f"Slice {key} is already in the ingest manifest, skipping: {file_obj.path}")
+                connection.rollback()
+                return 'skipped'
+
+            sinks = []
+            if 'postgres' in ingest_sinks:
+                # Hashes can repeat across slices and days, so batches are merged on the primary key instead of copied
+                merge = StagingMerge(cursor, 'transactions', key='hash')
+                sinks.append(merge)
+            if 'parquet' in ingest_sinks:
+                parquet = ParquetSliceWriter(parquet_root, key, transactions_parquet_schema)
+                sinks.append(parquet)
+            batch = BatchBuilder(lambda frames: write_to_sinks(sinks, frames), max_batch_bytes)
+            if not file_obj.load_data(batch, metrics):
+                logging.error(f"Failed to process file: {file_obj.path}")
+                connection.rollback()
+                if parquet is not None:
+                    parquet.abort()
+                record_failure(connection, key, size, content_hash(), started_at, "could not parse slice")
+                return FAILED
+            batch.flush()
+            metrics.add_time('write', batch.write_seconds)
+            with metrics.stage('commit'):
+                record_slice(cursor, key, size, content_hash(), LOADED, batch.rows_written, started_at,
+                             lines_repaired=file_obj.lines_repaired, lines_quarantined=file_obj.lines_quarantined)
+                if parquet is not None:
+                    parquet.close()
+                connection.commit()
+        rows = batch.rows_written
+    except Exception as e:
+        connection.rollback()
+        if parquet is not None:
+            parquet.abort()
+        logging.error(f"Failed to write {file_obj.path} to {', '.join(ingest_sinks)}: {e}")
+        try:
+            record_failure(connection, key, size, content_hash(), started_at, str(e))
+        except Exception as hash_error:
+            logging.error(f"Failed to record failure of {key}: {hash_error}")
+        return FAILED
+    finally:
+        connection.close()
+
+    logging.info(f"Loaded {rows} rows from {key}, {file_obj.lines_repaired} lines repaired, {file_obj.lines_quarantined} lines quarantined")
+    if merge is not None:
+        logging.info(f"{key}: {merge.conflicts} rows conflicted on 'hash' (policy '{merge.policy}')")
+    metrics.count('rows_written', rows)
+    metrics.count('lines_repaired', file_obj.lines_repaired)
+    metrics.count('lines_quarantined', file_obj.lines_quarantined)
+    return LOADED
+
+def load_file(path, queued_at=None):
+    """
+    Runs in a pool process: load one complete slice from disk with ingest_slice and delete
+    it once it is in the manifest. Returns the slice's metrics record.
+    """
+    file_obj = File(path)
+    metrics = SliceMetrics(slice_key(path), queued_at)
+    try:
+        size = os.path.getsize(path)
+    except OSError:
+        # Reported twice (e.g. by the startup scan and by an event) and already loaded
+        return metrics.as_record('missing')
+
+    def content_hash():
+        with metrics.stage('hash'):
+            return file_sha256(path)
+
+    status = ingest_slice(file_obj, size, metrics, content_hash)
+    if status != FAILED:
+        with metrics.stage('delete'):
+            delete_slice(path)
+    return metrics.as_record(status)
+
+def load_cached_slice(key, cached_path, source_size, source_sha256, queued_at=None):
+    """
+    Runs in a pool process: load one slice from the slice cache (see slice_cache.py). It is
+    recorded in the manifest with the size and hash of the original download, as in load_file.
+    """
+    metrics = SliceMetrics(key, queued_at)
+    file_obj = File(os.path.join('data', key), source=cached_path)
+    status = ingest_slice(file_obj, source_size, metrics, lambda: source_sha256)
+    return metrics.as_record(status)
+
+def reingest_from_cache(pool, cache, dates=None):
+    """Load every cached slice (of the given dates), largest first. Returns the number of slices per status."""
+    entries = cache.entries(dates)
+    logging.info(f"Reingesting {len(entries)} slices from the cache at {cache.root}")
+    metrics_publisher.set_queue_depth('slices', len(entries))
+    futures = []
+    queued_at = time.time()
+    for entry in sorted(entries, key=lambda entry: entry['csv_size'], reverse=True):
+        cache.touch(entry['slice_key'])
+        future = pool.submit(load_cached_slice, entry['slice_key'], cache.object_path(entry['object_hash']),
+                             entry['source_size'], entry['source_sha256'], queued_at)
+        future.add_done_callback(publish_metrics)
+        futures.append(future)
+
+    statuses = {}
+    for future in futures:
+        status = future.result()['status'] if future.exception() is None else FAILED
+        statuses[status] = statuses.get(status, 0) + 1
+    metrics_publisher.set_queue_depth('slices', 0)
+    return statuses
+
+def remove_loaded_slices(engine, directory_path):
+    """Delete slices that the manifest already lists as loaded, without opening them."""
+    loaded = loaded_slices(engine)
+    removed = 0
+    for item in os.listdir(directory_path):
+        item_path = os.path.join(directory_path, item)
+        if not (os.path.isdir(item_path) and is_valid_directory(item)):
+            continue
+        for path in list_slices(item_path):
+            if (slice_key(path), file_size(path)) in loaded:
+                delete_slice(path)
+                removed += 1
+    logging.info(f"Ingest manifest lists {len(loaded)} loaded slices; removed {removed} leftover files")
+
+# Slices that are queued or being loaded, so that a slice seen by both a directory scan
+# and a filesystem event is only loaded once
+scheduled_slices = set()
+scheduled_slices_lock = threading.Lock()
+
+# Per-slice metrics are collected by the pool processes and published from here. The queue
+# depths also go to data/.ingest_status, next to the downloads, for download_slices.sh.
+metrics_publisher = MetricsPublisher(status_path=os.path.join(os.getcwd(), 'data', '.ingest_status'))
+
+def release_slice(path):
+    with scheduled_slices_lock:
+        scheduled_slices.discard(path)
+        in_flight = len(scheduled_slices)
+    metrics_publisher.set_queue_depth('slices', in_flight)
+
+def publish_metrics(future):
+    if future.exception() is None:
+        metrics_publisher.publish(future.result())
+    metrics_publisher.set_queue_depth('directories', directories_queue.qsize())
+
+class DirectoryProgress:
+    """Counts the outstanding slices of a queue item and cleans up once the last one is done."""
+    def __init__(self, directory_path, slice_count, directories_queue):
+        self.directory_path = directory_path
+        self.remaining = slice_count
+        self.directories_queue = directories_queue
+        self.lock = threading.Lock()
+        if slice_count == 0:
+            self.finish()
+
+    def slice_done(self, future):
+        if future.exception() is not None:
+            logging.error(f"Ingest worker failed in {self.directory_path}: {future.exception()}")
+        with self.lock:
+            self.remaining -= 1
+            finished = self.remaining == 0
+        if finished:
+            self.finish()
+
+    def finish(self):
+        # Cleanup: Delete empty directories. A directory with a download in progress still holds its '.part' file.
+        for dir_path, _, _ in sorted(os.walk(self.directory_path), reverse=True):
+            if not os.listdir(dir_path):  # Check if the directory is empty
+                try:
+                    os.rmdir(dir_path)
+                    logging.info(f"Deleted empty directory: {dir_path}")
+                except Exception as e:
+                    logging.error(f"Failed to delete directory {dir_path}: {e}")
+        logging.info(f"Finished: {self.directory_path}")
+        self.directories_queue.task_done()
+
+def process_and_load_data(pool, paths, directories_queue):
+    """
+    Hand every slice of the given queue items (YYYYMMDD directories or single ready slices)
+    to the process pool, largest first so that big slices do not pile up at the end.
+    Returns the futures of the submitted slices.
+    """
+    slices = []
+    for path in paths:
+        item_slices = list_slices(path) if os.path.isdir(path) else [path]
+        with scheduled_slices_lock:
+            item_slices = [slice_path for slice_path in item_slices if slice_path not in scheduled_slices]
+            scheduled_slices.update(item_slices)
+        directory_path = path if os.path.isdir(path) else os.path.dirname(path)
+        progress = DirectoryProgress(directory_path, len(item_slices), directories_queue)
+        slices += [(slice_path, progress) for slice_path in item_slices]
+    with scheduled_slices_lock:
+        metrics_publisher.set_queue_depth('slices', len(scheduled_slices))
+
+    futures = []
+    queued_at = time.time()
+    for path, progress in sorted(slices, key=lambda item: file_size(item[0]), reverse=True):
+        future = pool.submit(load_file, path, queued_at)
+        future.add_done_callback(publish_metrics)
+        future.add_done_callback(lambda _, path=path: release_slice(path))
+        future.add_done_callback(progress.slice_done)
+        futures.append(future)
+    return futures
 
 def keyboard_listener(observer):
     print("Press 'c' and Enter to stop execution.")
@@ -234,12 +444,35 @@ def keyboard_listener(observer):
             break
         
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load Blocknative slices from data/ into the configured sinks.")
+    parser.add_argument('--reingest-from-cache', action='store_true',
+                        help="Load the slices in the local slice cache instead of watching data/, then exit")
+    parser.add_argument('--cache-dir', default=CACHE_ROOT)
+    parser.add_argument('--dates', help="With --reingest-from-cache: only the dates in this file, e.g. dates.txt")
+    args = parser.parse_args()
+
+    unknown_sinks = set(ingest_sinks) - set(INGEST_SINKS)
+    if unknown_sinks or not ingest_sinks:
+        logging.error(f"INGEST_SINKS must be a comma separated subset of {INGEST_SINKS}, got {ingest_sinks}. Exiting...")
+        exit(1)
+
     # Wait for the database to become available
     if not wait_for_db(engine):
         logging.error("Could not connect to the database. Exiting...")
         exit(1)
         
     create_transactions_table(engine)
+    create_manifest_table(engine)
+
+    if args.reingest_from_cache:
+        # Rebuilding tables from local disk; slices the manifest lists as loaded are skipped,
+        # so delete their ingest_manifest rows to load them again
+        pool = ProcessPoolExecutor(max_workers=ingest_workers, mp_context=multiprocessing.get_context('spawn'),
+                                   initializer=init_ingest_worker)
+        with pool:
+            statuses = reingest_from_cache(pool, SliceCache(args.cache_dir), set(read_dates(args.dates)) if args.dates else None)
+        logging.info(f"Reingest from cache finished: {statuses}")
+        exit(1 if statuses.get(FAILED) else 0)
     
     # Change directory_path to point to the "data" directory inside the current directory
     directory_path = os.path.join(os.getcwd(), "data")
@@ -249,24 +482,36 @@ if __name__ == "__main__":
         os.makedirs(directory_path)
         logging.info(f"Created 'data' directory at {directory_path}")
 
-    # Enqueue existing directories with the correct format within the "data" directory
+    # Slices that were committed right before a crash are still on disk; they are not loaded again
+    remove_loaded_slices(engine, directory_path)
+
+    # Enqueue existing directories with the correct format within the "data" directory.
+    # Downloads are renamed to their final name only once complete, so every slice found here can be loaded.
     for item in os.listdir(directory_path):
         item_path = os.path.join(directory_path, item)
         if os.path.isdir(item_path) and is_valid_directory(os.path.basename(item)):
             directories_queue.put(item_path)
+    metrics_publisher.set_queue_depth('directories', directories_queue.qsize())
 
-    # Setup Watchdog observer to monitor the "data" directory
-    event_handler = DirectoryHandler(directories_queue)
+    # Setup Watchdog observer to monitor the "data" directory and the YYYYMMDD directories inside it
+    debouncer = SliceDebouncer(directories_queue)
+    debouncer.start()
+    event_handler = DirectoryHandler(debouncer)
     observer = Observer()
-    observer.schedule(event_handler, directory_path, recursive=False)
+    observer.schedule(event_handler, directory_path, recursive=True)
     observer.start()
 
+    # Slices are parsed and loaded by a pool of processes. 'spawn' keeps the children
+    # independent of the observer thread and of the parent's database connections.
+    pool = ProcessPoolExecutor(max_workers=ingest_workers, mp_context=multiprocessing.get_context('spawn'),
+                               initializer=init_ingest_worker)
+
     # Start the directory processing worker
-    worker_thread = threading.Thread(target=directory_processing_worker, args=(engine, directories_queue))
+    worker_thread = threading.Thread(target=directory_processing_worker, args=(directories_queue, pool))
     worker_thread.daemon = True  # Optional: makes the thread exit when the main thread does
     worker_thread.start()
 
-    logging.info("Monitoring for new directories in 'data'...")
+    logging.info(f"Monitoring for new directories in 'data' with {ingest_workers} ingest workers...")
 
     try:
         while True:
@@ -274,3 +519,8 @@ if __name__ == "__main__":
     except KeyboardInterrupt:
         observer.stop()
     observer.join()
+
+    # Finish the slices that were already queued, then shut the pool down
+    directories_queue.put(None)
+    worker_thread.join()
+    pool.shutdown()
@@ -1,13 +1,25 @@
-import requests
 import os
+import json
+import asyncio
+import argparse
+import aiohttp
 import pandas as pd
 from sqlalchemy import create_engine, Column, Integer, MetaData, Table, select
 from sqlalchemy import Column, Table, MetaData, TIMESTAMP, VARCHAR, NUMERIC, INTEGER, BIGINT, Index
 from sqlalchemy.sql import text
 import time
+from collections import Counter, deque
 
 from sqlalchemy.orm import sessionmaker
 import logging
+from http_retry import RETRY_STATUSES, RetryableError, TokenBucket, retry_after_seconds, backoff_seconds
+from zeromev_cache import ZeromevCache, ZEROMEV_CACHE_PATH
+from zeromev_facts import create_zeromev_facts, mev_facts, replace_facts, wide_table_name, fetched_ranges_table_name
+
+# Usage: python zeromev.py                       (blocks 19220986 to 19499238, resuming where the last run stopped)
+#        python zeromev.py --start-block 11565019 --end-block 19499238 --concurrency 16 --rate 20
+#        python zeromev.py --base-url http://localhost:8090/v1/   (local zeromev_stub_server.py)
+#        python zeromev.py --replay [--start-block N --end-block M]   (rebuild from cache/zeromev.sqlite only)
 
 # Create the logs directory if it does not exist
 log_directory = "logs"
@@ -28,174 +40,442 @@ db_params = {
     'port': '5432'
 }
 
-table_name = 'zeromev_data'
+ZEROMEV_API = "https://data.zeromev.org/v1/"
+
+# Blocks fetched when no range is given
+DEFAULT_START_BLOCK = 19220986
+DEFAULT_END_BLOCK = 19499238
+
+# Requests in flight and requests per second to the zeromev API
+DEFAULT_CONCURRENCY = int(os.getenv('ZEROMEV_CONCURRENCY', '8'))
+DEFAULT_RATE = float(os.getenv('ZEROMEV_RATE', '10'))
+
+# Blocks per request adapt between these bounds (see BatchSizer): quiet blocks fit many to a
+# response, busy ones few. A response should take at most TARGET_SECONDS and TARGET_BYTES.
+DEFAULT_BLOCKS_PER_REQUEST = 100
+DEFAULT_MIN_BLOCKS = 10
+DEFAULT_MAX_BLOCKS = 1000
+TARGET_SECONDS = float(os.getenv('ZEROMEV_TARGET_SECONDS', '2'))
+TARGET_BYTES = 8 * 1024 * 1024
+# No growth for this long after a 429
+THROTTLE_HOLD_SECONDS = 10
+# Aggregated rows collected before one write to the database
+WRITE_BATCH_ROWS = 20000
+
+# Holes of this many blocks or more between the rows of zeromev_data count as not fetched
+# (a lost request leaves at least one), unless zeromev_fetched_ranges has them; shorter ones
+# are taken for blocks without MEV transactions
+DEFAULT_MIN_GAP = 100
+
+# Ranges that still failed after all retries are tried again by later runs, waiting
+# base * 2^(attempts - 1) seconds after each failed run, up to the cap
+FAILED_RETRY_BASE_SECONDS = 600
+FAILED_RETRY_CAP_SECONDS = 24 * 3600
 
 # Create a SQLAlchemy engine
 engine = create_engine(f"postgresql://{db_params['user']}:{db_params['password']}@{db_params['host']}:{db_params['port']}/{db_params['database']}")
 metadata = MetaData()
 
-table = Table(table_name, metadata,
-    Column('block_number', NUMERIC(18), primary_key=True),
-    
-    Column('total_user_swap_volume', NUMERIC),
-    Column('total_extractor_profit', NUMERIC),
-    
-    Column('multiple_count', INTEGER),
-    Column('aave_count', INTEGER),
-    Column('balancer1_count', INTEGER),
-    Column('bancor_count', INTEGER),
-    Column('compoundv2_count', INTEGER),
-    Column('curve_count', INTEGER),
-    Column('uniswap2_count', INTEGER),
-    Column('uniswap3_count', INTEGER),
-    Column('zerox_count', INTEGER),
-    Column('unknown_count', INTEGER),
-    
-    Column('arb_extractor_profit', NUMERIC),
-    Column('frontrun_extractor_profit', NUMERIC),
-    Column('sandwich_extractor_profit', NUMERIC),
-    Column('backrun_extractor_profit', NUMERIC),
-    Column('liquid_extractor_profit', NUMERIC),
-    Column('swap_extractor_profit', NUMERIC),
-    
-    Column('arb_user_swap_volume', NUMERIC),
-    Column('frontrun_user_swap_volume', NUMERIC),
-    Column('sandwich_user_swap_volume', NUMERIC),
-    Column('backrun_user_swap_volume', NUMERIC),
-    Column('liquid_user_swap_volume', NUMERIC),
-    Column('swap_user_swap_volume', NUMERIC),
-    
-    Column('arb_count', INTEGER),
-    Column('frontrun_count', INTEGER),
-    Column('sandwich_count', INTEGER),
-    Column('backrun_count', INTEGER),
-    Column('liquid_count', INTEGER),
-    Column('swap_count', INTEGER), # user tx count
+failed_ranges_table_name = 'zeromev_failed_ranges'
+
+failed_ranges_table = Table(failed_ranges_table_name, metadata,
+    Column('start_block', BIGINT, primary_key=True),
+    Column('block_count', INTEGER, nullable=False),
+    Column('attempts', INTEGER, nullable=False),
+    Column('last_attempt_at', TIMESTAMP, nullable=False),
+    Column('next_attempt_at', TIMESTAMP, nullable=False),
     )
-    # Create the table
-metadata.create_all(engine)
-logging.info(f"Table {table_name} has been created/ensured in the database")
-
-# Function to get the MEV transaction count and other details for a specific block number
-def get_mev_tx_info(start_block_number, count=100):
-    url = f"https://data.zeromev.org/v1/mevBlock?block_number={start_block_number}&count={count}"
-    response = requests.get(url, headers={'accept': 'application/json'})
-    
-    if response.status_code == 200:
-        data = response.json()
-        logging.info(f"Request successful, retrieved data for block number {start_block_number} to {start_block_number + count - 1}")
-
-        # Initialize dictionaries to track transaction counts
-        transaction_counts = {}
-        financial_aggregates = {}
-        protocol_counts = {}
-        block_volumes = {}
-        
-        for item in data:
-            mev_type = item['mev_type']
-            block_number = item['block_number']
-            protocol = item.get('protocol', 'unknown')  # Handle possible missing 'protocol' field
-
-            # Update transaction counts
-            if mev_type not in transaction_counts:
-                transaction_counts[mev_type] = {}
-            if block_number in transaction_counts[mev_type]:
-                transaction_counts[mev_type][block_number] += 1
-            else:
-                transaction_counts[mev_type][block_number] = 1
-                
-            if protocol not in protocol_counts:
-                protocol_counts[protocol] = {}
-            if block_number in protocol_counts[protocol]:
-                protocol_counts[protocol][block_number] += 1
-            else:
-                protocol_counts[protocol][block_number] = 1
-                
-            # Initialize or update financial aggregates for each mev_type and block_number
-            if block_number not in financial_aggregates:
-                financial_aggregates[block_number] = {}
-                block_volumes[block_number] = {'total_extractor_profit': 0, 'total_user_swap_volume': 0}
-            if f"{mev_type}_user_swap_volume" not in financial_aggregates[block_number]:
-                financial_aggregates[block_number][f"{mev_type}_user_swap_volume"] = 0
-            if f"{mev_type}_extractor_profit" not in financial_aggregates[block_number]:
-                financial_aggregates[block_number][f"{mev_type}_extractor_profit"] = 0
-
-                            
-            # Sum 'user_swap_volume_usd' and 'extractor_profit_usd' for each mev_type
-            user_volume = item.get('user_swap_volume_usd', 0) or 0
-            extractor_profit = item.get('extractor_profit_usd', 0) or 0
-            financial_aggregates[block_number][f"{mev_type}_user_swap_volume"] += item.get('user_swap_volume_usd', 0) or 0
-            financial_aggregates[block_number][f"{mev_type}_extractor_profit"] += item.get('extractor_profit_usd', 0) or 0
-        
-            # Aggregate total volumes per block
-            block_volumes[block_number]['total_user_swap_volume'] += user_volume
-            block_volumes[block_number]['total_extractor_profit'] += extractor_profit
-            
-        # Prepare data for DataFrame conversion and database insertion
-        all_transactions = []
-        for block_number in set(k for dic in transaction_counts.values() for k in dic):
-            transaction_record = {'block_number': block_number}
-            # Include transaction counts
-            for mev_type, counts in transaction_counts.items():
-                if block_number in counts:
-                    transaction_record[f"{mev_type}_count"] = counts[block_number]
-                    transaction_record.update(financial_aggregates[block_number])
-            # Include protocol counts
-            for protocol, counts in protocol_counts.items():
-                if block_number in counts:
-                    transaction_record[f"{protocol}_count"] = counts[block_number]
-            # Include total volumes
-            transaction_record.update(block_volumes[block_number])
-            
-            all_transactions.append(transaction_record)
-
-        # Convert the list of transactions to a DataFrame
-        df = pd.DataFrame(all_transactions)
-        if not df.empty:
-            # Pivot the DataFrame to have one row per block_number with separate columns for each mev_type
-            df = df.groupby('block_number').sum().reset_index()
-
-        # Return both DataFrames in a tuple
-        return df
-    else:
-        logging.error(f"Failed to fetch data for block number {start_block_number} to {start_block_number + count - 1}")
-        return None
 
-def write_to_db(df, engine):
-    if not df.empty:
-        df.to_sql(name=table_name, con=engine, if_exists='append', index=False)
-        logging.info("Data written successfully to the database.")
-    else:
-        logging.warning("No data to write to the database.")
+def create_zeromev_table(engine):
+    # Create the tables
+    metadata.create_all(engine)
+    create_zeromev_facts(engine)
+    logging.info(f"Table {failed_ranges_table_name} has been created/ensured in the database")
+
+def missing_block_ranges(connection, start_block_number, end_block_number, min_gap=DEFAULT_MIN_GAP):
+    """
+    (first, last) of the block ranges between start and end that were not fetched yet: the
+    blocks before the first and after the last row of zeromev_data in the range and the holes
+    of min_gap blocks or more in between, less the ranges in zeromev_fetched_ranges. Blocks
+    without MEV transactions have no rows, so the fetched ranges decide there; zeromev_data
+    covers the rows written before the fetched ranges were kept.
+    """
+    first, last = connection.execute(text(f"""
+        SELECT MIN(block_number), MAX(block_number) FROM {wide_table_name}
+        WHERE block_number BETWEEN :start AND :end
+    """), {'start': start_block_number, 'end': end_block_number}).fetchone()
+    fetched = connection.execute(text(f"""
+        SELECT start_block, block_count FROM {fetched_ranges_table_name}
+        WHERE start_block <= :end AND start_block + block_count > :start
+        ORDER BY start_block
+    """), {'start': start_block_number, 'end': end_block_number}).fetchall()
+    if first is None:
+        return subtract_ranges(start_block_number, end_block_number, fetched)
+    holes = connection.execute(text(f"""
+        SELECT block_number + 1, next_block - 1 FROM (
+            SELECT block_number, lead(block_number) OVER (ORDER BY block_number) AS next_block
+            FROM {wide_table_name} WHERE block_number BETWEEN :start AND :end
+        ) AS blocks
+        WHERE next_block - block_number > :min_gap
+        ORDER BY block_number
+    """), {'start': start_block_number, 'end': end_block_number, 'min_gap': min_gap}).fetchall()
+    missing = [(int(hole_start), int(hole_end)) for hole_start, hole_end in holes]
+    if first > start_block_number:
+        missing.insert(0, (start_block_number, int(first) - 1))
+    if last < end_block_number:
+        missing.append((int(last) + 1, end_block_number))
+    return [piece for first, last in missing for piece in subtract_ranges(first, last, fetched)]
+
+def subtract_ranges(first, last, ranges):
+    """The parts of the blocks from first to last that are not in any of the sorted (start, count) ranges."""
+    pieces, next_block = [], first
+    for start, count in ranges:
+        if start + count - 1 < next_block or start > last:
+            continue
+        if start > next_block:
+            pieces.append((next_block, start - 1))
+        next_block = max(next_block, start + count)
+    if next_block <= last:
+        pieces.append((next_block, last))
+    return pieces
+
+def plan_backfill(start_block_number, end_block_number, min_gap=DEFAULT_MIN_GAP, retry_failed=False):
+    """
+    What is still to do between start and end, as PendingRanges: the failed ranges whose backoff
+    has passed (or all of them with retry_failed), to be requested as they were, and the spans of
+    blocks missing from zeromev_data outside the failed ranges.
+    """
+    with engine.connect() as connection:
+        missing = missing_block_ranges(connection, start_block_number, end_block_number, min_gap)
+        failed = connection.execute(text(f"""
+            SELECT start_block, block_count, next_attempt_at <= now() AT TIME ZONE 'UTC' FROM {failed_ranges_table_name}
+            WHERE start_block BETWEEN :start AND :end ORDER BY start_block
+        """), {'start': start_block_number, 'end': end_block_number}).fetchall()
+    failed_ranges = [(start, count) for start, count, _ in failed]
+    due = [(start, count) for start, count, is_due in failed if is_due or retry_failed]
+
+    spans = [piece for first, last in missing for piece in subtract_ranges(first, last, failed_ranges)]
+    high_water_mark = missing[-1][0] - 1 if missing and missing[-1][1] == end_block_number else end_block_number
+    logging.info(f"Blocks {start_block_number} to {end_block_number}: done up to {high_water_mark}, "
+                 f"{len(missing)} missing ranges ({sum(last - first + 1 for first, last in missing)} blocks), "
+                 f"{len(due)} of {len(failed)} failed ranges due for a retry")
+    return PendingRanges(spans, due)
+
+class PendingRanges:
+    """
+    Work queue of the fetchers: spans of blocks, cut into requests of whatever size is asked for
+    when a fetcher takes the next one, and fixed (start, count) ranges that are requested as
+    they are (failed ranges from the retry table, which are cleared by their exact range).
+    """
+    def __init__(self, spans=(), fixed=()):
+        self.items = deque(sorted([(first, last - first + 1, False) for first, last in spans] +
+                                  [(start, count, True) for start, count in fixed]))
+
+    def __bool__(self):
+        return bool(self.items)
+
+    def blocks(self):
+        return sum(count for _, count, _ in self.items)
+
+    def peek(self):
+        """(start, count, fixed) of the next span or fixed range."""
+        return self.items[0]
+
+    def take(self, count):
+        """(start, count, fixed) of the next request: up to `count` blocks of a span, or a whole fixed range."""
+        start, size, fixed = self.items.popleft()
+        if not fixed and size > count:
+            self.items.appendleft((start + count, size - count, False))
+            size = count
+        return start, size, fixed
+
+    def put_back(self, start, count):
+        """Return blocks to the front of the queue as a span."""
+        self.items.appendleft((start, count, False))
+
+class BatchSizer:
+    """
+    Blocks per request, adjusted on every response: grows by a quarter while responses come
+    back in under half of TARGET_SECONDS and TARGET_BYTES, shrinks in proportion when one takes
+    longer or is larger than that, and by a quarter on 5xx errors and timeouts. Only responses
+    to requests of the current size make it grow, so it grows at most once per round trip however
+    many requests are in flight. 429s only stop the growth for a while: smaller requests would
+    mean more of them.
+    """
+    def __init__(self, initial=DEFAULT_BLOCKS_PER_REQUEST, minimum=DEFAULT_MIN_BLOCKS, maximum=DEFAULT_MAX_BLOCKS,
+                 target_seconds=TARGET_SECONDS, target_bytes=TARGET_BYTES):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.count = min(self.maximum, max(self.minimum, initial))
+        self.target_seconds = target_seconds
+        self.target_bytes = target_bytes
+        self.hold_until = 0.0
+        self.sizes = Counter()
+
+    def _resize(self, count, reason):
+        count = min(self.maximum, max(self.minimum, count))
+        if count != self.count:
+            logging.info(f"Blocks per request {self.count} -> {count} ({reason})")
+            self.count = count
+
+    def success(self, count, seconds, size):
+        self.sizes[count] += 1
+        if seconds > self.target_seconds or size > self.target_bytes:
+            factor = min(self.target_seconds / seconds, self.target_bytes / size)
+            self._resize(min(self.count, int(count * factor)), f"{count} blocks took {seconds:.2f}s for {size / 1e6:.1f} MB")
+        elif (count == self.count and seconds < self.target_seconds / 2 and size < self.target_bytes / 2
+              and time.monotonic() >= self.hold_until):
+            # Requests cut before a shrink still come back at the old size; they must not undo it
+            self._resize(self.count + max(1, self.count // 4), f"{count} blocks took {seconds:.2f}s for {size / 1e6:.1f} MB")
+
+    def error(self, count, reason):
+        self._resize(min(self.count, count * 3 // 4), reason)
+
+    def throttled(self):
+        self.hold_until = time.monotonic() + THROTTLE_HOLD_SECONDS
+
+def record_failed_ranges(ranges):
+    """Add ranges to the retry table, or push back their next attempt if they failed before."""
+    with engine.begin() as connection:
+        for start, count in ranges:
+            connection.execute(text(f"""
+                INSERT INTO {failed_ranges_table_name} AS failed (start_block, block_count, attempts, last_attempt_at, next_attempt_at)
+                VALUES (:start, :count, 1, now() AT TIME ZONE 'UTC', now() AT TIME ZONE 'UTC' + make_interval(secs => :base))
+                ON CONFLICT (start_block) DO UPDATE SET
+                    block_count = EXCLUDED.block_count,
+                    attempts = failed.attempts + 1,
+                    last_attempt_at = EXCLUDED.last_attempt_at,
+                    next_attempt_at = EXCLUDED.last_attempt_at
+                        + make_interval(secs => LEAST(:cap, :base * power(2, failed.attempts)))
+            """), {'start': start, 'count': count, 'base': FAILED_RETRY_BASE_SECONDS, 'cap': FAILED_RETRY_CAP_SECONDS})
+
+def clear_failed_ranges(ranges):
+    """Remove ranges whose rows have been written from the retry table."""
+    if not ranges:
+        return
+    with engine.begin() as connection:
+        connection.execute(text(f"""
+            DELETE FROM {failed_ranges_table_name}
+            WHERE (start_block, block_count) IN (
+                SELECT * FROM unnest(CAST(:starts AS bigint[]), CAST(:counts AS int[])))
+        """), {'starts': [start for start, _ in ranges], 'counts': [count for _, count in ranges]})
+
+async def fetch_mev_block(session, limiter, base_url, start_block_number, count, retries, sizer=None):
+    """
+    The raw mevBlock response for `count` blocks, or None if it could not be fetched. Every
+    response is reported to the BatchSizer, if there is one.
+    """
+    url = f"{base_url}mevBlock?block_number={start_block_number}&count={count}"
+    for attempt in range(retries + 1):
+        await limiter.acquire()
+        request_start = time.perf_counter()
+        try:
+            async with session.get(url, headers={'accept': 'application/json'}) as response:
+                if response.status == 200:
+                    body = await response.read()
+                    if sizer is not None:
+                        sizer.success(count, time.perf_counter() - request_start, len(body))
+                    return body
+                if sizer is not None:
+                    if response.status == 429:
+                        sizer.throttled()
+                    else:
+                        sizer.error(count, f"HTTP {response.status}")
+                if response.status in RETRY_STATUSES:
+                    raise RetryableError(f"HTTP {response.status}", retry_after_seconds(response.headers.get('Retry-After')))
+                logging.error(f"Failed to fetch data for block number {start_block_number} to {start_block_number + count - 1}: "
+                              f"HTTP {response.status}")
+                return None
+        except (RetryableError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+            if sizer is not None and not isinstance(e, RetryableError):
+                sizer.error(count, str(e) or type(e).__name__)
+            if attempt == retries:
+                logging.error(f"Retry limit reached for block number {start_block_number}: {e or type(e).__name__}")
+                return None
+            retry_after = getattr(e, 'retry_after', None)
+            delay = retry_after if retry_after is not None else backoff_seconds(attempt)
+            logging.warning(f"{e or type(e).__name__} for block number {start_block_number}. Retrying in {delay:.1f} seconds...")
+            await asyncio.sleep(delay)
+
+class PipelineStats:
+    def __init__(self):
+        self.requests = 0
+        self.cache_hits = 0
+        self.blocks_fetched = 0
+        self.bytes_fetched = 0
+        self.requeued_ranges = 0
+        self.failed_ranges = []
+        self.rows_written = 0
+        self.transform_seconds = 0.0
+        self.write_seconds = 0.0
+
+def transform_response(body, stats):
+    start_time = time.perf_counter()
+    df = mev_facts(json.loads(body))
+    stats.transform_seconds += time.perf_counter() - start_time
+    return df
+
+def write_frames(frames, ranges, stats):
+    """
+    Replace the facts of a batch of block ranges, then clear the ranges off the retry table.
+    Replacing rather than appending lets ranges be fetched or replayed again.
+    """
+    start_time = time.perf_counter()
+    df = pd.concat(frames, ignore_index=True) if frames else None
+    replace_facts(engine, df, ranges)
+    clear_failed_ranges(ranges)
+    stats.rows_written += 0 if df is None else len(df)
+    stats.write_seconds += time.perf_counter() - start_time
+
+async def write_responses(queue, stats):
+    """
+    Consumer of the pipeline: aggregates the responses and writes them in batches. Both run in
+    a worker thread, so the fetchers keep going while a batch is being written. Ranges that
+    could not be fetched go to the retry table straight away.
+    """
+    frames, ranges, rows = [], [], 0
+    try:
+        while True:
+            item = await queue.get()
+            if item is None:
+                break
+            start_block_number, count, body = item
+            if body is None:
+                stats.failed_ranges.append((start_block_number, count))
+                await asyncio.to_thread(record_failed_ranges, [(start_block_number, count)])
+                continue
+            df = await asyncio.to_thread(transform_response, body, stats)
+            ranges.append((start_block_number, count))
+            if not df.empty:
+                frames.append(df)
+                rows += len(df)
+            if rows >= WRITE_BATCH_ROWS:
+                batch, frames, ranges, rows = (frames, ranges), [], [], 0
+                await asyncio.to_thread(write_frames, *batch, stats)
+    except asyncio.CancelledError:
+        # Interrupted (Ctrl-C): write what has been aggregated so far, so the next run does not fetch it again
+        if ranges:
+            logging.info(f"Interrupted, writing the {len(ranges)} ranges aggregated so far")
+            write_frames(frames, ranges, stats)
+        raise
+    if ranges:
+        await asyncio.to_thread(write_frames, frames, ranges, stats)
+
+async def fetch_blocks(pending, sizer, base_url, concurrency, rate, retries, cache=None):
+    """
+    Fetch, aggregate and write PendingRanges as a pipeline: `concurrency` fetchers share one
+    keep-alive connection pool and a token bucket of `rate` requests per second, cut requests
+    of the size the BatchSizer currently asks for, and hand the responses to a single writer
+    through a bounded queue. With a ZeromevCache, blocks are read from the cache where possible
+    and every fetched response is stored in it.
+    """
+    queue = asyncio.Queue(maxsize=2 * concurrency)
+    limiter = TokenBucket(rate, burst=concurrency)
+    stats = PipelineStats()
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    timeout = aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=120)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        start_time = time.perf_counter()
+
+        async def fetcher():
+            # The fetchers share one queue of pending blocks
+            while pending:
+                start, size, fixed = pending.peek()
+                if cache is not None:
+                    count, body = (size, cache.read_range(start, size)) if fixed else cache.read_prefix(start, min(size, sizer.maximum))
+                    if body is not None:
+                        pending.take(count)
+                        stats.cache_hits += 1
+                        await queue.put((start, count, body))
+                        continue
+                start, count, fixed = pending.take(sizer.count)
+                body = await fetch_mev_block(session, limiter, base_url, start, count, retries, sizer)
+                stats.requests += 1
+                if body is None and not fixed and count > sizer.count:
+                    # Requests have become smaller since this one was cut; try its blocks again at the current size
+                    pending.put_back(start, count)
+                    stats.requeued_ranges += 1
+                    continue
+                if body is not None:
+                    stats.blocks_fetched += count
+                    stats.bytes_fetched += len(body)
+                    if cache is not None:
+                        cache.put(start, count, body)
+                if stats.requests % 100 == 0:
+                    elapsed = time.perf_counter() - start_time
+                    logging.info(f"Fetched {stats.requests} requests, up to block number {start + count - 1}; "
+                                 f"{sizer.count} blocks per request, {stats.blocks_fetched / elapsed:.0f} blocks/s, "
+                                 f"{stats.bytes_fetched / elapsed / 1e6:.1f} MB/s, {pending.blocks()} blocks to go")
+                await queue.put((start, count, body))
+
+        writer = asyncio.create_task(write_responses(queue, stats))
+        await asyncio.gather(*(fetcher() for _ in range(concurrency)))
+        await queue.put(None)
+        await writer
+    return stats
+
+async def replay_blocks(cache, start_block_number=None, end_block_number=None):
+    """Aggregate and write the cached responses of a block range, without touching the API."""
+    queue = asyncio.Queue(maxsize=16)
+    stats = PipelineStats()
+    writer = asyncio.create_task(write_responses(queue, stats))
+    for start, count, body in cache.iter_responses(start_block_number, end_block_number):
+        stats.cache_hits += 1
+        await queue.put((start, count, body))
+    await queue.put(None)
+    await writer
+    return stats
 
 def main():
+    parser = argparse.ArgumentParser(description="Fetch per-block MEV aggregates from zeromev into zeromev_facts (zeromev_data).")
+    parser.add_argument('--start-block', type=int, help=f"Default {DEFAULT_START_BLOCK} (with --replay: the first cached block)")
+    parser.add_argument('--end-block', type=int, help=f"Default {DEFAULT_END_BLOCK} (with --replay: the last cached block)")
+    parser.add_argument('--blocks-per-request', type=int, default=DEFAULT_BLOCKS_PER_REQUEST, help="Blocks in the first requests")
+    parser.add_argument('--min-blocks', type=int, default=DEFAULT_MIN_BLOCKS, help="Fewest blocks per request")
+    parser.add_argument('--max-blocks', type=int, default=DEFAULT_MAX_BLOCKS,
+                        help="Most blocks per request (--min-blocks = --max-blocks for a fixed size)")
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY, help="Requests in flight")
+    parser.add_argument('--rate', type=float, default=DEFAULT_RATE, help="Requests per second")
+    parser.add_argument('--retries', type=int, default=5, help="Retries per request on 429/5xx and connection errors")
+    parser.add_argument('--base-url', default=ZEROMEV_API, help="zeromev API, e.g. the local zeromev_stub_server.py")
+    parser.add_argument('--cache', default=ZEROMEV_CACHE_PATH, help="SQLite file of the raw response cache")
+    parser.add_argument('--no-cache', action='store_true', help="Neither read nor store raw responses")
+    parser.add_argument('--min-gap', type=int, default=DEFAULT_MIN_GAP,
+                        help="Holes of this many blocks or more in zeromev_data are fetched again")
+    parser.add_argument('--retry-failed', action='store_true', help="Retry every failed range now, ignoring its backoff")
+    parser.add_argument('--replay', action='store_true',
+                        help="Rebuild zeromev_data from the cached responses only (the whole cache unless a range is given)")
+    args = parser.parse_args()
+    if args.replay and args.no_cache:
+        parser.error("--replay needs the cache")
+
+    create_zeromev_table(engine)
     start_time = time.time()  # Start the clock
-    start_block_number = 19220986
-    end_block_number = 19499238
-    blocks_per_request = 100
-    total_blocks = end_block_number - start_block_number + 1
-    steps = total_blocks // blocks_per_request
-
-    for i in range(steps + 1):  # Iterate one extra time if necessary to cover all blocks
-        current_start_block = start_block_number + i * blocks_per_request
-        # Determine the number of blocks to request for the current iteration
-        if i < steps:
-            current_blocks_count = blocks_per_request
-        else:
-            current_blocks_count = total_blocks % blocks_per_request
-
-        if current_blocks_count == 0:
-            break  # If no more blocks to process, exit the loop
-
-        mev_df = get_mev_tx_info(current_start_block, current_blocks_count)
-        if mev_df is not None:
-            logging.info(f"Processing for blocks starting at {current_start_block}")
-            write_to_db(mev_df, engine)
-        else:
-            logging.warning(f"No data processed for blocks starting at {current_start_block}")
-            
+    base_url = args.base_url if args.base_url.endswith('/') else args.base_url + '/'
+    cache = None if args.no_cache else ZeromevCache(args.cache)
+    if args.replay:
+        stats = asyncio.run(replay_blocks(cache, args.start_block, args.end_block))
+    else:
+        start_block_number = args.start_block if args.start_block is not None else DEFAULT_START_BLOCK
+        end_block_number = args.end_block if args.end_block is not None else DEFAULT_END_BLOCK
+        pending = plan_backfill(start_block_number, end_block_number, args.min_gap, args.retry_failed)
+        sizer = BatchSizer(args.blocks_per_request, args.min_blocks, args.max_blocks)
+        stats = asyncio.run(fetch_blocks(pending, sizer, base_url, args.concurrency, args.rate, args.retries, cache))
+        fetch_seconds = time.time() - start_time
+        logging.info(f"Fetched {stats.blocks_fetched} blocks ({stats.bytes_fetched / 1e6:.1f} MB) in {fetch_seconds:.1f}s: "
+                     f"{stats.blocks_fetched / fetch_seconds:.0f} blocks/s; blocks per request (count: requests) "
+                     f"{dict(sorted(sizer.sizes.most_common(8)))}, {stats.requeued_ranges} ranges requeued at a smaller size")
+    if cache is not None:
+        cache.close()
     end_time = time.time()  # End the clock
+
+    for start, count in stats.failed_ranges:
+        logging.warning(f"No data processed for blocks starting at {start} ({count} blocks)")
+    logging.info(f"{stats.requests} requests, {stats.cache_hits} ranges from the cache, {len(stats.failed_ranges)} failed, "
+                 f"{stats.rows_written} facts written; "
+                 f"transform {stats.transform_seconds:.2f}s, database writes {stats.write_seconds:.2f}s")
     logging.info(f"Total execution time: {end_time - start_time:.2f} seconds")  # Log the total execution time
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
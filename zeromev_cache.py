@@ -0,0 +1,184 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import argparse
+import pyarrow as pa
+
+# Local store of raw zeromev mevBlock responses, so that zeromev_data or new per-transaction
+# tables (addresses, arrival times, ...) can be rebuilt without asking the API again (see
+# zeromev.py --replay). Every response is kept zstd-compressed in one SQLite file, keyed by
+# (start_block, count) and indexed by block range, so a request is also answered from several
+# smaller cached responses that together cover its blocks.
+#
+# Usage: python zeromev_cache.py                                     (summary)
+#        python zeromev_cache.py --start-block 19220986 --end-block 19499238   (coverage of a range)
+
+ZEROMEV_CACHE_PATH = os.getenv('ZEROMEV_CACHE', os.path.join(os.getcwd(), 'cache', 'zeromev.sqlite'))
+
+CACHE_COMPRESSION = 'zstd'
+CACHE_COMPRESSION_LEVEL = 9
+
+
+def join_responses(bodies):
+    """Concatenate the JSON arrays of several responses into one JSON array, without parsing them."""
+    items = [body.strip()[1:-1].strip() for body in bodies]
+    return b'[' + b','.join(item for item in items if item) + b']'
+
+
+class ZeromevCache:
+    def __init__(self, path=ZEROMEV_CACHE_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.codec = pa.Codec(CACHE_COMPRESSION, compression_level=CACHE_COMPRESSION_LEVEL)
+        # Autocommit: every response is durable as soon as it is stored, so an interrupted
+        # backfill keeps what it fetched
+        self.db = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                start_block INTEGER NOT NULL,
+                count INTEGER NOT NULL,
+                end_block INTEGER NOT NULL,
+                item_count INTEGER NOT NULL,
+                raw_size INTEGER NOT NULL,
+                body BLOB NOT NULL,
+                fetched_at REAL NOT NULL,
+                PRIMARY KEY (start_block, count)
+            )
+        """)
+        self.db.execute("CREATE INDEX IF NOT EXISTS responses_block_range ON responses (start_block, end_block)")
+
+    def _decompress(self, raw_size, body):
+        return self.codec.decompress(body, decompressed_size=raw_size, asbytes=True)
+
+    def put(self, start_block_number, count, body):
+        """Store the raw response for `count` blocks from start_block_number."""
+        item_count = len(json.loads(body))
+        self.db.execute("""
+            INSERT OR REPLACE INTO responses (start_block, count, end_block, item_count, raw_size, body, fetched_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, (start_block_number, count, start_block_number + count - 1, item_count, len(body),
+              self.codec.compress(body, asbytes=True), time.time()))
+
+    def get(self, start_block_number, count):
+        """The cached response for exactly this request, or None."""
+        row = self.db.execute("SELECT raw_size, body FROM responses WHERE start_block = ? AND count = ?",
+                              (start_block_number, count)).fetchone()
+        return self._decompress(*row) if row else None
+
+    def tiling(self, start_block_number, end_block_number):
+        """
+        (start_block, count) of cached responses that lie inside the block range and do not
+        overlap, in block order. Where responses overlap the longest one that starts first wins.
+        """
+        rows = self.db.execute("""
+            SELECT start_block, count FROM responses
+            WHERE start_block >= ? AND end_block <= ?
+            ORDER BY start_block, count DESC
+        """, (start_block_number, end_block_number)).fetchall()
+        chosen, next_block = [], start_block_number
+        for start, count in rows:
+            if start >= next_block:
+                chosen.append((start, count))
+                next_block = start + count
+        return chosen
+
+    def read_range(self, start_block_number, count):
+        """
+        The response for `count` blocks from start_block_number: the cached response of the
+        same request, or the cached responses that together cover every block. None if some
+        blocks are not cached.
+        """
+        body = self.get(start_block_number, count)
+        if body is not None:
+            return body
+        tiles = self.tiling(start_block_number, start_block_number + count - 1)
+        next_block = start_block_number
+        for start, tile_count in tiles:
+            if start != next_block:
+                return None
+            next_block = start + tile_count
+        if not tiles or next_block != start_block_number + count:
+            return None
+        return join_responses(self.get(start, tile_count) for start, tile_count in tiles)
+
+    def read_prefix(self, start_block_number, max_count):
+        """
+        (count, response) for the longest run of blocks from start_block_number, up to max_count,
+        that cached responses cover; (0, None) if the first block is not cached.
+        """
+        tiles, next_block = [], start_block_number
+        for start, count in self.tiling(start_block_number, start_block_number + max_count - 1):
+            if start != next_block:
+                break
+            tiles.append((start, count))
+            next_block = start + count
+        if not tiles:
+            return 0, None
+        return next_block - start_block_number, join_responses(self.get(start, count) for start, count in tiles)
+
+    def iter_responses(self, start_block_number=None, end_block_number=None):
+        """(start_block, count, body) of the non-overlapping cached responses in a block range, in block order."""
+        if start_block_number is None or end_block_number is None:
+            low, high = self.db.execute("SELECT MIN(start_block), MAX(end_block) FROM responses").fetchone()
+            if low is None:
+                return
+            start_block_number = low if start_block_number is None else start_block_number
+            end_block_number = high if end_block_number is None else end_block_number
+        for start, count in self.tiling(start_block_number, end_block_number):
+            yield start, count, self.get(start, count)
+
+    def iter_items(self, start_block_number=None, end_block_number=None):
+        """Every cached mevBlock item of a block range, for building derived tables offline."""
+        for _, _, body in self.iter_responses(start_block_number, end_block_number):
+            yield from json.loads(body)
+
+    def missing_ranges(self, start_block_number, end_block_number):
+        """(start, count) of the blocks in the range that no cached response covers."""
+        missing, next_block = [], start_block_number
+        for start, count in self.tiling(start_block_number, end_block_number):
+            if start > next_block:
+                missing.append((next_block, start - next_block))
+            next_block = start + count
+        if next_block <= end_block_number:
+            missing.append((next_block, end_block_number - next_block + 1))
+        return missing
+
+    def summary(self):
+        row = self.db.execute("""
+            SELECT COUNT(*), COALESCE(SUM(count), 0), COALESCE(SUM(item_count), 0), COALESCE(SUM(raw_size), 0),
+                   COALESCE(SUM(length(body)), 0), MIN(start_block), MAX(end_block)
+            FROM responses
+        """).fetchone()
+        return dict(zip(('responses', 'blocks', 'items', 'raw_bytes', 'stored_bytes', 'first_block', 'last_block'), row))
+
+    def close(self):
+        self.db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarise the local cache of zeromev responses.")
+    parser.add_argument('--cache', default=ZEROMEV_CACHE_PATH, help="SQLite file of the cache")
+    parser.add_argument('--start-block', type=int, help="Report the uncached blocks from here...")
+    parser.add_argument('--end-block', type=int, help="...to here, inclusive")
+    args = parser.parse_args()
+
+    cache = ZeromevCache(args.cache)
+    summary = cache.summary()
+    print(f"{summary['responses']} responses for {summary['blocks']} blocks ({summary['items']} transactions), "
+          f"blocks {summary['first_block']} to {summary['last_block']}, in {args.cache}: "
+          f"{summary['stored_bytes'] / 1e6:.1f} MB zstd for {summary['raw_bytes'] / 1e6:.1f} MB of JSON")
+    if args.start_block is not None and args.end_block is not None:
+        missing = cache.missing_ranges(args.start_block, args.end_block)
+        print(f"Blocks {args.start_block} to {args.end_block}: {sum(count for _, count in missing)} not cached "
+              f"in {len(missing)} ranges")
+        for start, count in missing[:20]:
+            print(f"  {start} to {start + count - 1}")
+    cache.close()
+
+
+if __name__ == '__main__':
+    main()
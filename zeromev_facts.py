@@ -0,0 +1,251 @@
+import logging
+import numpy as np
+import pandas as pd
+from sqlalchemy import Column, Table, MetaData, VARCHAR, NUMERIC, SMALLINT, INTEGER, BIGINT, inspect, text
+from sqlalchemy.dialects.postgresql import DOUBLE_PRECISION
+from bulk_loader import copy_frames
+
+# Storage of the zeromev data in long format: one row per block, mev_type and protocol with the
+# transaction count and the user swap volume and extractor profit sums, so that a new mev_type
+# or protocol is just another row. mev types and protocols are stored as smallint ids from the
+# zeromev_mev_types and zeromev_protocols lookup tables, and amounts of 0 as NULL, so a fact
+# row is little more than its header.
+#
+# zeromev_data keeps the wide columns the analysis scripts use. It is a table, not a view:
+# replace_facts pivots the facts of the block ranges it writes into it in the same transaction,
+# so it is refreshed incrementally and always matches the facts. blocknative_zeromev, which the
+# plots read, is refreshed from it by combine_blocknative_zeromev.py using the
+# zeromev_changed_ranges log, which it empties. zeromev_fetched_ranges keeps every block range
+# that was written for good, including blocks without MEV transactions, which have no rows.
+# Rows of zeromev_data written before the facts existed stay as they are until their blocks
+# are fetched or replayed again.
+
+facts_table_name = 'zeromev_facts'
+mev_types_table_name = 'zeromev_mev_types'
+protocols_table_name = 'zeromev_protocols'
+changed_ranges_table_name = 'zeromev_changed_ranges'
+fetched_ranges_table_name = 'zeromev_fetched_ranges'
+wide_table_name = 'zeromev_data'
+
+# The columns of the wide zeromev_data, in their original order
+WIDE_PROTOCOLS = ['multiple', 'aave', 'balancer1', 'bancor', 'compoundv2', 'curve', 'uniswap2', 'uniswap3', 'zerox', 'unknown']
+WIDE_MEV_TYPES = ['arb', 'frontrun', 'sandwich', 'backrun', 'liquid', 'swap']
+
+metadata = MetaData()
+
+mev_types_table = Table(mev_types_table_name, metadata,
+    Column('id', SMALLINT, primary_key=True, autoincrement=True),
+    Column('name', VARCHAR(32), nullable=False, unique=True),
+    )
+
+protocols_table = Table(protocols_table_name, metadata,
+    Column('id', SMALLINT, primary_key=True, autoincrement=True),
+    Column('name', VARCHAR(32), nullable=False, unique=True),
+    )
+
+# The amounts come last and are NULL when 0, which costs no space
+facts_table = Table(facts_table_name, metadata,
+    Column('block_number', INTEGER, primary_key=True),
+    Column('mev_type_id', SMALLINT, primary_key=True),
+    Column('protocol_id', SMALLINT, primary_key=True),
+    Column('tx_count', INTEGER, nullable=False),
+    Column('user_swap_volume', DOUBLE_PRECISION),
+    Column('extractor_profit', DOUBLE_PRECISION),
+    )
+
+wide_table = Table(wide_table_name, metadata,
+    Column('block_number', NUMERIC(18), primary_key=True),
+    Column('total_user_swap_volume', NUMERIC),
+    Column('total_extractor_profit', NUMERIC),
+    *[Column(f"{protocol}_count", INTEGER) for protocol in WIDE_PROTOCOLS],
+    *[Column(f"{mev_type}_extractor_profit", NUMERIC) for mev_type in WIDE_MEV_TYPES],
+    *[Column(f"{mev_type}_user_swap_volume", NUMERIC) for mev_type in WIDE_MEV_TYPES],
+    *[Column(f"{mev_type}_count", INTEGER) for mev_type in WIDE_MEV_TYPES],
+    )
+
+# Block ranges whose facts were replaced since blocknative_zeromev was last refreshed
+changed_ranges_table = Table(changed_ranges_table_name, metadata,
+    Column('start_block', BIGINT, nullable=False),
+    Column('block_count', INTEGER, nullable=False),
+    )
+
+# Every block range whose facts were written; adjacent ranges of a batch are merged
+fetched_ranges_table = Table(fetched_ranges_table_name, metadata,
+    Column('start_block', BIGINT, nullable=False, index=True),
+    Column('block_count', INTEGER, nullable=False),
+    )
+
+
+def mev_facts(data):
+    """
+    Long-format facts of a mevBlock response: one row per block, mev_type and protocol with
+    the number of transactions and the sums of user_swap_volume_usd and extractor_profit_usd.
+    A missing or null protocol counts as 'unknown', a missing or null amount as 0.
+    """
+    if not data:
+        return pd.DataFrame(columns=['block_number', 'mev_type', 'protocol', 'tx_count', 'user_swap_volume', 'extractor_profit'])
+    blocks, block_index = np.unique([item['block_number'] for item in data], return_inverse=True)
+    mev_types, type_index = np.unique([item['mev_type'] for item in data], return_inverse=True)
+    protocols, protocol_index = np.unique([item.get('protocol') or 'unknown' for item in data], return_inverse=True)
+    # One bincount per measure over the (block, mev_type, protocol) cells that occur
+    cells, cell_index = np.unique((block_index * len(mev_types) + type_index) * len(protocols) + protocol_index,
+                                  return_inverse=True)
+    user_swap_volume = np.array([item.get('user_swap_volume_usd') or 0 for item in data], dtype=float)
+    extractor_profit = np.array([item.get('extractor_profit_usd') or 0 for item in data], dtype=float)
+    return pd.DataFrame({
+        'block_number': blocks[cells // (len(mev_types) * len(protocols))],
+        'mev_type': mev_types[cells // len(protocols) % len(mev_types)],
+        'protocol': protocols[cells % len(protocols)],
+        'tx_count': np.bincount(cell_index, minlength=len(cells)),
+        'user_swap_volume': np.bincount(cell_index, weights=user_swap_volume, minlength=len(cells)),
+        'extractor_profit': np.bincount(cell_index, weights=extractor_profit, minlength=len(cells)),
+    })
+
+
+def wide_columns_sql():
+    """The select list that pivots zeromev_facts f, joined to its mev types t and protocols p, into the wide columns."""
+    columns = ["CAST(f.block_number AS NUMERIC(18)) AS block_number",
+               "CAST(COALESCE(SUM(f.user_swap_volume), 0) AS NUMERIC) AS total_user_swap_volume",
+               "CAST(COALESCE(SUM(f.extractor_profit), 0) AS NUMERIC) AS total_extractor_profit"]
+    columns += [f"CAST(COALESCE(SUM(f.tx_count) FILTER (WHERE p.name = '{protocol}'), 0) AS INTEGER) AS {protocol}_count"
+                for protocol in WIDE_PROTOCOLS]
+    for measure in ('extractor_profit', 'user_swap_volume'):
+        columns += [f"CAST(COALESCE(SUM(f.{measure}) FILTER (WHERE t.name = '{mev_type}'), 0) AS NUMERIC) AS {mev_type}_{measure}"
+                    for mev_type in WIDE_MEV_TYPES]
+    columns += [f"CAST(COALESCE(SUM(f.tx_count) FILTER (WHERE t.name = '{mev_type}'), 0) AS INTEGER) AS {mev_type}_count"
+                for mev_type in WIDE_MEV_TYPES]
+    return ',\n    '.join(columns)
+
+
+def wide_column_names():
+    return [column.name for column in wide_table.columns]
+
+
+def wide_rows_sql(where):
+    """INSERT of the pivoted facts of the blocks matching `where` into zeromev_data."""
+    return (f"INSERT INTO {wide_table_name} ({', '.join(wide_column_names())})\n"
+            f"SELECT\n    {wide_columns_sql()}\n"
+            f"FROM {facts_table_name} f\n"
+            f"JOIN {mev_types_table_name} t ON t.id = f.mev_type_id\n"
+            f"JOIN {protocols_table_name} p ON p.id = f.protocol_id\n"
+            f"WHERE {where}\n"
+            f"GROUP BY f.block_number")
+
+
+def migrate_views(connection, tables, views):
+    """
+    Back from the first version of the facts: zeromev_data was a view over zeromev_facts, which
+    kept the names as VARCHAR and the zero amounts, and zeromev_data_legacy held the old table.
+    """
+    named_facts = None
+    if facts_table_name in tables and 'mev_type' in {column['name'] for column in inspect(connection).get_columns(facts_table_name)}:
+        named_facts = f"{facts_table_name}_named"
+        connection.execute(text(f"ALTER TABLE {facts_table_name} RENAME TO {named_facts}"))
+        connection.execute(text(f"ALTER INDEX IF EXISTS {facts_table_name}_pkey RENAME TO {named_facts}_pkey"))
+    for view in ('zeromev_blocks', wide_table_name):
+        if view in views:
+            connection.execute(text(f"DROP VIEW {view}"))
+    if 'zeromev_data_legacy' in tables:
+        connection.execute(text(f"ALTER TABLE zeromev_data_legacy RENAME TO {wide_table_name}"))
+
+    metadata.create_all(connection)
+    if named_facts is not None:
+        for table_name, column in ((mev_types_table_name, 'mev_type'), (protocols_table_name, 'protocol')):
+            connection.execute(text(f"INSERT INTO {table_name} (name) SELECT DISTINCT {column} FROM {named_facts} ORDER BY 1"))
+        connection.execute(text(f"""
+            INSERT INTO {facts_table_name}
+            SELECT f.block_number, t.id, p.id, f.tx_count, NULLIF(f.user_swap_volume, 0), NULLIF(f.extractor_profit, 0)
+            FROM {named_facts} f
+            JOIN {mev_types_table_name} t ON t.name = f.mev_type
+            JOIN {protocols_table_name} p ON p.name = f.protocol
+        """))
+        connection.execute(text(f"DROP TABLE {named_facts}"))
+        # Blocks with facts were served from the facts, not from the legacy rows
+        connection.execute(text(f"DELETE FROM {wide_table_name} WHERE block_number IN (SELECT block_number FROM {facts_table_name})"))
+        connection.execute(text(wide_rows_sql('TRUE')))
+        logging.info(f"Moved {facts_table_name} to smallint ids and {wide_table_name} back to a table")
+
+
+def create_zeromev_facts(engine):
+    """Create the fact, lookup and zeromev_data tables and the change log."""
+    with engine.begin() as connection:
+        inspector = inspect(connection)
+        tables, views = set(inspector.get_table_names()), set(inspector.get_view_names())
+        if wide_table_name in views:
+            migrate_views(connection, tables, views)
+        metadata.create_all(connection)
+    logging.info(f"Tables {facts_table_name}, {wide_table_name} and their lookup tables have been created/ensured in the database")
+
+
+def category_ids(cursor, table_name, names):
+    """{name: id} of the names in a lookup table; names seen for the first time are added."""
+    # Only new names are inserted, so no sequence value is spent on a name that exists
+    cursor.execute(f"""
+        INSERT INTO {table_name} (name)
+        SELECT names.name FROM unnest(%s::varchar[]) AS names(name)
+        WHERE NOT EXISTS (SELECT 1 FROM {table_name} known WHERE known.name = names.name)
+        ON CONFLICT (name) DO NOTHING
+    """, (names,))
+    cursor.execute(f"SELECT name, id FROM {table_name} WHERE name = ANY(%s)", (names,))
+    return dict(cursor.fetchall())
+
+
+def fact_rows(cursor, df):
+    """The columns of zeromev_facts for a frame of mev_facts: ids for the names, NULL for 0 amounts."""
+    mev_type_ids = category_ids(cursor, mev_types_table_name, df['mev_type'].unique().tolist())
+    protocol_ids = category_ids(cursor, protocols_table_name, df['protocol'].unique().tolist())
+    return pd.DataFrame({
+        'block_number': df['block_number'],
+        'mev_type_id': df['mev_type'].map(mev_type_ids),
+        'protocol_id': df['protocol'].map(protocol_ids),
+        'tx_count': df['tx_count'],
+        'user_swap_volume': df['user_swap_volume'].where(df['user_swap_volume'] != 0),
+        'extractor_profit': df['extractor_profit'].where(df['extractor_profit'] != 0),
+    })
+
+
+def merged_ranges(ranges):
+    """Sorted (start, count) ranges with overlapping and adjacent ones merged."""
+    merged = []
+    for start, count in sorted(ranges):
+        if merged and start <= merged[-1][0] + merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], start + count - merged[-1][0]))
+        else:
+            merged.append((start, count))
+    return merged
+
+
+def replace_facts(engine, df, ranges):
+    """
+    Replace the facts and the zeromev_data rows of the (start, count) block ranges with df and
+    log the ranges as fetched and for the next blocknative_zeromev refresh, in one transaction.
+    Returns the number of facts written.
+    """
+    if not ranges:
+        return 0
+    starts, counts = [start for start, _ in ranges], [count for _, count in ranges]
+    # The bounds let both statements use the block_number index before the ranges are checked
+    in_ranges = (f"{{table}}.block_number BETWEEN %(first)s AND %(last)s AND EXISTS ("
+                 f"SELECT 1 FROM unnest(%(starts)s::bigint[], %(counts)s::int[]) AS ranges(start_block, block_count) "
+                 f"WHERE {{table}}.block_number >= ranges.start_block AND {{table}}.block_number < ranges.start_block + ranges.block_count)")
+    params = {'first': min(starts), 'last': max(start + count - 1 for start, count in ranges), 'starts': starts, 'counts': counts}
+    connection = engine.raw_connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {facts_table_name} WHERE {in_ranges.format(table=facts_table_name)}", params)
+            rows = copy_frames(cursor, [fact_rows(cursor, df)], facts_table_name) if df is not None and not df.empty else 0
+            cursor.execute(f"DELETE FROM {wide_table_name} WHERE {in_ranges.format(table=wide_table_name)}", params)
+            cursor.execute(wide_rows_sql(in_ranges.format(table='f')), params)
+            cursor.execute(f"INSERT INTO {changed_ranges_table_name} (start_block, block_count) SELECT * FROM unnest(%s::bigint[], %s::int[])",
+                           (starts, counts))
+            fetched = merged_ranges(ranges)
+            cursor.execute(f"INSERT INTO {fetched_ranges_table_name} (start_block, block_count) SELECT * FROM unnest(%s::bigint[], %s::int[])",
+                           ([start for start, _ in fetched], [count for _, count in fetched]))
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        connection.close()
+    logging.info(f"Wrote {rows} facts for {len(ranges)} block ranges")
+    return rows
@@ -0,0 +1,118 @@
+import json
+import time
+import random
+import asyncio
+import logging
+import argparse
+from aiohttp import web
+
+# Local stand-in for data.zeromev.org, to measure zeromev.py and exercise its retries and rate
+# limiting offline. /v1/mevBlock?block_number=N&count=C returns synthetic MEV transactions in the
+# format of the real API; the same block always gets the same transactions.
+#
+# Usage: python zeromev_stub_server.py --port 8090 --latency 0.2 --rate-limit 20
+#        python zeromev.py --base-url http://localhost:8090/v1/
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+MEV_TYPES = ['swap', 'swap', 'swap', 'arb', 'frontrun', 'backrun', 'sandwich', 'liquid']
+PROTOCOLS = ['uniswap2', 'uniswap3', 'multiple', 'curve', 'zerox', 'balancer1', 'bancor', 'compoundv2', 'aave', 'unknown']
+MAX_COUNT = 1000
+
+
+def synthetic_block(block_number):
+    """MEV transactions of one block; about one block in ten has none."""
+    rng = random.Random(block_number)
+    items = []
+    for tx_index in sorted(rng.sample(range(300), rng.choice([0, 1, 2, 3, 5, 8, 13]))):
+        mev_type = rng.choice(MEV_TYPES)
+        item = {
+            'block_number': block_number,
+            'tx_index': tx_index,
+            'mev_type': mev_type,
+            'protocol': rng.choice(PROTOCOLS),
+            'user_loss_usd': round(rng.uniform(0, 50), 2) if mev_type == 'swap' and rng.random() < 0.2 else None,
+            'user_swap_volume_usd': round(rng.lognormvariate(6, 2), 2) if rng.random() < 0.9 else None,
+            'user_swap_count': rng.randint(0, 3),
+            'extractor_swap_volume_usd': round(rng.lognormvariate(7, 2), 2) if mev_type != 'swap' else None,
+            'extractor_swap_count': rng.randint(1, 4) if mev_type != 'swap' else 0,
+            'extractor_profit_usd': round(rng.uniform(-20, 500), 2) if mev_type != 'swap' else None,
+            'imbalance': None,
+            'address_from': '0x%040x' % rng.getrandbits(160),
+            'address_to': '0x%040x' % rng.getrandbits(160),
+            'arrival_time_us': f"2024-03-01T12:00:{rng.randint(0, 59):02d}.{rng.randint(0, 999):03d}Z",
+            'arrival_time_eu': None,
+            'arrival_time_as': None,
+        }
+        # Older responses leave out the protocol of some transactions
+        if rng.random() < 0.05:
+            del item['protocol']
+        items.append(item)
+    return items
+
+
+class ZeromevStub:
+    def __init__(self, latency, error_rate, rate_limit, bandwidth=0):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.window_start = time.monotonic()
+        self.window_requests = 0
+        self.stats = {'requests': 0, 'errors': 0, 'rate_limited': 0, 'blocks': 0}
+
+    def over_rate_limit(self):
+        """Requests per one-second window, like a simple API gateway."""
+        now = time.monotonic()
+        if now - self.window_start >= 1:
+            self.window_start, self.window_requests = now, 0
+        self.window_requests += 1
+        return self.rate_limit and self.window_requests > self.rate_limit
+
+    async def handle_mev_block(self, request):
+        self.stats['requests'] += 1
+        if self.over_rate_limit():
+            self.stats['rate_limited'] += 1
+            return web.Response(status=429, headers={'Retry-After': '1'})
+        await asyncio.sleep(self.latency)
+        if random.random() < self.error_rate:
+            self.stats['errors'] += 1
+            return web.Response(status=random.choice([500, 503]))
+        try:
+            block_number = int(request.query['block_number'])
+            count = int(request.query.get('count', 1))
+        except (KeyError, ValueError):
+            raise web.HTTPBadRequest(text='block_number and count must be integers')
+        if not 0 < count <= MAX_COUNT:
+            raise web.HTTPBadRequest(text=f'count must be between 1 and {MAX_COUNT}')
+        self.stats['blocks'] += count
+        items = [item for number in range(block_number, block_number + count) for item in synthetic_block(number)]
+        body = json.dumps(items).encode()
+        if self.bandwidth:
+            # Big responses take longer, as they do on the real API
+            await asyncio.sleep(len(body) / (self.bandwidth * 1e6))
+        return web.Response(body=body, content_type='application/json')
+
+    async def handle_stats(self, request):
+        return web.json_response(self.stats)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the zeromev API.")
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--latency', type=float, default=0.2, help="Seconds before each response")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Share of requests answered with 500/503")
+    parser.add_argument('--rate-limit', type=int, default=0, help="Requests per second before answering 429, 0 for none")
+    parser.add_argument('--bandwidth', type=float, default=0, help="MB per second and response, 0 for unlimited")
+    args = parser.parse_args()
+
+    stub = ZeromevStub(args.latency, args.error_rate, args.rate_limit, args.bandwidth)
+    app = web.Application()
+    app.router.add_get('/v1/mevBlock', stub.handle_mev_block)
+    app.router.add_get('/stats', stub.handle_stats)
+    logging.info(f"Serving synthetic zeromev data on port {args.port}")
+    web.run_app(app, port=args.port)
+
+
+if __name__ == '__main__':
+    main()